@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+"""Compares the per-document dispatch cost of the pypes execution backends.
+
+A linear chain of pass-through components is built and documents are
+sent through it one at a time. The time per document per hop is
+reported for every backend that can be loaded in this interpreter.
+With -p the chain is built from components implementing process()
+instead, run once with the chain fused into a single stage and once
+with a stage per component.
+
+    $ python BackendBenchmark.py -d 20000 -c 10
+    $ python BackendBenchmark.py -p
+"""
+
+import sys
+import time
+from optparse import OptionParser
+
+from pypes.component import Component
+from pypes.scheduler import Scheduler
+from pypes.backend import BACKENDS, BackendError, get_backend
+
+class Source(Component):
+    __metatype__ = 'ADAPTER'
+
+    def run(self):
+        while True:
+            for data in self.receive_all('in'):
+                self.send('out', data)
+            self.yield_ctrl()
+
+class Hop(Component):
+    __metatype__ = 'TRANSFORMER'
+
+    def run(self):
+        while True:
+            for data in self.receive_all('in'):
+                self.send('out', data)
+            self.yield_ctrl()
+
+class Sink(Component):
+    __metatype__ = 'PUBLISHER'
+
+    def __init__(self):
+        Component.__init__(self)
+        self.remove_output('out')
+        self.count = 0
+
+    def run(self):
+        while True:
+            for data in self.receive_all('in'):
+                self.count += 1
+            self.yield_ctrl()
+
+# generator style versions of the same components
+class GenSource(Source):
+    def run(self):
+        while True:
+            for data in self.receive_all('in'):
+                self.send('out', data)
+            yield
+
+class GenHop(Hop):
+    def run(self):
+        while True:
+            for data in self.receive_all('in'):
+                self.send('out', data)
+            yield
+
+class GenSink(Sink):
+    def run(self):
+        while True:
+            for data in self.receive_all('in'):
+                self.count += 1
+            yield
+
+# process() style versions, run by the stages of compiled graphs
+class ProcSource(Source):
+    def process(self, docs):
+        return docs
+
+class ProcHop(Hop):
+    def process(self, docs):
+        return docs
+
+class ProcSink(Sink):
+    def process(self, docs):
+        self.count += len(docs)
+        return []
+
+def build(backend, hops, proc=False):
+    if proc:
+        source, hop, sink = ProcSource, ProcHop, ProcSink
+    elif backend == 'generator':
+        source, hop, sink = GenSource, GenHop, GenSink
+    else:
+        source, hop, sink = Source, Hop, Sink
+
+    nodes = [source()] + [hop() for i in range(hops)] + [sink()]
+    graph = {}
+    for n1, n2 in zip(nodes, nodes[1:]):
+        graph[n1] = {n2: ('out', 'in')}
+    return graph, nodes[-1]
+
+def bench(backend, docs, hops, proc=False, fuse=True):
+    graph, sink = build(backend, hops, proc)
+    s = Scheduler(graph, backend=get_backend(backend), fuse=fuse)
+
+    start = time.time()
+    for i in xrange(docs):
+        s.send(i)
+    elapsed = time.time() - start
+
+    assert sink.count == docs
+    return elapsed, s.get_wakeup_stats()
+
+if __name__ == '__main__':
+    parser = OptionParser()
+    parser.add_option('-d', '--docs', type='int', default=20000,
+                      help='number of documents to send')
+    parser.add_option('-c', '--chain', type='int', default=10,
+                      help='number of pass-through components in the chain')
+    parser.add_option('-p', '--process', action='store_true', default=False,
+                      help='use process() components, fused and unfused')
+    options, args = parser.parse_args()
+
+    hops = options.chain + 1
+    print '%d documents, %d hops' % (options.docs, hops)
+    print '%-16s %10s %12s %10s %12s' % ('backend', 'seconds', 'usec/doc/hop',
+                                         'wakeups', 'idle wakeups')
+    if options.process:
+        runs = [(True, ' fused'), (False, '')]
+    else:
+        runs = [(True, '')]
+    for name in BACKENDS:
+        try:
+            get_backend(name)
+        except BackendError, e:
+            print '%-16s %s' % (name, e)
+            continue
+
+        for fuse, suffix in runs:
+            elapsed, stats = bench(name, options.docs, options.chain,
+                                   options.process, fuse)
+            print '%-16s %10.3f %12.2f %10d %12d' % (name + suffix, elapsed,
+                                elapsed * 1e6 / (options.docs * hops),
+                                stats['wakeups'], stats['idle_wakeups'])
+    sys.exit(0)
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+"""Measures the throughput of a L{Dataflow} pool at several pool sizes.
+
+Documents are sent into a pool of instances running a short chain
+of components. Each document costs a fixed amount of CPU time in
+the chain. The number of documents completed per second is reported
+for pools of 1, 2, 4 and 8 instances.
+
+    $ python DataflowBenchmark.py -d 20000 -w 200 -b greenlet
+
+Use -B to enable batching and compare the cost of the queue
+with and without it (small -w values make the queue dominate).
+
+Use -s to run a L{StagedDataflow} instead, where only the work
+component is replicated and the source and sink run in one process
+each.
+"""
+
+import sys
+import time
+from optparse import OptionParser
+from multiprocessing import Value
+
+from pypes.component import Component
+from pypes.pipeline import Dataflow, StagedDataflow
+
+class Source(Component):
+    __metatype__ = 'ADAPTER'
+
+    def run(self):
+        while True:
+            for data in self.receive_all('in'):
+                self.send('out', data)
+            self.yield_ctrl()
+
+class Work(Component):
+    __metatype__ = 'TRANSFORMER'
+
+    def __init__(self, cost):
+        Component.__init__(self)
+        self.cost = cost
+
+    def work(self, data):
+        x = data
+        for i in xrange(self.cost):
+            x = (x * 31 + i) & 0xffff
+        return x
+
+    def run(self):
+        while True:
+            for data in self.receive_all('in'):
+                self.send('out', self.work(data))
+            self.yield_ctrl()
+
+class Sink(Component):
+    __metatype__ = 'PUBLISHER'
+
+    def __init__(self, done):
+        Component.__init__(self)
+        self.remove_output('out')
+        self.done = done
+
+    def run(self):
+        while True:
+            for data in self.receive_all('in'):
+                with self.done.get_lock():
+                    self.done.value += 1
+            self.yield_ctrl()
+
+# generator style versions of the same components
+class GenSource(Source):
+    def run(self):
+        while True:
+            for data in self.receive_all('in'):
+                self.send('out', data)
+            yield
+
+class GenWork(Work):
+    def run(self):
+        while True:
+            for data in self.receive_all('in'):
+                self.send('out', self.work(data))
+            yield
+
+class GenSink(Sink):
+    def run(self):
+        while True:
+            for data in self.receive_all('in'):
+                with self.done.get_lock():
+                    self.done.value += 1
+            yield
+
+def build(backend, cost, done):
+    if backend == 'generator':
+        source, work, sink = GenSource, GenWork, GenSink
+    else:
+        source, work, sink = Source, Work, Sink
+
+    s, w, p = source(), work(cost), sink(done)
+    return {s: {w: ('out', 'in')},
+            w: {p: ('out', 'in')}}
+
+def bench(workers, docs, cost, backend, batch_size=None, staged=False):
+    done = Value('l', 0)
+    graph = build(backend, cost, done)
+    if staged:
+        work = [n for n in graph if isinstance(n, Work)][0]
+        flow = StagedDataflow(graph, {work: workers}, backend=backend,
+                                                    batch_size=batch_size)
+    else:
+        flow = Dataflow(graph, workers, backend=backend,
+                                                    batch_size=batch_size)
+
+    start = time.time()
+    for i in xrange(docs):
+        flow.send(i)
+    flow.flush()
+    while done.value < docs:
+        time.sleep(0.001)
+    elapsed = time.time() - start
+
+    flow.close()
+    for p in flow.processes:
+        p.process.join()
+    return elapsed
+
+if __name__ == '__main__':
+    parser = OptionParser()
+    parser.add_option('-d', '--docs', type='int', default=20000,
+                      help='number of documents to send')
+    parser.add_option('-w', '--work', type='int', default=200,
+                      help='loop iterations of CPU work per document')
+    parser.add_option('-b', '--backend', default=None,
+                      help='execution backend (stackless, greenlet, generator)')
+    parser.add_option('-B', '--batch', type='int', default=None,
+                      help='send documents in batches of this size')
+    parser.add_option('-s', '--staged', action='store_true', default=False,
+                      help='replicate only the work stage (StagedDataflow)')
+    options, args = parser.parse_args()
+
+    print '%d documents, %d iterations of work each' % (options.docs,
+                                                        options.work)
+    print '%-8s %10s %12s' % ('workers', 'seconds', 'packets/sec')
+    for workers in (1, 2, 4, 8):
+        elapsed = bench(workers, options.docs, options.work, options.backend,
+                        options.batch, options.staged)
+        print '%-8d %10.3f %12.0f' % (workers, elapsed,
+                                      options.docs / elapsed)
+    sys.exit(0)
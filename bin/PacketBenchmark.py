@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+"""Measures the cost of common L{Packet} operations.
+
+Each benchmark builds packets shaped like the documents the studio
+handles and times one operation over many of them (or measures the
+memory they use).
+
+    $ python PacketBenchmark.py -n 10000 -f 20
+    $ python PacketBenchmark.py -t clone -t memory
+"""
+
+import gc
+import sys
+import time
+import cPickle
+from optparse import OptionParser
+
+from pypesvds.lib.packet import Packet, CompactPacket
+from pypesvds.lib.packetbatch import PacketBatch
+
+class DictPacket(Packet):
+    """A packet pickled through its instance dictionary as before"""
+
+    def __getstate__(self):
+        return self.__dict__
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+def make_packet(fields, values=1, size=32, cls=Packet):
+    """Returns a packet with the given number of fields.
+
+    Every fourth field is multivalued and carries the given number
+    of values. Packet and attribute metadata is set as the adapters do.
+    """
+    doc = cls()
+    for i in range(fields):
+        name = 'field%d' % i
+        if values > 1 and i % 4 == 0:
+            doc.set(name, [('%d' % j).ljust(size, 'v') \
+                                        for j in range(values)], multi=True)
+        else:
+            doc.set(name, ('%d' % i).ljust(size, 'v'))
+        doc.set_meta('source', 'bench', name)
+    doc.set_meta('mimetype', 'text/csv')
+    doc.set_meta('id', 'bench')
+    return doc
+
+def timeit(func, n):
+    """Returns the time per call in microseconds.
+
+    The garbage collector is disabled while timing, as the timeit
+    module does, so earlier benchmarks do not slow down later ones.
+    """
+    gc.collect()
+    gc.disable()
+    try:
+        start = time.time()
+        for i in xrange(n):
+            func()
+        return (time.time() - start) * 1e6 / n
+    finally:
+        gc.enable()
+
+def sizeof(obj, seen):
+    """Returns the memory used by an object and everything it refers to.
+
+    Objects already in seen are not counted again so objects shared by
+    many packets (such as interned names) are only counted once.
+    """
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for k, v in obj.iteritems():
+            size += sizeof(k, seen) + sizeof(v, seen)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for item in obj:
+            size += sizeof(item, seen)
+    elif hasattr(obj, '__dict__'):
+        size += sizeof(obj.__dict__, seen)
+    elif hasattr(obj, '__slots__'):
+        for slot in obj.__slots__:
+            size += sizeof(getattr(obj, slot, None), seen)
+    return size
+
+def bench_clone(options):
+    """clone (copy-on-write) vs deep_clone, and a write to the clone"""
+    doc = make_packet(options.fields, options.values, options.size)
+
+    def deep():
+        doc.deep_clone().append('field0', 'x')
+
+    def cow():
+        doc.clone().append('field0', 'x')
+
+    results = []
+    for name, func in (('deep_clone', deep), ('clone', cow)):
+        results.append((name, timeit(func, options.number), 'usec/op'))
+    return results
+
+def bench_views(options):
+    """copying accessors vs read-only views, and merge and == using them"""
+    doc = make_packet(options.fields, options.values, options.size)
+    other = doc.clone()
+
+    def merge():
+        doc.clone().merge(other, metas=True)
+
+    results = []
+    for name, func in (('get_attributes', doc.get_attributes),
+                       ('view_attributes', doc.view_attributes),
+                       ('get_metas', doc.get_metas),
+                       ('view_metas', doc.view_metas),
+                       ('merge', merge),
+                       ('==', lambda: doc == other)):
+        results.append((name, timeit(func, options.number), 'usec/op'))
+    return results
+
+def serialize(fields):
+    """Writes fields the way the Solr publisher does"""
+    buf = []
+    for key, vals in fields:
+        for val in vals:
+            buf.append('\t<field name="%s"><![CDATA[%s]]></field>' % (key, val))
+    return '\n'.join(buf)
+
+def bench_iterate(options):
+    """sorted vs unsorted iteration and serialization (try -f 250)"""
+    doc = make_packet(options.fields, options.values, options.size)
+
+    def walk(fields):
+        for key, vals in fields:
+            pass
+
+    results = []
+    for name, func in (('iter (sorted)', lambda: walk(doc)),
+                       ('iteritems', lambda: walk(doc.iteritems())),
+                       ('serialize (sorted)', lambda: serialize(doc)),
+                       ('serialize', lambda: serialize(doc.iteritems()))):
+        results.append((name, timeit(func, options.number), 'usec/op'))
+    return results
+
+def bench_pickle(options):
+    """pickling through the instance dict vs the packet wire format"""
+    results = []
+    for cls in (DictPacket, Packet, CompactPacket):
+        doc = make_packet(options.fields, options.values, options.size, cls)
+        data = cPickle.dumps(doc, cPickle.HIGHEST_PROTOCOL)
+        name = cls.__name__
+        results.append(('%s size' % name, len(data), 'bytes'))
+        results.append(('%s dumps' % name, timeit(lambda: cPickle.dumps(doc,
+                            cPickle.HIGHEST_PROTOCOL), options.number), 'usec/op'))
+        results.append(('%s loads' % name, timeit(lambda: cPickle.loads(data),
+                                                options.number), 'usec/op'))
+    return results
+
+def bench_batch(options):
+    """per document vs column-wise (PacketBatch) transformers, per document"""
+    fields = ['field%d' % i for i in range(0, options.fields, 2)]
+    docs = [make_packet(options.fields, options.values, options.size) \
+                                                    for i in range(100)]
+
+    def lower_docs():
+        # as CaseNormalizer did before PacketBatch
+        for doc in docs:
+            for field in fields:
+                value = doc.get(field)
+                if value is not None:
+                    if doc.is_multivalued(field):
+                        doc.set(field, [v.lower() for v in value], multi=True)
+                    else:
+                        doc.set(field, value.lower())
+
+    def lower_batch():
+        batch = PacketBatch(docs)
+        for field in fields:
+            batch.set_column(field, [vals if vals is None else \
+                [v.lower() for v in vals] for vals in batch.get_column(field)])
+        batch.to_packets()
+
+    def delete_docs():
+        for doc in docs:
+            for field in fields:
+                doc.delete(field)
+
+    def delete_batch():
+        batch = PacketBatch(docs)
+        for field in fields:
+            batch.delete_column(field)
+        batch.to_packets()
+
+    number = max(options.number / len(docs), 1)
+    results = []
+    for name, func in (('normalize', lower_docs),
+                       ('normalize (batch)', lower_batch)):
+        results.append((name, timeit(func, number) / len(docs), 'usec/doc'))
+
+    # deleting is only timed on the first pass, later passes find nothing
+    for name, func in (('delete', delete_docs),
+                       ('delete (batch)', delete_batch)):
+        docs = [make_packet(options.fields, options.values, options.size) \
+                                                    for i in range(2000)]
+        results.append((name, timeit(func, 1) / len(docs), 'usec/doc'))
+    return results
+
+def csv_rows(cls, rows, columns):
+    """Builds packets the way the CSV reader does for each row"""
+    template = cls()
+    packets = []
+    for r in xrange(rows):
+        document = template.clone(metas=False)
+        for idx in range(columns):
+            document.set('column%d' % (idx + 1), u'value %d.%d' % (r, idx))
+        document.set_meta('column_count', columns)
+        packets.append(document)
+    return packets
+
+def bench_memory(options):
+    """memory per packet for CSV rows (-f columns per row)"""
+    results = []
+    for cls in (Packet, CompactPacket):
+        packets = csv_rows(cls, options.number, options.fields)
+        seen = set()
+        total = sum(sizeof(p, seen) for p in packets)
+        results.append((cls.__name__, float(total) / len(packets),
+                                                        'bytes/packet'))
+    return results
+
+BENCHMARKS = [('clone', bench_clone),
+              ('views', bench_views),
+              ('iterate', bench_iterate),
+              ('pickle', bench_pickle),
+              ('batch', bench_batch),
+              ('memory', bench_memory)]
+
+if __name__ == '__main__':
+    parser = OptionParser()
+    parser.add_option('-n', '--number', type='int', default=10000,
+                      help='number of operations to time')
+    parser.add_option('-f', '--fields', type='int', default=20,
+                      help='number of fields per packet')
+    parser.add_option('-v', '--values', type='int', default=10,
+                      help='number of values in multivalued fields')
+    parser.add_option('-s', '--size', type='int', default=32,
+                      help='size of each value in bytes')
+    parser.add_option('-t', '--test', action='append', default=[],
+                      help='benchmark to run (default all): %s' % \
+                                ', '.join(name for name, b in BENCHMARKS))
+    options, args = parser.parse_args()
+
+    print '%d operations, %d fields, %d values per multivalued field' % \
+                        (options.number, options.fields, options.values)
+    for name, bench in BENCHMARKS:
+        if options.test and name not in options.test:
+            continue
+        print
+        print '%s: %s' % (name, bench.__doc__)
+        for label, value, unit in bench(options):
+            print '  %-20s %12.2f %s' % (label, value, unit)
+    sys.exit(0)
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+"""Measures the latency of a graph with independent branches.
+
+A source is split into several branches that each cost a fixed
+amount of CPU time (or of waiting, with -s) per document. Documents
+are sent one at a time and the time each takes to pass through the
+whole graph is reported for a single L{Scheduler} and for a
+L{ParallelScheduler} with threads and with processes. The graph is
+first run on the single scheduler to measure the cost of every
+component, and the measured costs decide how it is split.
+
+    $ python ParallelBenchmark.py -d 500 -n 4 -w 20000
+    $ python ParallelBenchmark.py -s
+"""
+
+import sys
+import time
+from optparse import OptionParser
+
+from pypes.component import Component
+from pypes.scheduler import Scheduler
+from pypes.parallel import ParallelScheduler, component_costs
+from pypes.backend import get_backend
+
+class Source(Component):
+    __metatype__ = 'ADAPTER'
+
+    def process(self, docs):
+        return docs
+
+class Split(Component):
+    __metatype__ = 'OPERATOR'
+
+    def __init__(self, n):
+        Component.__init__(self)
+        self.ports = ['out'] + ['out%d' % i for i in range(2, n + 1)]
+        for port in self.ports[1:]:
+            self.add_output(port)
+
+    def run(self):
+        while True:
+            docs = self.receive_batch('in')
+            for port in self.ports:
+                self.send_batch(port, docs)
+            yield
+
+class Work(Component):
+    __metatype__ = 'PUBLISHER'
+
+    def __init__(self, cost, sleep):
+        Component.__init__(self)
+        self.remove_output('out')
+        self.cost = cost
+        self.sleep = sleep
+
+    def process(self, docs):
+        for data in docs:
+            if self.sleep:
+                time.sleep(self.cost / 1e6)
+            else:
+                x = data
+                for i in xrange(self.cost):
+                    x = (x * 31 + i) & 0xffff
+        return []
+
+def build(branches, cost, sleep):
+    source, split = Source(), Split(branches)
+    graph = {source: {split: ('out', 'in')}, split: {}}
+    for port in split.ports:
+        graph[split][Work(cost, sleep)] = (port, 'in')
+    return graph
+
+def bench(pipe, docs):
+    start = time.time()
+    for i in xrange(docs):
+        pipe.send(i)
+    return time.time() - start
+
+if __name__ == '__main__':
+    parser = OptionParser()
+    parser.add_option('-d', '--docs', type='int', default=500,
+                      help='number of documents to send')
+    parser.add_option('-n', '--branches', type='int', default=4,
+                      help='number of branches after the split')
+    parser.add_option('-w', '--work', type='int', default=20000,
+                      help='loop iterations of CPU work per document '
+                           '(microseconds of waiting with -s)')
+    parser.add_option('-s', '--sleep', action='store_true', default=False,
+                      help='branches wait instead of using the CPU')
+    options, args = parser.parse_args()
+
+    graph = build(options.branches, options.work, options.sleep)
+    single = Scheduler(graph, backend=get_backend('generator'))
+    bench(single, max(options.docs / 10, 1))
+    costs = component_costs(single.get_metrics())
+
+    print '%d documents, %d branches' % (options.docs, options.branches)
+    print '%-20s %10s %12s' % ('scheduler', 'seconds', 'usec/doc')
+    elapsed = bench(single, options.docs)
+    print '%-20s %10.3f %12.0f' % ('single', elapsed,
+                                   elapsed * 1e6 / options.docs)
+    for processes in (False, True):
+        pipe = ParallelScheduler(graph, options.branches, costs,
+                                 backend='generator', processes=processes)
+        elapsed = bench(pipe, options.docs)
+        pipe.close()
+        name = '%d %s' % (len(pipe.partitions),
+                          processes and 'processes' or 'threads')
+        print '%-20s %10.3f %12.0f' % (name, elapsed,
+                                       elapsed * 1e6 / options.docs)
+    sys.exit(0)
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+"""Measures how long a L{Dataflow} takes to grow its pool.
+
+A pool of one instance is grown one instance at a time and the time
+from add_process() until the new instance is reading the queue is
+reported, with no spare instances and with -s spares kept started.
+The graph is a source fanned out to -n publishers.
+
+    $ python StartupBenchmark.py -a 20 -n 8 -s 1
+"""
+
+import sys
+import time
+from optparse import OptionParser
+
+from pypes.component import Component
+from pypes.pipeline import Dataflow
+
+class Source(Component):
+    __metatype__ = 'ADAPTER'
+
+    def process(self, docs):
+        return docs
+
+class Sink(Component):
+    __metatype__ = 'PUBLISHER'
+
+    def __init__(self):
+        Component.__init__(self)
+        self.remove_output('out')
+
+    def process(self, docs):
+        return []
+
+def build(n):
+    source = Source()
+    return {source: dict((Sink(), ('out', 'in')) for i in range(n))}
+
+def bench(adds, n, spares, backend):
+    flow = Dataflow(build(n), 1, backend=backend, spares=spares)
+    # let the first instance and the spares start
+    time.sleep(1)
+
+    times = []
+    for i in range(adds):
+        start = time.time()
+        flow.add_process()
+        instance = flow.processes[-1]
+        while not instance.ready.is_set():
+            time.sleep(0.0001)
+        times.append(time.time() - start)
+        # give the replacement spare time to start
+        time.sleep(0.3)
+
+    flow.close()
+    times.sort()
+    return times[len(times) / 2], times[-1]
+
+if __name__ == '__main__':
+    parser = OptionParser()
+    parser.add_option('-a', '--adds', type='int', default=20,
+                      help='number of instances to add')
+    parser.add_option('-n', '--sinks', type='int', default=8,
+                      help='number of publishers in the graph')
+    parser.add_option('-s', '--spares', type='int', default=1,
+                      help='number of spare instances to compare with')
+    parser.add_option('-b', '--backend', default=None,
+                      help='execution backend (stackless, greenlet, generator)')
+    options, args = parser.parse_args()
+
+    print '%d instances added, %d publishers' % (options.adds, options.sinks)
+    print '%-8s %12s %12s' % ('spares', 'median ms', 'max ms')
+    for spares in (0, options.spares):
+        median, longest = bench(options.adds, options.sinks, spares,
+                                options.backend)
+        print '%-8d %12.2f %12.2f' % (spares, median * 1000, longest * 1000)
+    sys.exit(0)
@@ -78,9 +78,9 @@ if __name__ == '__main__':
     p2 = Pype()
 
     # A component is written as a stackless tasklet
-    # We need to let stackless know. We only need a reference
-    # to the first tasklet which is where we will send data 
-    t = stackless.tasklet(hello.run)()
+    # We need to let stackless know. Sending data on a pype
+    # wakes the component reading from it.
+    stackless.tasklet(hello.run)()
     stackless.tasklet(printer.run)()
 
     print 'Connecting ports now...'
@@ -97,6 +97,7 @@ if __name__ == '__main__':
     print 'Sending some test data...\n'
     for name in ['Tom', 'Dick', 'Harry']:
         p1.send(name)
-        # we need to "trigger" the first stackless tasklet
-        t.run()
+        # run the tasklets until they are waiting for more data
+        while stackless.getruncount() > 1:
+            stackless.schedule()
 
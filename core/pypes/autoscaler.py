@@ -0,0 +1,210 @@
+"""Provides a controller that resizes a L{Dataflow} pool with the load.
+
+The controller samples the depth of the shared queue and the average
+time an instance takes per item. Together they estimate how long a
+newly queued item waits before an instance picks it up::
+
+    wait = depth * latency / pool size
+
+The pool grows while the wait is above the target and shrinks while
+it is well below it. A change is only made after the same decision
+has been reached on several samples in a row and never sooner than
+the cooldown after the previous change, which keeps the pool from
+flapping around a threshold.
+
+Instances being removed are drained: they finish the item they are
+working on and leave the rest of the queue to the other instances.
+
+Run this module directly to run the doctests (unittests). The examples
+drive the controller with made up queue depths and latencies:
+
+    >>> class FakeDataflow(object):
+    ...     def __init__(self):
+    ...         self.processes = ['p0']
+    ...         self.depth, self.latency = 0, 0.5
+    ...     def get_queue_depth(self):
+    ...         return self.depth
+    ...     def get_latency(self):
+    ...         return self.latency
+    ...     def add_process(self):
+    ...         self.processes.append('p%d' % len(self.processes))
+    ...     def remove_process(self):
+    ...         self.processes.pop()
+    >>> flow = FakeDataflow()
+    >>> scaler = Autoscaler(flow, min_size=1, max_size=3, target=1.0,
+    ...                     low=0.1, samples=3, cooldown=5.0)
+
+Ten items queued behind one instance wait 5 seconds. The pool grows on
+the third sample in a row above the target:
+
+    >>> flow.depth = 10
+    >>> scaler.get_wait()
+    5.0
+    >>> [scaler.step(now) for now in (100, 101, 102)], len(flow.processes)
+    ([0, 0, 1], 2)
+
+The wait is still above the target but the next change waits for the
+cooldown, and the pool never grows past max_size:
+
+    >>> [scaler.step(now) for now in (103, 104, 105, 107)], len(flow.processes)
+    ([0, 0, 0, 1], 3)
+    >>> [scaler.step(now) for now in range(200, 210)].count(0)
+    10
+
+A sample between the thresholds starts the count over:
+
+    >>> flow.depth = 0
+    >>> [scaler.step(now) for now in (300, 301)]
+    [0, 0]
+    >>> flow.depth = 1
+    >>> scaler.step(302)
+    0
+    >>> flow.depth = 0
+    >>> [scaler.step(now) for now in (303, 304, 305)], len(flow.processes)
+    ([0, 0, -1], 2)
+    >>> scaler.grows, scaler.shrinks
+    (2, 1)
+
+Nothing changes while the queue depth is unknown:
+
+    >>> flow.depth = None
+    >>> scaler.get_wait(), scaler.step(400)
+    (None, 0)
+"""
+
+import time
+import threading
+import multiprocessing
+
+class Autoscaler(object):
+    """Grows and shrinks the pool of a L{Dataflow}.
+    """
+    def __init__(self, dataflow, min_size=1, max_size=None, target=1.0,
+                 low=0.1, samples=3, interval=1.0, cooldown=5.0):
+        """Class constructor
+
+        @param dataflow: The pool being resized
+        @type dataflow: L{Dataflow}
+        @keyword min_size: The smallest pool size
+        @type min_size: int
+        @keyword max_size: The largest pool size (defaults to the CPU count)
+        @type max_size: int
+        @keyword target: The longest an item should wait on the queue (seconds)
+        @type target: float
+        @keyword low: The pool shrinks once the wait drops below this
+                      fraction of the target
+        @type low: float
+        @keyword samples: Consecutive samples needed before resizing
+        @type samples: int
+        @keyword interval: Time between samples (seconds)
+        @type interval: float
+        @keyword cooldown: The least time between two resizes (seconds)
+        @type cooldown: float
+        """
+        if max_size is None:
+            max_size = multiprocessing.cpu_count()
+
+        self.dataflow = dataflow
+        self.min_size = max(min_size, 1)
+        self.max_size = max(max_size, self.min_size)
+        self.target = target
+        self.low = low
+        self.samples = samples
+        self.interval = interval
+        self.cooldown = cooldown
+
+        self.grows = 0
+        self.shrinks = 0
+
+        self._trend = 0
+        self._last_resize = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def get_wait(self):
+        """Returns the estimated time an item waits on the queue.
+
+        @return: float or None if the queue depth is unknown
+        """
+        depth = self.dataflow.get_queue_depth()
+        if depth is None:
+            return None
+
+        size = len(self.dataflow.processes)
+        latency = self.dataflow.get_latency()
+        return depth * latency / max(size, 1)
+
+    def step(self, now=None):
+        """Takes one sample and resizes the pool if needed.
+
+        @keyword now: The current time (defaults to time.time())
+        @type now: float
+        @return: 1 if the pool grew, -1 if it shrank, otherwise 0
+        """
+        if now is None:
+            now = time.time()
+
+        wait = self.get_wait()
+        if wait is None:
+            return 0
+
+        size = len(self.dataflow.processes)
+        if wait > self.target and size < self.max_size:
+            vote = 1
+        elif wait < self.target * self.low and size > self.min_size:
+            vote = -1
+        else:
+            vote = 0
+
+        # count consecutive votes in the same direction
+        if vote == 0 or (vote > 0) != (self._trend > 0):
+            self._trend = vote
+        else:
+            self._trend += vote
+
+        if abs(self._trend) < self.samples:
+            return 0
+        if now - self._last_resize < self.cooldown:
+            return 0
+
+        self._trend = 0
+        self._last_resize = now
+        if vote > 0:
+            self.dataflow.add_process()
+            self.grows += 1
+        else:
+            self.dataflow.remove_process()
+            self.shrinks += 1
+        return vote
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.step()
+            self._stop.wait(self.interval)
+
+    def start(self):
+        """Starts sampling in a background thread.
+
+        @return: Nothing
+        """
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops sampling. The pool is left at its current size.
+
+        @return: Nothing
+        """
+        self._stop.set()
+        if self._thread is not None and \
+                        self._thread is not threading.currentThread():
+            self._thread.join()
+        self._thread = None
+
+if __name__ == '__main__':
+    # Run the doctests
+    import sys
+    import doctest
+    doctest.testmod(sys.modules['__main__'])
@@ -0,0 +1,300 @@
+"""Provides the execution backends that run component micro-threads.
+
+A backend supplies the few primitives the scheduler and the
+components rely on: spawning a component, rescheduling the
+running component, blocking an idle component until data is
+sent to it and draining the run queue.
+
+Three backends are available:
+
+    - stackless: runs each component as a stackless tasklet.
+    - greenlet:  runs each component as a greenlet on stock CPython.
+    - generator: runs components whose run() method is a generator
+                 on stock CPython. Such components yield where they
+                 would otherwise call L{Component.yield_ctrl}.
+
+The stackless and greenlet backends run the same run() loops. The
+generator backend cannot suspend a component from inside a call so
+edges are left unbounded when it is used.
+"""
+
+import time
+import inspect
+from collections import deque
+
+BACKENDS = ('stackless', 'greenlet', 'generator')
+
+class BackendError(Exception):
+    """Raised when a backend is unknown or cannot be loaded"""
+    pass
+
+class StacklessEvent(object):
+    """Blocks a tasklet until it is signaled.
+    """
+    def __init__(self, stackless):
+        """Class constructor
+
+        @param stackless: the stackless module
+        @type stackless: module
+        """
+        self._channel = stackless.channel()
+        # the signaling tasklet keeps running
+        self._channel.preference = 1
+        self._waiting = False
+
+    def wait(self):
+        """Blocks the current tasklet until L{signal} is called
+        """
+        self._waiting = True
+        self._channel.receive()
+
+    def signal(self):
+        """Makes the waiting tasklet runnable (if there is one)
+        """
+        if self._waiting:
+            self._waiting = False
+            self._channel.send(None)
+
+class StacklessBackend(object):
+    """Runs components as stackless tasklets.
+    """
+    name = 'stackless'
+    can_block = True
+
+    def __init__(self):
+        """Class constructor
+        """
+        try:
+            import stackless
+        except ImportError:
+            raise BackendError('The stackless backend requires Stackless Python')
+        self._stackless = stackless
+
+    def spawn(self, component):
+        """Starts a component as a new tasklet
+
+        @param component: The component to start
+        @type component: L{Component}
+        @return: stackless.tasklet
+        """
+        return self._stackless.tasklet(component.run)()
+
+    def event(self):
+        """Returns a new event used to block an idle component
+
+        @return: L{StacklessEvent}
+        """
+        return StacklessEvent(self._stackless)
+
+    def schedule(self):
+        """Relinquishes control, keeping the current tasklet runnable
+        """
+        self._stackless.schedule()
+
+    def drain(self):
+        """Runs tasklets until only the caller is left on the run queue
+        """
+        while self._stackless.getruncount() > 1:
+            self._stackless.schedule()
+
+class GreenletEvent(object):
+    """Blocks a greenlet until it is signaled.
+    """
+    def __init__(self, backend):
+        """Class constructor
+
+        @param backend: the backend owning the run queue
+        @type backend: L{GreenletBackend}
+        """
+        self._backend = backend
+        self._waiting = None
+
+    def wait(self):
+        """Blocks the current greenlet until L{signal} is called
+        """
+        self._waiting = self._backend._getcurrent()
+        self._backend._hub.switch()
+
+    def signal(self):
+        """Makes the waiting greenlet runnable (if there is one)
+        """
+        if self._waiting is not None:
+            self._backend._runnable.append(self._waiting)
+            self._waiting = None
+
+class GreenletBackend(object):
+    """Runs components as greenlets on stock CPython.
+
+    The greenlet calling L{drain} acts as the hub. It switches into
+    each runnable greenlet in turn and is switched back to whenever
+    a component yields or blocks.
+    """
+    name = 'greenlet'
+    can_block = True
+
+    def __init__(self):
+        """Class constructor
+        """
+        try:
+            from greenlet import greenlet, getcurrent
+        except ImportError:
+            raise BackendError('The greenlet backend requires greenlet')
+        self._greenlet = greenlet
+        self._getcurrent = getcurrent
+        self._runnable = deque()
+        self._hub = None
+
+    def spawn(self, component):
+        """Creates a greenlet for a component and marks it runnable
+
+        @param component: The component to start
+        @type component: L{Component}
+        @return: greenlet
+        """
+        task = self._greenlet(component.run)
+        self._runnable.append(task)
+        return task
+
+    def event(self):
+        """Returns a new event used to block an idle component
+
+        @return: L{GreenletEvent}
+        """
+        return GreenletEvent(self)
+
+    def schedule(self):
+        """Relinquishes control, keeping the current greenlet runnable
+        """
+        self._runnable.append(self._getcurrent())
+        self._hub.switch()
+
+    def drain(self):
+        """Runs greenlets until none of them are runnable
+        """
+        self._hub = self._getcurrent()
+        runnable = self._runnable
+        while runnable:
+            task = runnable.popleft()
+            if not task.dead:
+                task.switch()
+
+class GeneratorEvent(object):
+    """Parks a generator task until it is signaled.
+    """
+    def __init__(self, backend):
+        """Class constructor
+
+        @param backend: the backend owning the run queue
+        @type backend: L{GeneratorBackend}
+        """
+        self._backend = backend
+        self._waiting = None
+
+    def wait(self):
+        """Generator components yield control themselves
+        """
+        raise BackendError('The generator backend cannot suspend a ' \
+                                                    'component inside a call')
+
+    def signal(self):
+        """Makes the parked task runnable (if there is one)
+        """
+        if self._waiting is not None:
+            self._backend._runnable.append(self._waiting)
+            self._waiting = None
+
+class GeneratorBackend(object):
+    """Runs generator components on stock CPython.
+
+    Each yield from a component's run() returns control to L{drain}.
+    A component that yields with data waiting on its inputs is run
+    again, otherwise it is parked until data is sent to it.
+    """
+    name = 'generator'
+    can_block = False
+
+    def __init__(self):
+        """Class constructor
+        """
+        self._runnable = deque()
+
+    def spawn(self, component):
+        """Starts a component's run() generator and marks it runnable
+
+        @param component: The component to start
+        @type component: L{Component}
+        @return: list [component, generator, started]
+        """
+        if not inspect.isgeneratorfunction(component.run):
+            raise BackendError('%s.run() must be a generator to use the ' \
+                    'generator backend' % component.__class__.__name__)
+        task = [component, component.run(), False]
+        self._runnable.append(task)
+        return task
+
+    def event(self):
+        """Returns a new event used to park an idle component
+
+        @return: L{GeneratorEvent}
+        """
+        return GeneratorEvent(self)
+
+    def schedule(self):
+        """Generator components yield control themselves
+        """
+        raise BackendError('The generator backend cannot suspend a ' \
+                                                    'component inside a call')
+
+    def drain(self):
+        """Runs generator tasks until none of them are runnable
+        """
+        runnable = self._runnable
+        while runnable:
+            task = runnable.popleft()
+            component, gen, started = task
+
+            # the first run is a start rather than a wakeup
+            if started:
+                component.wakeups += 1
+                if not component.has_pending_input():
+                    component.idle_wakeups += 1
+            task[2] = True
+
+            start = time.time()
+            try:
+                gen.next()
+            except StopIteration:
+                continue
+            finally:
+                component.run_time += time.time() - start
+
+            if component.has_pending_input():
+                runnable.append(task)
+            else:
+                component._wakeup._waiting = task
+
+def get_backend(name=None):
+    """Returns a new backend instance.
+
+    @keyword name: One of L{BACKENDS}. When None the first backend
+                   that can be loaded (stackless, then greenlet) is used.
+    @type name: String
+    @return: backend instance
+    """
+    if name is None:
+        for name in BACKENDS[:2]:
+            try:
+                return get_backend(name)
+            except BackendError:
+                pass
+        raise BackendError('Neither stackless nor greenlet is available')
+
+    if name == 'stackless':
+        backend = StacklessBackend()
+    elif name == 'greenlet':
+        backend = GreenletBackend()
+    elif name == 'generator':
+        backend = GeneratorBackend()
+    else:
+        raise BackendError('Unknown backend: %s' % name)
+    return backend
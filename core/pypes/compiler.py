@@ -0,0 +1,230 @@
+"""Compiles a data flow graph into the stages the scheduler runs.
+
+Components normally run as micro-threads of their own and pass data
+on a L{Pype} per edge. A component can instead implement process(),
+which takes the list of documents received on its 'in' port and
+returns the list to send on its 'out' port. Such components are
+run by a L{Stage} and a linear chain of them is fused into a single
+stage that hands each batch from one process() call to the next
+without an edge, a wakeup or a context switch in between.
+
+A link is fused when the parent's only child is the child and the
+child's only parent is the parent (from 'out' to 'in'). Nodes that
+fan in or fan out, and components implementing run() only, are left
+as stages of their own. So are components implementing process()
+that use other ports as well, they run the default L{Component.run}.
+
+Run this module directly to run the doctests (unittests).
+
+    >>> class Upper(Component):
+    ...     def process(self, docs):
+    ...         return [d.upper() for d in docs]
+    >>> class Strip(Component):
+    ...     def process(self, docs):
+    ...         return [d.strip() for d in docs]
+    >>> class Print(Component):
+    ...     def __init__(self):
+    ...         Component.__init__(self)
+    ...         self.remove_output('out')
+    ...     def process(self, docs):
+    ...         for d in docs:
+    ...             print d
+    ...         return []
+    >>> a, b, c = Upper(), Strip(), Print()
+    >>> a.__metatype__ = 'ADAPTER'
+    >>> nodes, stages, stage_of = compile_graph({a: {b: ('out', 'in')},
+    ...                                          b: {c: ('out', 'in')}})
+    >>> stages
+    [Stage(Upper -> Strip -> Print)]
+    >>> stages[0].get_type(), stages[0].get_out_ports()
+    ('ADAPTER', [])
+    >>> nodes, stages, stage_of = compile_graph({a: {b: ('out', 'in')},
+    ...                                          b: {c: ('out', 'in')}},
+    ...                                         fuse=False)
+    >>> stages
+    [Stage(Upper), Stage(Strip), Stage(Print)]
+
+A component implementing process() with other ports is not fused but
+still runs, here on the generator backend:
+
+    >>> from scheduler import Scheduler
+    >>> from backend import get_backend
+    >>> class Tee(Upper):
+    ...     def __init__(self):
+    ...         Upper.__init__(self)
+    ...         self.add_output('copy')
+    >>> t = Tee()
+    >>> t.__metatype__ = 'ADAPTER'
+    >>> pipe = Scheduler({t: {c: ('out', 'in')}}, backend=get_backend('generator'))
+    >>> pipe.stages[0] is t
+    True
+    >>> pipe.send('hello')
+    HELLO
+"""
+
+import sys
+import time
+import traceback
+
+from component import Component
+from graph import get_pairlist, topsort
+
+def is_fusable(component):
+    """Returns True if a component can be run by a L{Stage}.
+
+    The component must implement process() and use no ports other
+    than 'in' and (optionally) 'out'.
+
+    @param component: The component
+    @type component: L{Component}
+    @return: Boolean
+    """
+    return component.process is not None and \
+           component.get_in_ports() == ['in'] and \
+           component.get_out_ports() in (['out'], [])
+
+class Stage(Component):
+    """Runs a chain of components implementing process() as one micro-thread.
+
+    Each batch received on the stage's input is passed through the
+    process() method of every component in turn and the result is
+    sent on the stage's output. The components' counters (documents
+    in and out, run time) are kept up to date so their metrics are
+    reported as if they ran on their own.
+    """
+    def __init__(self, components):
+        """Class constructor
+
+        @param components: The chain of components in the order data
+                           flows through them
+        @type components: list of L{Component}
+        """
+        Component.__init__(self)
+        self.components = list(components)
+        if not self.components[-1].get_out_ports():
+            self.remove_output('out')
+
+    def __repr__(self):
+        return 'Stage(%s)' % ' -> '.join(c.__class__.__name__ \
+                                                for c in self.components)
+
+    def get_type(self):
+        """Returns the type of the first component in the chain.
+        """
+        return self.components[0].get_type()
+
+    def get_mimetypes(self):
+        """Returns the mimetypes the first component in the chain accepts.
+        """
+        return self.components[0].get_mimetypes()
+
+    def get_routes(self):
+        """Returns the routes the first component in the chain accepts.
+        """
+        return self.components[0].get_routes()
+
+    def connect_input(self, name, edge):
+        """Connects an edge to the input of the stage.
+
+        The first component of the chain is connected too so it
+        reports the statistics of the edge.
+
+        @see: L{Component.connect_input}
+        """
+        self.components[0].connect_input(name, edge)
+        Component.connect_input(self, name, edge)
+
+    def connect_output(self, name, edge):
+        """Connects an edge to the output of the stage.
+
+        @see: L{Component.connect_output}
+        """
+        self.components[-1].connect_output(name, edge)
+        Component.connect_output(self, name, edge)
+
+    def process(self, docs):
+        """Runs a batch through every component in the chain.
+
+        A component that fails passes the batch on unprocessed.
+
+        @param docs: The documents received on the stage's input
+        @type docs: list
+        @return: The documents to send on the stage's output
+        """
+        for component in self.components:
+            component.docs_in += len(docs)
+            start = time.time()
+            try:
+                docs = component.process(docs)
+            except:
+                print 'OOPS! - Component Failure'
+                traceback.print_exc()
+            component.run_time += time.time() - start
+            component.docs_out += len(docs)
+            if not docs:
+                break
+        return docs
+
+def compile_graph(graph, fuse=True, key=None):
+    """Compiles a graph into the stages that run it.
+
+    Components that can be run by a L{Stage} (see L{is_fusable}) are
+    wrapped in one. When fuse is True linear chains of them share a
+    single stage. Other components are their own stage. Nodes without edges are compiled
+    too when they are keys of the graph (mapped to an empty dict).
+
+    @param graph: The graph representing the work flow
+    @type graph: Python dict organized as a graph struct
+    @keyword fuse: Fuse linear chains into a single stage
+    @type fuse: Boolean
+    @keyword key: Only fuse components for which this returns the same value
+    @type key: callable
+    @return: tuple, (components in dependency order, stages in
+             dependency order, dict mapping each component to its stage)
+    """
+    nodes = topsort(get_pairlist(graph))
+
+    # nodes without any edges are not in the pair list
+    seen = set(nodes)
+    nodes.extend([n for n in graph if n not in seen])
+
+    parents = dict((n, 0) for n in nodes)
+    for n in nodes:
+        for child in graph.get(n, {}):
+            parents[child] += 1
+
+    stages = []
+    stage_of = {}
+    for n in nodes:
+        if n in stage_of:
+            continue
+
+        if not is_fusable(n):
+            stage_of[n] = n
+            stages.append(n)
+            continue
+
+        chain = [n]
+        while fuse:
+            children = graph.get(chain[-1], {})
+            if len(children) != 1:
+                break
+            child, ports = children.items()[0]
+            if tuple(ports[:2]) != ('out', 'in') or parents[child] != 1 or \
+                                                    not is_fusable(child):
+                break
+            if key is not None and key(child) != key(chain[-1]):
+                break
+            chain.append(child)
+
+        stage = Stage(chain)
+        for c in chain:
+            stage_of[c] = stage
+        stages.append(stage)
+
+    return nodes, stages, stage_of
+
+if __name__ == '__main__':
+    # Run the doctests
+    import doctest
+    doctest.testmod(sys.modules['__main__'])
@@ -5,7 +5,10 @@ the run() method.
 
 """
 
-import stackless
+import time
+import traceback
+
+from backend import get_backend
 
 class Component(object):
     """Provides methods common to all filters.
@@ -14,11 +17,33 @@ class Component(object):
     subclass this module and implement their own
     run() method.
 
-    Keep in mind that filters are stackless.tasklets
-    and the run method should yield rather return.
+    Keep in mind that filters run as micro-threads (stackless
+    tasklets or greenlets depending on the backend) and the run
+    method should yield rather return.
+
+    Scheduling is event driven. A component that yields with
+    no data waiting on its inputs is not resumed until one of
+    its input pypes receives data.
+
+    Components may implement process() instead of run(). It takes
+    the list of documents received on 'in' and returns the list to
+    send on 'out'. Components with no other ports are run by a
+    L{pypes.compiler.Stage}, fused with their neighbours when they
+    form a linear chain. Others run the default L{run}, which feeds
+    process() in the same way.
+
+    @see: L{pypes.backend}
     """
     __metatype__ = None
 
+    # process(docs) -> docs, see above (None when run() is implemented)
+    process = None
+
+    # the mimetypes and routes an adapter accepts, None accepts anything
+    # (see pypes.router). A None in the list matches data without one.
+    __mimetypes__ = None
+    __routes__ = None
+
     def __init__(self):
         """Class constructor
 
@@ -28,22 +53,177 @@ class Component(object):
         self._outputs = {'out': [None, 'Default output port']}
         self._parameters = {}
 
+        # the backend running this component and the
+        # event it blocks on while idle (see set_backend)
+        self._backend = None
+        self._wakeup = None
+
+        # scheduler counters
+        self.wakeups = 0
+        self.idle_wakeups = 0
+
+        # throughput counters and the time spent running (in seconds)
+        self.docs_in = 0
+        self.docs_out = 0
+        self.run_time = 0.0
+        self._resumed = None
+
+    def set_backend(self, backend):
+        """Binds this component to the backend that runs it.
+
+        Components implementing process() rather than run() run the
+        generator version of L{run} on backends that can't suspend a
+        call.
+
+        @param backend: The execution backend
+        @type backend: L{pypes.backend} backend instance
+        @return: Nothing
+        """
+        self._backend = backend
+        self._wakeup = backend.event()
+        if self.process is not None and not backend.can_block and \
+                        type(self).run.im_func is Component.run.im_func:
+            self.run = self._run_generator
+
     def run(self):
-        """Starts this component as a stackless tasklet
+        """Starts this component as a micro-thread
 
         This method is meant to be overridden in derived subclass.
-        The subclass should implement its own logic.
+        The subclass should implement its own logic. Components
+        implementing process() instead don't need to.
+        """
+        if self.process is None:
+            raise NotImplementedError
+        while True:
+            self._process_waiting()
+            self.yield_ctrl()
+
+    def _run_generator(self):
+        """Entry point of components implementing process() on the
+        generator backend.
+        """
+        while True:
+            self._process_waiting()
+            yield
+
+    def _process_waiting(self):
+        """Runs the documents waiting on 'in' through process().
+
+        The documents are sent on 'out' (if there is one). A failure
+        passes them on unprocessed.
         """
-        raise NotImplementedError
+        docs = self.receive_batch('in')
+        if not docs:
+            return
+        try:
+            docs = self.process(docs)
+        except:
+            print 'OOPS! - Component Failure'
+            traceback.print_exc()
+        if docs and 'out' in self.get_out_ports():
+            self.send_batch('out', docs)
 
     def yield_ctrl(self):
         """Causes this tasklet to relinquish control of the 
-        CPU to allow another tasklet to run. This tasklet is
-        re-scheduled to run again.
+        CPU to allow another tasklet to run.
+
+        If data is waiting on any input port this tasklet is
+        re-scheduled to run again. Otherwise it blocks until
+        data is sent to one of its input ports.
 
         @return: Nothing
         """
-        stackless.schedule()
+        if self._backend is None:
+            self.set_backend(get_backend())
+
+        self._suspend()
+        if self.has_pending_input():
+            self._backend.schedule()
+        else:
+            self._wakeup.wait()
+        self._resumed = time.time()
+
+        self.wakeups += 1
+        if not self.has_pending_input():
+            self.idle_wakeups += 1
+
+    def wait_for_drain(self):
+        """Relinquishes control while waiting on a full output edge.
+
+        Unlike L{yield_ctrl} this tasklet always remains runnable
+        since it must retry the send once downstream has drained.
+
+        @return: Nothing
+        """
+        if self._backend is None:
+            self.set_backend(get_backend())
+        self._suspend()
+        self._backend.schedule()
+        self._resumed = time.time()
+
+    def _suspend(self):
+        """Adds the time since this tasklet was resumed to its run time.
+        """
+        if self._resumed is not None:
+            self.run_time += time.time() - self._resumed
+            self._resumed = None
+
+    def wake(self):
+        """Makes this tasklet runnable if it is blocked waiting for input.
+
+        This is called by the L{Pype} connected to an input port
+        whenever data is sent on it.
+
+        @return: Nothing
+        """
+        if self._wakeup is not None:
+            self._wakeup.signal()
+
+    def has_pending_input(self):
+        """Returns True if data is waiting on any of the input ports.
+
+        @return: Boolean
+        """
+        for edge, desc in self._inputs.values():
+            if edge is not None and edge.size:
+                return True
+        return False
+
+    def get_wakeup_stats(self):
+        """Returns the scheduler counters for this component.
+
+        Idle wakeups count the times this component was resumed
+        and found no data waiting on its inputs.
+
+        @return: dict
+        """
+        return {'wakeups': self.wakeups,
+                'idle_wakeups': self.idle_wakeups}
+
+    def get_metrics(self):
+        """Returns the counters for this component and its input edges.
+
+        Documents in and out count the data received and sent on every
+        port. Run time is the time in seconds spent inside run() between
+        yields. Each connected input port reports the statistics of its
+        edge (see L{Pype.get_stats}) so every edge is reported once, by
+        the component reading from it.
+
+        @return: dict
+        """
+        edges = {}
+        for port, (edge, desc) in self._inputs.items():
+            if edge is not None:
+                edges[port] = edge.get_stats()
+
+        metrics = {'name': self.__class__.__name__,
+                   'type': self.get_type(),
+                   'docs_in': self.docs_in,
+                   'docs_out': self.docs_out,
+                   'run_time': self.run_time,
+                   'edges': edges}
+        metrics.update(self.get_wakeup_stats())
+        return metrics
 
     def add_input(self, name, desc=None):
         """Adds a new input port to this component.
@@ -145,6 +325,8 @@ class Component(object):
         else:
             item[0] = edge
             self._inputs[name] = item
+            if edge is not None:
+                edge.consumer = self
 
     def connect_output(self, name, edge):
         """Connects a edge (pype) to the specified output port of this component.
@@ -257,6 +439,8 @@ class Component(object):
             data = self._inputs[port][0].recv()
         except:
             data = None
+        if data is not None:
+            self.docs_in += 1
         return data
 
     def receive_all(self, port):
@@ -267,11 +451,63 @@ class Component(object):
         @return: An iterator over this ports available data
         """
         for item in range(self._inputs[port][0].size):
+            self.docs_in += 1
             yield self._inputs[port][0].recv()
-    
+
+    def receive_batch(self, port, max_n=None):
+        """Tries recieving a batch of data waiting on the specified port.
+
+        The batch is moved off the edge in a single operation
+        which avoids the per item overhead of L{receive_all}.
+
+        @param port: The port being referenced
+        @type port: String
+        @keyword max_n: The maximum number of items to receive (None for all)
+        @type max_n: int
+        @return: list (empty if no data is available)
+        """
+        try:
+            batch = self._inputs[port][0].recv_batch(max_n)
+        except:
+            batch = []
+        self.docs_in += len(batch)
+        return batch
+
+    def send_batch(self, port, batch):
+        """Sends a batch of data on the specified port.
+
+        The batch is written to the edge in a single operation. If the
+        edge fills up this component yields control until the downstream
+        component drains it and then sends the remainder.
+
+        @param port: The port being referenced
+        @type port: String
+
+        @param batch: The data to be sent
+        @type batch: list
+
+        @return: Boolean (depending on the success)
+        """
+        status = True
+        try:
+            edge = self._outputs[port][0]
+            sent = edge.send_batch(batch)
+            self.docs_out += sent
+            while sent < len(batch):
+                batch = batch[sent:]
+                self.wait_for_drain()
+                sent = edge.send_batch(batch)
+                self.docs_out += sent
+        except:
+            status = False
+        return status
+
     def send(self, port, data):
         """Sends data on specified port.
 
+        If the edge connected to the port is full this component
+        yields control until the downstream component drains it.
+
         @param port: The port being referenced
         @type port: String
 
@@ -282,11 +518,31 @@ class Component(object):
         """
         status = True
         try:
-            self._outputs[port][0].send(data)
+            edge = self._outputs[port][0]
+            while not edge.send(data):
+                self.wait_for_drain()
+            self.docs_out += 1
         except:
             status = False
         return status
 
+    def get_port_stats(self, port):
+        """Returns the buffer statistics of the edge connected to a port.
+
+        @see: L{Pype.get_stats}
+
+        @param port: The port being referenced
+        @type port: String
+        @return: dict or None if the port is not connected
+        """
+        stats = None
+        if self.is_connected(port):
+            try:
+                stats = self._inputs[port][0].get_stats()
+            except:
+                stats = self._outputs[port][0].get_stats()
+        return stats
+
     def get_in_ports(self):
         """Returns a list of current inputs ports for this component.
         """
@@ -343,3 +599,9 @@ class Component(object):
 
     def get_type(self):
         return self.__metatype__
+
+    def get_mimetypes(self):
+        return self.__mimetypes__
+
+    def get_routes(self):
+        return self.__routes__
@@ -5,8 +5,6 @@ Most of these basic filters operate on strings or lines
 of strings just as you would expect from the Unix versions.
 """
 
-import stackless
-
 from component import Component
 
 class Null(Component):
@@ -23,8 +21,7 @@ class Null(Component):
         """Entry point for this component. Overrides L{Component.run}
         """
         while True:
-            for data in self.receive_all('in'):
-                pass
+            self.receive_batch('in')
             self.yield_ctrl()
 
 class TextFileInputReader(Component):
@@ -45,8 +42,7 @@ class TextFileInputReader(Component):
                 fp = open(data, 'rb')
                 lines = fp.readlines()
                 fp.close()
-                for line in lines:
-                    self.send('out', line.strip())
+                self.send_batch('out', [line.strip() for line in lines])
 
             self.yield_ctrl()
 
@@ -64,8 +60,7 @@ class StringInputReader(Component):
         """Entry point for this component. Overrides L{Component.run}
         """
         while True:
-            for data in self.receive_all('in'):
-                self.send('out', data)
+            self.send_batch('out', self.receive_batch('in'))
             self.yield_ctrl()
 
 class ConsoleOutputWriter(Component):
@@ -83,7 +78,7 @@ class ConsoleOutputWriter(Component):
         """Entry point for this component. Overrides L{Component.run}
         """
         while True:
-            for data in self.receive_all('in'):
+            for data in self.receive_batch('in'):
                 print data
             
             self.yield_ctrl()
@@ -107,9 +102,8 @@ class Grep(Component):
         """Entry point for this component. Overrides L{Component.run}
         """
         while True:
-            for data in self.receive_all('in'):
-                if self.expression in data:
-                    self.send('out', data)
+            self.send_batch('out', [data for data in self.receive_batch('in') \
+                                            if self.expression in data])
             self.yield_ctrl()
 
 class Sort(Component):
@@ -136,15 +130,10 @@ class Sort(Component):
     def run(self):
         """Entry point for this component. Overrides L{Component.run}
         """
-        items = []
         while True:
-            for data in self.receive_all('in'):
-                items.append(data)
-
+            items = self.receive_batch('in')
             items.sort(reverse=self.direction)
-            for item in items:
-                self.send('out', item)
-            items = []
+            self.send_batch('out', items)
             self.yield_ctrl()
 
 class BinarySplit(Component):
@@ -164,10 +153,10 @@ class BinarySplit(Component):
         """Entry point for this component. Overrides L{Component.run}
         """
         while True:
-            for data in self.receive_all('in'):
-                self.send('out', data)
-                self.send('out2', data)
-            
+            items = self.receive_batch('in')
+            self.send_batch('out', items)
+            self.send_batch('out2', items)
+
             self.yield_ctrl()
 
 class Uniq(Component):
@@ -183,11 +172,9 @@ class Uniq(Component):
     def run(self):
         """Entry point for this component. Overrides L{Component.run}
         """
-        items = []
         while True:
-            for data in self.receive_all('in'):
-                items.append(data)
-            
+            items = self.receive_batch('in')
+
             uniq = {}
             count = 0
 
@@ -197,9 +184,7 @@ class Uniq(Component):
 
             keys = [uniq[i] for i in range(len(uniq))]
 
-            for item in items:
-                self.send('out', item)
-            items = []
+            self.send_batch('out', items)
             self.yield_ctrl()
 
 class Cut(Component):
@@ -226,7 +211,8 @@ class Cut(Component):
         """Entry point for this component. Overrides L{Component.run}
         """
         while True:
-            for data in self.receive_all('in'):
+            batch = []
+            for data in self.receive_batch('in'):
                 tokens = []
                 parts = data.split(self.sep)
 
@@ -235,9 +221,9 @@ class Cut(Component):
                         tokens.append(parts[i-1])
                     except:
                         pass
-                this_string = ' '.join(tokens)
+                batch.append(' '.join(tokens))
+
+            self.send_batch('out', batch)
 
-                self.send('out', this_string)
-            
             self.yield_ctrl()
 
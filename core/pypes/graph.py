@@ -424,6 +424,37 @@ def find_cycles(parent_children):
                     # Mark the node as visited.
                     visited_nodes.add(child)
 
+def reachable(graph, starts):
+    """Returns the set of nodes reachable from any of the start nodes.
+
+    A single search visiting every node and edge at most once.
+    The start nodes are included.
+
+    >>> g = {'A': ['B'], 'B': ['C'], 'D': ['C'], 'C': ['A']}
+    >>> result = list(reachable(g, ['B']))
+    >>> result.sort()
+    >>> print result
+    ['A', 'B', 'C']
+    >>> result = list(reachable(g, ['D', 'E']))
+    >>> result.sort()
+    >>> print result
+    ['A', 'B', 'C', 'D', 'E']
+
+    @param graph: Children keyed on their parent
+    @type graph: dict
+    @param starts: The nodes the search starts from
+    @type starts: list
+    @return: set
+    """
+    visited = set(starts)
+    queue = list(visited)
+    while queue:
+        parent = queue.pop()
+        for child in graph.get(parent, ()):
+            if child not in visited:
+                visited.add(child)
+                queue.append(child)
+    return visited
 
 if __name__ == '__main__':
     # Run the doctest tests.
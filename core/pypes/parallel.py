@@ -0,0 +1,629 @@
+"""Runs the independent branches of a data flow graph in parallel.
+
+A L{Scheduler} runs every component of a graph as a micro-thread of a
+single thread so the branches following a split take turns on one
+CPU. A L{ParallelScheduler} partitions the graph and runs each part
+on a worker thread or process with a scheduler of its own. Edges
+between components in the same part remain L{Pype}s. Edges cut by the
+partition become L{Channel}s that pass what is sent on them to the
+other worker's queue.
+
+The graph is partitioned level by level (see
+L{pypes.graph.topsort_levels}). The components of a level do not
+depend on each other and are spread over the workers by their cost,
+the average time they take per document. Every edge cut costs time
+too (pickling and queueing) so a component only leaves the worker
+running its parents when that shortens the level. Cheap branches stay
+together and a linear chain is never split. Costs are measured by
+running the graph, see L{component_costs}.
+
+Workers never share a document. In process mode every worker gets a
+pickled copy, in thread mode a document is cloned (see L{clone}) when
+it crosses to another worker or is sent to more than one.
+
+Each worker reports whether it built its part of the graph before
+anything is sent, and a worker that exits makes the scheduler raise
+RuntimeError rather than wait for it forever.
+
+Run this module directly to run the doctests (unittests).
+
+    >>> graph = {'split': {'a1': ('out', 'in'), 'b1': ('out2', 'in')},
+    ...          'a1': {'a2': ('out', 'in')},
+    ...          'b1': {'b2': ('out', 'in')}}
+    >>> costs = {'split': 0.001, 'a1': 0.02, 'a2': 0.01,
+    ...                          'b1': 0.01, 'b2': 0.002}
+    >>> partition_graph(graph, 2, costs)
+    [['split', 'a1', 'a2'], ['b1', 'b2']]
+    >>> partition_graph(graph, 2, costs, cut_cost=0.05)
+    [['split', 'a1', 'b1', 'a2', 'b2']]
+"""
+
+import sys
+import copy
+import traceback
+import threading
+import Queue as queue
+import multiprocessing
+
+from pype import Pype
+from scheduler import Scheduler
+from router import Router
+from backend import get_backend
+from graph import get_pairlist, topsort_levels
+
+# estimated time (in seconds) a document takes to cross a cut edge
+DEFAULT_CUT_COST = 0.0001
+
+# how often (in seconds) the scheduler checks its workers are alive
+# while it waits on them
+POLL_INTERVAL = 0.1
+
+def clone(data):
+    """Returns a copy of data sharing nothing with it.
+
+    Data with a deep_clone() method (as the studio's packets have) is
+    copied with it, anything else with copy.deepcopy.
+
+    @param data: The data to copy
+    @type data: Application Specific
+    @return: The copy
+    """
+    deep_clone = getattr(data, 'deep_clone', None)
+    if deep_clone is not None:
+        return deep_clone()
+    return copy.deepcopy(data)
+
+def component_costs(metrics):
+    """Returns the average time each component takes per document.
+
+    The metrics are those returned by L{Scheduler.get_metrics} or the
+    components of L{pypes.pipeline.Dataflow.get_metrics} for the same
+    graph. Components that have not received anything are left out.
+
+    @param metrics: Component metrics keyed on str(hash(component))
+    @type metrics: dict
+    @return: dict of seconds per document keyed like the metrics
+    """
+    costs = {}
+    for key, m in metrics.items():
+        if m['docs_in']:
+            costs[key] = m['run_time'] / m['docs_in']
+    return costs
+
+def _get_cost(costs, node):
+    """Returns the cost of a component looked up on it or its key.
+    """
+    if costs is None:
+        return 1.0
+    cost = costs.get(node)
+    if cost is None:
+        cost = costs.get(str(hash(node)), 0.0)
+    return cost
+
+def partition_graph(graph, n, costs=None, cut_cost=DEFAULT_CUT_COST):
+    """Splits a graph into at most n parts that can run in parallel.
+
+    Each level of the graph is placed in turn, most expensive
+    component first. A component goes to the part that finishes the
+    level soonest, counting the cost of every edge from a parent in
+    another part. Ties go to the part with the fewest cut edges and
+    then the least work.
+
+    @param graph: The graph representing the work flow
+    @type graph: Python dict organized as a graph struct
+    @param n: The number of parts
+    @type n: int
+    @keyword costs: Seconds per document of each component, keyed on
+                    the component or str(hash(component)). Without
+                    costs every component costs the same
+    @type costs: dict
+    @keyword cut_cost: Seconds per document for each edge cut
+    @type cut_cost: float
+    @return: list of lists of components in dependency order
+             (empty parts are left out)
+    """
+    parents = {}
+    for parent, child in get_pairlist(graph):
+        parents.setdefault(child, []).append(parent)
+
+    levels = list(topsort_levels(get_pairlist(graph)))
+    seen = set()
+    for level in levels:
+        seen.update(level)
+    isolated = [node for node in graph if node not in seen]
+    if isolated:
+        levels.insert(0, isolated)
+
+    parts = [[] for i in range(n)]
+    part_of = {}
+    loads = [0.0] * n
+    for level in levels:
+        level_loads = [0.0] * n
+        for node in sorted(level, key=lambda x: -_get_cost(costs, x)):
+            cost = _get_cost(costs, node)
+            best = None
+            for p in range(n):
+                cuts = len([x for x in parents.get(node, []) \
+                                                if part_of[x] != p])
+                load = level_loads[p] + cost + cuts * cut_cost
+                others = max(level_loads[:p] + level_loads[p + 1:] + [0.0])
+                key = (max(load, others), cuts, loads[p], p)
+                if best is None or key < best[0]:
+                    best = (key, load)
+
+            p = best[0][-1]
+            loads[p] += best[1] - level_loads[p]
+            level_loads[p] = best[1]
+            part_of[node] = p
+            parts[p].append(node)
+
+    return [part for part in parts if part]
+
+class Channel(Pype):
+    """An edge leading to a component run by another worker.
+
+    Data sent on the channel is passed to the other worker straight
+    away, a batch in a single message. When given a count of active
+    messages every message is counted until the receiving worker has
+    finished with it. A bounded inbox blocks the sender while full.
+    Workers sharing memory (threads) are sent clones of the data.
+    """
+    def __init__(self, inbox, key, active=None, copies=False):
+        """Class constructor
+
+        @param inbox: The queue of the worker running the receiving end
+        @type inbox: L{Queue.Queue} or L{multiprocessing.Queue}
+        @param key: Identifies the edge to the receiving worker
+        @type key: int
+        @keyword active: The number of messages not finished yet
+        @type active: L{multiprocessing.Value}
+        @keyword copies: Pass on clones of the data (see L{clone})
+        @type copies: Boolean
+        """
+        Pype.__init__(self)
+        self.inbox = inbox
+        self.key = key
+        self.active = active
+        self.copies = copies
+
+    def send(self, data):
+        """Passes data to the other worker
+
+        @return: True
+        """
+        return self.send_batch([data]) == 1
+
+    def send_batch(self, items):
+        """Passes a list of data to the other worker in one message
+
+        @param items: The data to pass on
+        @type items: list
+        @return: The number of items passed on
+        """
+        if self.copies:
+            items = [clone(item) for item in items]
+        else:
+            items = list(items)
+        if not items:
+            return 0
+
+        # counted before it is sent so the count never drops to
+        # zero while the message is on its way
+        if self.active is not None:
+            self.active.get_lock().acquire()
+            try:
+                self.active.value += 1
+            finally:
+                self.active.get_lock().release()
+
+        self.inbox.put(('data', self.key, items))
+        self.sent += len(items)
+        return len(items)
+
+def split_graph(graph, parts):
+    """Splits a graph into the subgraphs of its parts and the edges cut.
+
+    Every cut edge is given a key. The edges arriving in each part
+    map their key to the (component, port) they feed and the edges
+    leaving each part are listed as (component, port, key, part).
+
+    @param graph: The graph representing the work flow
+    @type graph: Python dict organized as a graph struct
+    @param parts: The components of each part
+    @type parts: list of lists
+    @return: tuple, (subgraphs, inputs, outputs) with an item per part
+    """
+    part_of = {}
+    for i, part in enumerate(parts):
+        for node in part:
+            part_of[node] = i
+
+    subgraphs = [dict((node, {}) for node in part) for part in parts]
+    inputs = [{} for part in parts]
+    outputs = [[] for part in parts]
+    key = 0
+    for parent, child in get_pairlist(graph):
+        ports = graph[parent][child]
+        p, c = part_of[parent], part_of[child]
+        if p == c:
+            subgraphs[p][parent][child] = ports
+            continue
+
+        # does this port exist
+        if not parent.has_port(ports[0]):
+            print 'Trying to connect undefined output port', parent, ports[0]
+            sys.exit(1)
+        if not child.has_port(ports[1]):
+            print 'Trying to connect undefined input port', child, ports[1]
+            sys.exit(1)
+
+        inputs[c][key] = (child, ports[1])
+        outputs[p].append((parent, ports[0], key, c))
+        key += 1
+
+    return subgraphs, inputs, outputs
+
+def connect_cut(pipe, inputs, outputs, inboxes, active=None, copies=False):
+    """Connects the cut edges of a part to the scheduler running it.
+
+    Edges leaving the part become L{Channel}s to the inbox of the
+    part they lead to. Edges arriving are given a L{Pype} each.
+
+    @see: L{split_graph}
+
+    @param pipe: The scheduler running the part (not started yet)
+    @type pipe: L{Scheduler}
+    @param inputs: The cut edges arriving in the part
+    @type inputs: dict
+    @param outputs: The cut edges leaving the part
+    @type outputs: list of tuples
+    @param inboxes: The inbox of every part
+    @type inboxes: list
+    @keyword active: The number of messages not finished yet
+    @type active: L{multiprocessing.Value}
+    @keyword copies: Pass clones of the data to the other parts
+    @type copies: Boolean
+    @return: dict of the arriving edges keyed on the cut edge
+    """
+    edges = {}
+    for key, (node, port) in inputs.items():
+        edges[key] = Pype()
+        pipe.connect_input(node, port, edges[key])
+
+    for node, port, key, part in outputs:
+        pipe.connect_output(node, port,
+                            Channel(inboxes[part], key, active, copies))
+    return edges
+
+class Partition(object):
+    """A part of a graph run by a worker of a L{ParallelScheduler}.
+
+    The worker waits on its inbox for data from the caller (sent to
+    its adapters) or from the channels of other workers and runs its
+    graph until idle. The worker finishing the last active message
+    tells the L{ParallelScheduler} every worker is idle.
+
+    Once its scheduler is built the worker acks 'started', or 'error'
+    with the traceback if that failed.
+    """
+    def __init__(self, index, graph, inputs, outputs, inboxes, acks, active,
+                    capacity=None, backend=None, fuse=True, copies=False):
+        """Class constructor
+
+        @param index: The position of this part in the scheduler
+        @type index: int
+        @param graph: The part of the graph run by this worker
+        @type graph: Python dict organized as a graph struct
+        @param inputs: The (component, port) fed by each cut edge
+                       arriving here, keyed on the edge
+        @type inputs: dict
+        @param outputs: The (component, port, edge, part) of each cut
+                        edge leaving this part
+        @type outputs: list of tuples
+        @param inboxes: The inbox of every part
+        @type inboxes: list
+        @param acks: The queue the scheduler is told on once every
+                     worker is idle
+        @type acks: L{Queue.Queue} or L{multiprocessing.Queue}
+        @param active: The number of messages not finished yet
+        @type active: L{multiprocessing.Value}
+        @keyword capacity: The default capacity of each edge
+        @type capacity: int
+        @keyword backend: The name of the execution backend
+        @type backend: String
+        @keyword fuse: Fuse linear chains of components into one stage
+        @type fuse: Boolean
+        @keyword copies: Pass clones of the data to the other workers
+        @type copies: Boolean
+        """
+        self.index = index
+        self.graph = graph
+        self.inputs = inputs
+        self.outputs = outputs
+        self.inboxes = inboxes
+        self.acks = acks
+        self.active = active
+        self.capacity = capacity
+        self.backend = backend
+        self.fuse = fuse
+        self.copies = copies
+
+    def run(self):
+        """The entry point of the worker thread or process.
+
+        The scheduler is created here so the micro-threads live in
+        the worker running them.
+
+        @return: Nothing
+        """
+        try:
+            pipe = Scheduler(self.graph, self.capacity,
+                            get_backend(self.backend), self.fuse, start=False)
+            edges = connect_cut(pipe, self.inputs, self.outputs,
+                                self.inboxes, self.active, self.copies)
+            pipe.start()
+        except:
+            self.acks.put(('error', self.index, traceback.format_exc()))
+            return
+        self.acks.put(('started', self.index, None))
+
+        inbox = self.inboxes[self.index]
+        while True:
+            kind, key, batch = inbox.get()
+            if kind == 'stop':
+                break
+            if kind == 'metrics':
+                self.acks.put(('metrics', self.index,
+                               (pipe.get_metrics(), pipe.get_wakeup_stats())))
+                continue
+            if kind == 'parameters':
+                pipe.set_parameters(batch)
+                self.acks.put(('parameters', self.index, None))
+                continue
+
+            try:
+                if key is None:
+                    pipe.send_batch(batch)
+                else:
+                    edges[key].send_batch(batch)
+                    pipe.drain()
+            except:
+                print 'OOPS! - Component Failure'
+                traceback.print_exc()
+
+            self.active.get_lock().acquire()
+            try:
+                self.active.value -= 1
+                idle = self.active.value == 0
+            finally:
+                self.active.get_lock().release()
+            if idle:
+                self.acks.put(('idle', self.index, None))
+
+class ParallelScheduler(object):
+    """Runs a data flow graph split across worker threads or processes.
+
+    Provides the interface of a L{Scheduler}. Sending data returns
+    once every worker is idle again. The scheduler should only be
+    used by the thread that created it.
+
+    The constructor returns once every worker is running. It raises
+    RuntimeError if a worker fails to build its part of the graph,
+    as does any call waiting on a worker that has exited.
+    """
+    def __init__(self, graph, workers=2, costs=None, cut_cost=DEFAULT_CUT_COST,
+                 capacity=None, backend=None, fuse=True, processes=False):
+        """Class constructor
+
+        @param graph: The graph representing the work flow
+        @type graph: Python dict organized as a graph struct
+        @keyword workers: The largest number of workers to start
+        @type workers: int
+        @keyword costs: Seconds per document of each component
+                        (see L{partition_graph} and L{component_costs})
+        @type costs: dict
+        @keyword cut_cost: Seconds per document for each edge cut
+        @type cut_cost: float
+        @keyword capacity: The default capacity of each edge
+        @type capacity: int
+        @keyword backend: The name of the execution backend
+        @type backend: String
+        @keyword fuse: Fuse linear chains of components into one stage
+        @type fuse: Boolean
+        @keyword processes: Run the workers as processes instead of threads
+        @type processes: Boolean
+        @raise RuntimeError: if a worker fails to start
+        """
+        # fail early rather than inside each worker
+        get_backend(backend)
+
+        self.partitions = partition_graph(graph, workers, costs, cut_cost)
+        self.nodes = [node for part in self.partitions for node in part]
+
+        if processes:
+            Inbox, Worker = multiprocessing.Queue, multiprocessing.Process
+        else:
+            Inbox, Worker = queue.Queue, threading.Thread
+        self.inboxes = [Inbox() for part in self.partitions]
+        self.acks = Inbox()
+        self.active = multiprocessing.Value('l', 0)
+
+        # threads share memory so the documents they pass are cloned
+        self.copies = not processes
+
+        subgraphs, inputs, outputs = split_graph(graph, self.partitions)
+
+        # only the parts with adapters accepting the data are sent it
+        self.router = Router([(n, i) for i, part in enumerate(self.partitions)
+                                    for n in part if n.get_type() == 'ADAPTER'])
+
+        self.workers = []
+        for i in range(len(self.partitions)):
+            part = Partition(i, subgraphs[i], inputs[i], outputs[i],
+                             self.inboxes, self.acks, self.active,
+                             capacity, backend, fuse, self.copies)
+            worker = Worker(target=part.run)
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+        self._running = False
+
+        # wait for every worker to build its part of the graph
+        try:
+            started = 0
+            while started < len(self.workers):
+                kind, index, value = self._get_ack()
+                if kind == 'error':
+                    raise RuntimeError('Worker %d failed to start:\n%s' % \
+                                                            (index, value))
+                started += 1
+        except:
+            self._stop()
+            raise
+
+    def _get_ack(self):
+        """Returns the next (kind, index, value) ack of the workers.
+
+        @raise RuntimeError: if a worker exits while waiting
+        """
+        while True:
+            try:
+                return self.acks.get(True, POLL_INTERVAL)
+            except queue.Empty:
+                for i, worker in enumerate(self.workers):
+                    if not worker.is_alive():
+                        raise RuntimeError('Worker %d has exited' % i)
+
+    def _stop(self):
+        """Tells every worker to stop once it has finished its inbox.
+        """
+        for inbox in self.inboxes:
+            inbox.put(('stop', None, None))
+
+    def send(self, data):
+        """Feeds data to the input adapters accepting it and runs the graph
+        until idle.
+
+        @param data: The data being sent
+        @type data: Application Specific
+        @return: nothing
+        """
+        self.send_batch([data])
+
+    def send_batch(self, batch):
+        """Feeds a list of data to the input adapters accepting it and runs
+        the graph until idle.
+
+        @param batch: The data being sent
+        @type batch: list
+        @return: nothing
+        """
+        groups = self.router.route_batch(batch)
+        if not groups:
+            return
+
+        self.active.get_lock().acquire()
+        try:
+            self.active.value += len(groups)
+        finally:
+            self.active.get_lock().release()
+
+        # a document sent to more than one thread is cloned for
+        # every thread but the first
+        if self.copies and len(groups) > 1:
+            sent = set()
+            for j, (i, items) in enumerate(groups):
+                groups[j] = (i, [clone(x) if id(x) in sent else x \
+                                                        for x in items])
+                sent.update([id(x) for x in items])
+
+        self._running = True
+        for i, items in groups:
+            self.inboxes[i].put(('data', None, items))
+        self.drain()
+
+    def drain(self):
+        """Waits until every worker is idle with nothing left to pass on.
+
+        @return: nothing
+        """
+        while self._running:
+            kind, index, value = self._get_ack()
+            if kind == 'idle':
+                self._running = False
+
+    def _collect(self):
+        """Returns the (metrics, wakeup stats) reported by every worker.
+        """
+        self.drain()
+        for inbox in self.inboxes:
+            inbox.put(('metrics', None, None))
+
+        reports = []
+        while len(reports) < len(self.inboxes):
+            kind, index, value = self._get_ack()
+            if kind == 'metrics':
+                reports.append(value)
+        return reports
+
+    def set_parameters(self, parameters):
+        """Sets the parameters of components in every worker.
+
+        Returns once every worker has applied them.
+
+        @see: L{Scheduler.set_parameters}
+
+        @param parameters: {name: value} dicts keyed on the component
+        @type parameters: dict
+        @return: Nothing
+        """
+        self.drain()
+        for inbox in self.inboxes:
+            inbox.put(('parameters', None, parameters))
+
+        applied = 0
+        while applied < len(self.inboxes):
+            kind, index, value = self._get_ack()
+            if kind == 'parameters':
+                applied += 1
+
+    def get_wakeup_stats(self):
+        """Returns the scheduler counters summed over every worker.
+
+        @see: L{Scheduler.get_wakeup_stats}
+
+        @return: dict
+        """
+        totals = {'wakeups': 0, 'idle_wakeups': 0}
+        for metrics, stats in self._collect():
+            for key, value in stats.items():
+                totals[key] += value
+        return totals
+
+    def get_metrics(self):
+        """Returns the metrics of every component keyed on the component.
+
+        @see: L{Scheduler.get_metrics}
+
+        @return: dict
+        """
+        result = {}
+        for metrics, stats in self._collect():
+            result.update(metrics)
+        return result
+
+    def close(self):
+        """Stops the workers once they have finished what they were sent.
+
+        @return: nothing
+        """
+        self.drain()
+        self._stop()
+        for worker in self.workers:
+            worker.join()
+
+if __name__ == '__main__':
+    # Run the doctests
+    import doctest
+    doctest.testmod(sys.modules['__main__'])
@@ -10,41 +10,388 @@ of the data flow model is run on a different CPU/core. At the same
 time, it provides an abstraction making the pool appear as a single
 unified entity. 
 
-Data fed is actually load balanced in a round-robin fashion across
-all instances in the workflow pool.
+Data fed is load balanced across all instances in the workflow pool.
+Every instance reads from the same queue so whichever instance is
+idle takes the next item.
+
+A L{StagedDataflow} runs each stage of the graph in a pool of its own
+instead, so an expensive stage can be given more processes than a
+cheap one.
+
+An optional memory budget bounds the bytes held in flight (queued
+or being processed) by the pool. Data reports its size through a
+get_size() method, see L{item_size}.
+
+The execution backend running the components of each instance
+(stackless, greenlet or generator) is selected when the Dataflow
+is constructed. See L{pypes.backend}. Each instance may also split
+its graph across several processes so independent branches run in
+parallel. See L{pypes.parallel}.
 
 Uses the L{multiprocessing} module and requires Python >= 2.6
+
+Run this module directly to run the doctests (unittests). The examples
+run a graph of an adapter and a publisher that passes what it receives
+back on a queue, tagged with the name of its graph:
+
+    >>> from multiprocessing import Queue
+    >>> from component import Component
+    >>> class Source(Component):
+    ...     __metatype__ = 'ADAPTER'
+    ...     def process(self, docs):
+    ...         return docs
+    >>> class Sink(Component):
+    ...     __metatype__ = 'PUBLISHER'
+    ...     def __init__(self, out, tag, delay):
+    ...         Component.__init__(self)
+    ...         self.remove_output('out')
+    ...         self.out, self.tag, self.delay = out, tag, delay
+    ...     def process(self, docs):
+    ...         for doc in docs:
+    ...             time.sleep(self.delay)
+    ...             self.out.put((self.tag, doc))
+    ...         return []
+    >>> def graph(out, tag='graph', delay=0):
+    ...     return {Source(): {Sink(out, tag, delay): ('out', 'in')}}
+    >>> def received(out, n):
+    ...     return sorted([out.get(True, 10) for i in range(n)])
+    >>> def wait_for(test, timeout=10):
+    ...     deadline = time.time() + timeout
+    ...     while not test() and time.time() < deadline:
+    ...         time.sleep(0.01)
+    ...     return test()
+    >>> def shutdown(flow):
+    ...     flow.close()
+    ...     for p in flow.processes:
+    ...         p.process.join()
+
+Swapping the graph while data is being sent loses or repeats nothing
+and the old instances exit once they have run what was queued before
+the switch (see L{Dataflow.swap}):
+
+    >>> out = Queue()
+    >>> flow = Dataflow(graph(out, 'old'), 2, backend='generator')
+    >>> old = list(flow.processes)
+    >>> def send():
+    ...     for i in range(200):
+    ...         flow.send(i)
+    ...         time.sleep(0.005)
+    >>> sender = threading.Thread(target=send)
+    >>> sender.start()
+    >>> time.sleep(0.2)
+    >>> flow.swap(graph(out, 'new'))
+    >>> sender.join()
+    >>> docs = received(out, 200)
+    >>> sorted([i for tag, i in docs]) == range(200), out.empty()
+    (True, True)
+    >>> sorted(set([tag for tag, i in docs]))
+    ['new', 'old']
+    >>> wait_for(lambda: not [p for p in old if p.process.is_alive()])
+    True
+    >>> shutdown(flow)
+
+A L{StagedDataflow} starts the stages of the new graph and drains the
+old ones stage by stage:
+
+    >>> flow = StagedDataflow(graph(out, 'old'), backend='generator',
+    ...                       fuse=False)
+    >>> old = list(flow.processes)
+    >>> len(old)
+    2
+    >>> sender = threading.Thread(target=send)
+    >>> sender.start()
+    >>> time.sleep(0.2)
+    >>> flow.swap(graph(out, 'new'))
+    >>> sender.join()
+    >>> docs = received(out, 200)
+    >>> sorted([i for tag, i in docs]) == range(200), out.empty()
+    (True, True)
+    >>> sorted(set([tag for tag, i in docs]))
+    ['new', 'old']
+    >>> wait_for(lambda: not [p for p in old if p.process.is_alive()])
+    True
+    >>> shutdown(flow)
+
+With a memory budget, data that does not fit is refused (or waits for
+room) and the bytes are given back once the data has been processed
+or the instance holding it has died:
+
+    >>> out = Queue()
+    >>> flow = Dataflow(graph(out, delay=0.5), 2, backend='generator',
+    ...                 memory_budget=5)
+    >>> flow.send('x' * 8)
+    >>> flow.send('y' * 8, block=False)
+    Traceback (most recent call last):
+    ...
+    MemoryBudgetExceeded: 8 bytes do not fit, 8 of 10 bytes in flight
+    >>> out.get(True, 10)
+    ('graph', 'xxxxxxxx')
+    >>> wait_for(lambda: flow.get_in_flight() == 0)
+    True
+    >>> flow.send('z' * 8)
+    >>> wait_for(lambda: sum([p.holding.value for p in flow.processes]) == 8)
+    True
+    >>> victim = [p for p in flow.processes if p.holding.value][0]
+    >>> victim.process.terminate()
+    >>> victim.process.join()
+    >>> flow.get_in_flight()
+    8
+    >>> flow.send('w' * 8, block=False)
+    >>> out.get(True, 10)
+    ('graph', 'wwwwwwww')
+    >>> wait_for(lambda: flow.get_in_flight() == 0)
+    True
+    >>> shutdown(flow)
+
+Spare instances are started ahead of time but read nothing until
+L{Dataflow.add_process} moves one into the pool, a replacement is then
+started in the background:
+
+    >>> out = Queue()
+    >>> flow = Dataflow(graph(out, delay=0.5), 1, backend='generator',
+    ...                 spares=1)
+    >>> spare = flow._spares[0]
+    >>> wait_for(spare.ready.is_set), spare.release.is_set()
+    (True, False)
+    >>> flow.send('a')
+    >>> flow.send('b')
+    >>> received(out, 2)
+    [('graph', 'a'), ('graph', 'b')]
+    >>> spare.processed.value
+    0
+    >>> flow.add_process()
+    >>> flow.processes[-1] is spare, spare.release.is_set()
+    (True, True)
+    >>> wait_for(lambda: len(flow._spares) == 1)
+    True
+    >>> flow._spares[0] is not spare
+    True
+    >>> flow.send('c')
+    >>> flow.send('d')
+    >>> received(out, 2)
+    [('graph', 'c'), ('graph', 'd')]
+    >>> wait_for(lambda: spare.processed.value == 1)
+    True
+    >>> shutdown(flow)
+
+With a batch size, documents are sent as soon as a batch is full and
+the rest of a partial batch once it has waited batch_timeout
+milliseconds:
+
+    >>> out = Queue()
+    >>> flow = Dataflow(graph(out), 1, backend='generator', batch_size=3,
+    ...                 batch_timeout=500)
+    >>> for i in range(4):
+    ...     flow.send(i)
+    >>> [out.get(True, 10) for i in range(3)], list(flow._batch)
+    ([('graph', 0), ('graph', 1), ('graph', 2)], [3])
+    >>> start = time.time()
+    >>> out.get(True, 10), list(flow._batch)
+    (('graph', 3), [])
+    >>> time.time() - start > 0.1
+    True
+    >>> shutdown(flow)
+
+L{Dataflow.flush} and L{Dataflow.close} send a partial batch without
+waiting:
+
+    >>> flow = Dataflow(graph(out), 1, backend='generator', batch_size=10,
+    ...                 batch_timeout=60000)
+    >>> flow.send('a')
+    >>> flow.send('b')
+    >>> flow.flush()
+    >>> received(out, 2)
+    [('graph', 'a'), ('graph', 'b')]
+    >>> flow.send('c')
+    >>> shutdown(flow)
+    >>> out.get(True, 10), out.empty()
+    (('graph', 'c'), True)
 """
-import stackless
+import copy
+import time
 import traceback
-from multiprocessing import Process, Pipe, Queue
+from Queue import Empty
+import threading
+from threading import Lock, Timer
+from multiprocessing import Process, Queue, Event, Value
+
+from scheduler import Scheduler, set_parameters
+from compiler import Stage, compile_graph
+from router import Router
+from parallel import ParallelScheduler, split_graph, connect_cut
+from backend import get_backend
+from autoscaler import Autoscaler
 
-from scheduler import sched
+# how often (in seconds) an idle instance checks if it has been stopped
+POLL_INTERVAL = 0.1
 
-def pipeline(graph):
-    """Initializes the main scheduling tasklet.
+# weight of the newest sample in the per instance latency average
+LATENCY_WEIGHT = 0.2
+
+# how often (in seconds) a busy instance reports its metrics
+METRICS_INTERVAL = 1.0
+
+# how often (in seconds) a sender blocked on the memory budget retries
+BUDGET_INTERVAL = 0.01
+
+# how many messages may wait on each stage's queue in a StagedDataflow
+DEFAULT_QUEUE_SIZE = 100
+
+# the queue results are published on inside an instance's process
+_results = None
+
+def publish_result(key, data):
+    """Returns data from a running instance to its L{Dataflow}.
+
+    Components call this (typically from a publisher) to hand a
+    result back to a caller waiting in L{Dataflow.wait_result}.
+    Nothing is published when the graph is not running inside a
+    L{Dataflow} instance.
+
+    @param key: The key the caller is waiting on (see L{Dataflow.expect})
+    @type key: String
+    @param data: The result
+    @type data: Application Specific
+    @return: True if the result was published
+    """
+    if _results is None:
+        return False
+    _results.put((key, data))
+    return True
+
+def pipeline(graph, capacity=None, backend=None, workers=None, costs=None):
+    """Initializes the scheduler for a graph.
 
     @param graph: The work flow graph 
     @type graph: Python dict organized as a graph
-    @return: L{stackless.channel}
+    @keyword capacity: The default capacity of each edge (None is unbounded)
+    @type capacity: int
+    @keyword backend: The name of the execution backend (None picks the
+                      first one available)
+    @type backend: String
+    @keyword workers: The number of processes the graph is split across
+                      (None or 1 runs it in the calling process)
+    @type workers: int
+    @keyword costs: The cost of each component used to split the graph
+                    (see L{pypes.parallel.partition_graph})
+    @type costs: dict
+    @return: L{Scheduler} or L{pypes.parallel.ParallelScheduler}
     """
-    ch = stackless.channel()
-    stackless.tasklet(sched)(ch, graph).run()
-    return ch
+    if workers > 1:
+        return ParallelScheduler(graph, workers, costs, capacity=capacity,
+                                 backend=backend, processes=True)
+    return Scheduler(graph, capacity, get_backend(backend))
+
+def item_size(data):
+    """Returns the approximate size in bytes of an item sent to a L{Dataflow}.
+
+    Items report their own size through a get_size() method (as the
+    studio's packets do), strings count their length and a L{Batch}
+    counts its documents. Anything else counts nothing.
+
+    @param data: The item
+    @type data: Application Specific
+    @return: int
+    """
+    if isinstance(data, Batch):
+        return sum([item_size(item) for item in data])
+    if isinstance(data, basestring):
+        return len(data)
+    get_size = getattr(data, 'get_size', None)
+    if get_size is None:
+        return 0
+    return get_size()
+
+def release_holding(in_flight, holding):
+    """Takes the bytes an instance holds off the in flight count.
+
+    @param in_flight: the bytes held in flight by the pool
+    @type in_flight: L{multiprocessing.Value}
+    @param holding: the bytes held by the instance
+    @type holding: L{multiprocessing.Value}
+    @return: the bytes taken off
+    """
+    in_flight.get_lock().acquire()
+    try:
+        size = holding.value
+        holding.value = 0
+        in_flight.value -= size
+    finally:
+        in_flight.get_lock().release()
+    return size
+
+class MemoryBudgetExceeded(Exception):
+    """Raised when data does not fit in the memory budget of a L{Dataflow}"""
+    pass
+
+class Batch(list):
+    """A frame of documents sent to an L{Instance} as a single item.
+
+    Batches are created by a L{Dataflow} with batching enabled so
+    the documents in the frame are pickled and queued together.
+    """
+    pass
 
 class Instance:
     """Represents a single instance of a data flow model.
+
+    Every instance in a L{Dataflow} pool reads from the same shared
+    queue. An instance only takes the next item once it has finished
+    the previous one so idle instances pick up work ahead of busy ones.
+
+    The stop event and the latency average are shared with the
+    process running the instance. Component metrics are reported
+    on a separate queue (see L{Dataflow.get_metrics}).
+
+    When the L{Dataflow} has a memory budget the size of each item is
+    taken off the shared in flight count once it has been processed.
+    The size of the item being processed is kept in the holding value
+    so the L{Dataflow} can take it off if the instance dies mid-item.
+
+    Parameter updates (see L{Dataflow.set_parameters}) arrive on a
+    queue of the instance's own and are applied before the next item.
+
+    A spare instance builds its graph and waits until it is released
+    before reading the queue (see L{Dataflow.add_process}).
     """
-    def __init__(self, channel):
+    def __init__(self, channel, metrics=None, name=None, results=None,
+                                                in_flight=None, spare=False):
         """Class constructor
 
-        @param channel: the L{stackless.channel} this instance will listen on
-        @type channel: L{stackless.channel}
+        @param channel: the queue this instance will listen on
+        @type channel: L{multiprocessing.Queue}
+        @keyword metrics: the queue this instance reports its metrics on
+        @type metrics: L{multiprocessing.Queue}
+        @keyword name: identifies this instance in its metrics reports
+        @type name: String
+        @keyword results: the queue results are published on
+                          (see L{publish_result})
+        @type results: L{multiprocessing.Queue}
+        @keyword in_flight: the bytes held in flight by the pool
+        @type in_flight: L{multiprocessing.Value}
+        @keyword spare: Wait to be released before reading the queue
+        @type spare: Boolean
         """
-        self.sender, self.recipient = Pipe()
         self.channel = channel
+        self.metrics = metrics
+        self.results = results
+        self.in_flight = in_flight
+        self.name = name
+        self.process = None
+        self.stop = Event()
+        self.ready = Event()
+        self.release = Event()
+        if not spare:
+            self.release.set()
+        # parameter updates and the number sent so far
+        self.updates = Queue()
+        self.updated = Value('l', 0, lock=False)
+        self.holding = Value('l', 0, lock=False)
+        self.latency = Value('d', 0.0, lock=False)
+        self.processed = Value('l', 0, lock=False)
 
-    def execute(self, graph):
+    def execute(self, graph, capacity=None, backend=None, workers=None,
+                                                            costs=None):
         """This is the entry point for the process.
 
         This method will be forked into a separate process
@@ -53,64 +400,159 @@ class Instance:
 
         The actual pipeline must be created here so that it
         lives inside a separate process than teh caller. This
-        is vital to how the scheduling works in stackless Python.
+        is vital to how the scheduling works since micro-threads
+        can't be shared between processes.
 
         @see: L{Dataflow.add_process}
 
         @param graph: The data flow graph
         @type graph: dict
+        @keyword capacity: The default capacity of each edge
+        @type capacity: int
+        @keyword backend: The name of the execution backend
+        @type backend: String
+        @keyword workers: The number of processes the graph is split across
+        @type workers: int
+        @keyword costs: The cost of each component
+        @type costs: dict
         
         @return: Nothing
         """
-        pipe = pipeline(graph)
+        global _results
+        _results = self.results
+
+        pipe = pipeline(graph, capacity, backend, workers, costs)
         self._run(pipe)
 
     def _run(self, pipe):
         """The main loop that runs inside the new process.
 
-        This runs in an event loop waiting on data using
-        a L{multiprocessing.Pipe} which allows two processes
-        to communicate using shared memory.
+        This runs in an event loop waiting on data from the
+        shared L{multiprocessing.Queue}. Data is read straight
+        from the queue without passing through another process.
+
+        If no data is available then it blocks and waits. Data
+        is run through the graph until every component is idle
+        before waiting on the next item. A L{Batch} is unpacked
+        and fed to the graph in a single operation.
 
-        If no data is available then it blocks and waits.
+        The loop exits when it reads the terminate signal (-1) or
+        once the stop event is set. A stopped instance finishes the
+        item it is working on and leaves the rest of the queue to
+        the other instances.
 
-        @param pipe: The communcation channel used to wake this method
-        @type pipe: L{multiprocessing.Pipe}
+        @param pipe: The scheduler running the graph
+        @type pipe: L{Scheduler}
         @return: Nothing
         """
-        while True:
-            data = self.recipient.recv()
+        self._reported = 0
+        self._unreported = False
+        self._applied = 0
+        self.ready.set()
+        while not self.release.is_set() and not self.stop.is_set():
+            self.release.wait(POLL_INTERVAL)
+
+        while not self.stop.is_set():
+            try:
+                data = self.channel.get(True, POLL_INTERVAL)
+            except Empty:
+                self._update(pipe)
+                # report anything left over once the instance is idle
+                if self._unreported:
+                    self._report(pipe, True)
+                continue
             if data == -1:
                 break
+
+            # measured before the components change the data
+            if self.in_flight is not None:
+                self.holding.value = item_size(data)
+
             try:
-                pipe.send(data)
-            except:
-                print 'OOPS! - Component Failure'
-                traceback.print_exc()
+                self._update(pipe)
+
+                start = time.time()
+                try:
+                    self._feed(pipe, data)
+                except:
+                    print 'OOPS! - Component Failure'
+                    traceback.print_exc()
+                self._update_latency(time.time() - start)
+            finally:
+                if self.in_flight is not None:
+                    release_holding(self.in_flight, self.holding)
+            self._unreported = True
+            self._report(pipe)
 
-    def send(self):
-        """Sends data into the new process 
+        if self._unreported:
+            self._report(pipe, True)
 
-        This runs in an event loop waiting on data using
-        a L{multiprocessing.Queue}. When data arrives, it is
-        sent immediately into the new process using a
-        L{multiprocessing.Pipe}.
+    def _update(self, pipe):
+        """Applies the parameter updates waiting for this instance.
 
-        If no data is available then it blocks and waits.
+        @param pipe: The scheduler running the graph
+        @type pipe: L{Scheduler}
+        """
+        while self._applied < self.updated.value:
+            pipe.set_parameters(self.updates.get())
+            self._applied += 1
 
-        This method serves as a proxy that can shuttle
-        data from the main calling process to the newly
-        created process that was created using L{execute}
+    def _feed(self, pipe, data):
+        """Runs an item read from the queue through the graph.
 
-        @return: Nothing
+        @param pipe: The scheduler running the graph
+        @type pipe: L{Scheduler}
+        @param data: The item
+        @type data: Application Specific or L{Batch}
         """
-        while True:
-            data = self.channel.get()
-            if data == -1:
-                self.sender.send(-1)
-                break
-            else: 
-                self.sender.send(data)
+        if isinstance(data, Batch):
+            pipe.send_batch(data)
+        else:
+            pipe.send(data)
+
+    def _report(self, pipe, force=False):
+        """Sends a snapshot of this instance's metrics to the L{Dataflow}.
+
+        Snapshots are sent at most once every L{METRICS_INTERVAL}
+        seconds unless forced.
+
+        @param pipe: The scheduler running the graph
+        @type pipe: L{Scheduler}
+        @keyword force: Send the snapshot now
+        @type force: Boolean
+        """
+        if self.metrics is None:
+            return
+
+        now = time.time()
+        if not force and now - self._reported < METRICS_INTERVAL:
+            return
+
+        self.metrics.put((self.name, {'processed': self.processed.value,
+                                      'latency': self.latency.value,
+                                      'components': pipe.get_metrics()}))
+        self._reported = now
+        self._unreported = False
+
+    def _update_latency(self, elapsed):
+        """Adds an item's processing time to the latency average.
+
+        @param elapsed: The time taken to process the item in seconds
+        @type elapsed: float
+        """
+        if self.processed.value:
+            self.latency.value += LATENCY_WEIGHT * \
+                                  (elapsed - self.latency.value)
+        else:
+            self.latency.value = elapsed
+        self.processed.value += 1
+
+    def get_latency(self):
+        """Returns the average time in seconds this instance takes per item.
+
+        @return: float
+        """
+        return self.latency.value
 
 class Dataflow:
     """Provides an abstraction of a group of L{Instance}s.
@@ -122,8 +564,29 @@ class Dataflow:
 
     It uses L{multiprocessing.Queue} to send data to the
     instance pool.
+
+    Batching is opt-in. When a batch size is given documents are
+    held back and sent as a single L{Batch} once the batch is full
+    or the oldest document has waited for the batch timeout.
+
+    So is the memory budget. When one is given L{send} blocks (or
+    raises L{MemoryBudgetExceeded}) while the data queued or being
+    processed would take more than the budget of every instance in
+    the pool. The budget is shared by the pool: a busy instance may
+    hold more than its own share while others are idle. Data larger
+    than the whole budget is accepted once nothing else is in flight.
+    The bytes held by instances that died mid-item, and by data left
+    on the queue of a swapped out pool that has exited, are given back
+    while a sender waits for room.
+
+    The graph can be replaced while data is being sent, see L{swap}.
+
+    Spare instances can be kept forked and ready so growing the pool
+    does not wait for a new process to start, see L{add_process}.
     """
-    def __init__(self, graph, n=1):
+    def __init__(self, graph, n=1, capacity=None, backend=None,
+                    batch_size=None, batch_timeout=10, memory_budget=None,
+                    workers=None, costs=None, spares=0):
         """Class constructor
 
         @param graph: the data model in graph notation
@@ -133,26 +596,252 @@ class Dataflow:
                   available on the architecture running the code.
                   Defaults to 1
         @type n: int
+        @keyword capacity: The default capacity of each edge in the graph.
+                           Components block when sending to a full edge.
+                           Defaults to None (unbounded)
+        @type capacity: int
+        @keyword backend: The execution backend used by each instance
+                          ('stackless', 'greenlet' or 'generator').
+                          Defaults to None (the first one available)
+        @type backend: String
+        @keyword batch_size: The maximum number of documents sent in a
+                             single L{Batch}. Defaults to None (no batching)
+        @type batch_size: int
+        @keyword batch_timeout: The longest time in milliseconds a document
+                                waits for its batch to fill. Defaults to 10
+        @type batch_timeout: int
+        @keyword memory_budget: The bytes in flight each instance adds to
+                                the budget of the pool, which is shared by
+                                all the instances (see L{item_size}).
+                                Defaults to None (no budget)
+        @type memory_budget: int
+        @keyword workers: The number of processes each instance splits its
+                          graph across. Defaults to None (one)
+        @type workers: int
+        @keyword costs: The seconds per document of each component used
+                        to split the graph, keyed on str(hash(component))
+                        as in L{get_metrics} (see
+                        L{pypes.parallel.component_costs}). Defaults to
+                        None (every component costs the same)
+        @type costs: dict
+        @keyword spares: The number of instances kept started and waiting
+                         to join the pool. Defaults to 0
+        @type spares: int
         """
         self.queue = Queue()
         self.pipeline = graph
         self.size = n
+        self.capacity = capacity
+        self.backend = backend
+        self.batch_size = batch_size
+        self.batch_timeout = batch_timeout
+        self.memory_budget = memory_budget
+        self.workers = workers
+        self.costs = costs
+        self.spares = spares
+
         self.processes = []
+        self._spares = []
+
+        # instances stopped while they may still hold an item and the
+        # queues of swapped out pools with the instances reading them
+        self._retired = []
+        self._old_queues = []
+
+        # bytes sent but not yet processed by an instance
+        self.in_flight = None
+        if memory_budget:
+            self.in_flight = Value('l', 0)
+
+        # documents waiting to be sent as a batch, the lock also
+        # guards switching the queue (see swap)
+        self._batch = Batch()
+        self._batch_lock = Lock()
+        self._batch_timer = None
+
+        # guards the pool against concurrent resizing
+        self._pool_lock = Lock()
+        self.autoscaler = None
+
+        # the latest metrics reported by each instance
+        self.metrics_queue = Queue()
+        self._metrics = {}
+        self._instances = 0
+
+        # callers waiting on results published by the instances
+        self.results_queue = Queue()
+        self._waiters = {}
+        self._waiters_lock = Lock()
+        self._dispatcher = None
+
+        # fail early rather than inside each instance
+        get_backend(backend)
 
         for i in range(self.size):
             self.add_process()
+        self._fill_spares()
 
-    def send(self, data):
+    def send(self, data, block=True, timeout=None):
         """Sends data to the next available L{Instance}
         
-        Uses a stackless channel to communicate with the
-        L{Instance} tasklet.
+        Uses a L{multiprocessing.Queue} to communicate with the
+        L{Instance} processes. Each instance reads the queue directly
+        so the data is only pickled once on its way to the instance.
+
+        When batching is enabled the data is added to the current
+        batch instead and sent when the batch is flushed.
+
+        When a memory budget is set and the data does not fit, the
+        call waits for the instances to make room unless block is
+        False.
 
         @see: L{add_process}
         @param data: The data being sent
         @type data: Application Specific
+        @keyword block: Wait for room in the memory budget
+        @type block: Boolean
+        @keyword timeout: The longest time to wait in seconds
+                          (None waits forever)
+        @type timeout: float
+        @raise MemoryBudgetExceeded: if the data did not fit in time
+        """
+        if self.in_flight is not None:
+            self._reserve(item_size(data), block, timeout)
+
+        if self.batch_size is None:
+            self._batch_lock.acquire()
+            try:
+                self._put(data)
+            finally:
+                self._batch_lock.release()
+            return
+
+        self._batch_lock.acquire()
+        try:
+            self._batch.append(data)
+            if len(self._batch) >= self.batch_size:
+                self._flush()
+            elif self._batch_timer is None:
+                self._batch_timer = Timer(self.batch_timeout / 1000.0,
+                                          self.flush)
+                self._batch_timer.setDaemon(True)
+                self._batch_timer.start()
+        finally:
+            self._batch_lock.release()
+
+    def _reserve(self, size, block, timeout):
+        """Adds data to the in flight count once it fits in the budget.
+
+        @param size: The size of the data in bytes
+        @type size: int
+        @param block: Wait for room in the budget
+        @type block: Boolean
+        @param timeout: The longest time to wait in seconds (None is forever)
+        @type timeout: float
+        @raise MemoryBudgetExceeded: if the data did not fit in time
         """
-        self.queue.put(data)
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+
+        lock = self.in_flight.get_lock()
+        while True:
+            limit = self.memory_budget * max(len(self.processes), 1)
+            lock.acquire()
+            try:
+                if self.in_flight.value <= 0 or \
+                                    self.in_flight.value + size <= limit:
+                    self.in_flight.value += size
+                    return
+                in_flight = self.in_flight.value
+            finally:
+                lock.release()
+
+            # room may be held by instances that are gone
+            if self._reap():
+                continue
+
+            if not block or (deadline is not None and time.time() >= deadline):
+                raise MemoryBudgetExceeded('%d bytes do not fit, %d of %d '
+                                'bytes in flight' % (size, in_flight, limit))
+            time.sleep(BUDGET_INTERVAL)
+
+    def _reap(self):
+        """Gives back the budget held by instances that have exited.
+
+        An instance killed mid-item never takes its item off the in
+        flight count and the data left on the queue of a swapped out
+        pool is never processed once the pool has exited.
+
+        @return: the bytes given back
+        """
+        released = 0
+        self._pool_lock.acquire()
+        try:
+            for p in self.processes + self._retired:
+                if p.in_flight is not None and p.holding.value and \
+                                            not p.process.is_alive():
+                    released += release_holding(self.in_flight, p.holding)
+            self._retired = [p for p in self._retired \
+                                        if p.process.is_alive()]
+
+            for queue, pool in self._old_queues[:]:
+                if [p for p in pool if p.process.is_alive()]:
+                    continue
+                self._old_queues.remove((queue, pool))
+                size = 0
+                try:
+                    while True:
+                        data = queue.get_nowait()
+                        if data != -1:
+                            size += item_size(data)
+                except Empty:
+                    pass
+                if size:
+                    self.in_flight.get_lock().acquire()
+                    try:
+                        self.in_flight.value -= size
+                    finally:
+                        self.in_flight.get_lock().release()
+                    released += size
+        finally:
+            self._pool_lock.release()
+        return released
+
+    def get_in_flight(self):
+        """Returns the bytes sent but not yet processed by an instance.
+
+        @return: int or None if there is no memory budget
+        """
+        if self.in_flight is None:
+            return None
+        return self.in_flight.value
+
+    def flush(self):
+        """Sends any documents waiting in the current batch.
+
+        @return: Nothing
+        """
+        self._batch_lock.acquire()
+        try:
+            self._flush()
+        finally:
+            self._batch_lock.release()
+
+    def _flush(self):
+        """Sends the current batch. The caller must hold the batch lock.
+        """
+        if self._batch_timer is not None:
+            self._batch_timer.cancel()
+            self._batch_timer = None
+        if self._batch:
+            self._put(self._batch)
+            self._batch = Batch()
+
+    def _put(self, item):
+        """Queues an item (data or a L{Batch}) for the instances.
+        """
+        self.queue.put(item)
 
     def close(self):
         """ Shuts down this workflow and all associated L{Instance}s
@@ -163,28 +852,821 @@ class Dataflow:
 
         This should lead to a clean shutdown based on the shear nature
         of stackless tasklets. Any data will be flushed (completed) before
-        exiting.
+        exiting, including documents waiting in the current batch.
         """
+        if self.autoscaler is not None:
+            self.autoscaler.stop()
+            self.autoscaler = None
+
+        self._pool_lock.acquire()
+        try:
+            self.spares = 0
+            self._retire_spares()
+        finally:
+            self._pool_lock.release()
+
+        self.flush()
         for p in self.processes:
             self.queue.put(-1)
 
+        if self._dispatcher is not None:
+            self.results_queue.put(-1)
+            self._dispatcher = None
+
+    def expect(self, key):
+        """Registers interest in a result before the data is sent.
+
+        The result is published from inside an instance with
+        L{publish_result} and collected with L{wait_result}.
+
+        @param key: The key the result will be published with
+        @type key: String
+        @return: Nothing
+        """
+        self._waiters_lock.acquire()
+        try:
+            self._waiters[key] = [threading.Event(), None]
+            if self._dispatcher is None:
+                self._dispatcher = threading.Thread(target=self._dispatch)
+                self._dispatcher.setDaemon(True)
+                self._dispatcher.start()
+        finally:
+            self._waiters_lock.release()
+
+    def wait_result(self, key, timeout=None):
+        """Waits for the result published with a key.
+
+        @see: L{expect}
+
+        @param key: The key passed to L{expect}
+        @type key: String
+        @keyword timeout: The longest time to wait in seconds (None waits forever)
+        @type timeout: float
+        @return: The result or None if it did not arrive in time
+        """
+        self._waiters_lock.acquire()
+        try:
+            waiter = self._waiters[key]
+        finally:
+            self._waiters_lock.release()
+
+        waiter[0].wait(timeout)
+
+        self._waiters_lock.acquire()
+        try:
+            self._waiters.pop(key, None)
+        finally:
+            self._waiters_lock.release()
+        return waiter[1]
+
+    def _dispatch(self):
+        """Hands the results published by the instances to their waiters.
+
+        Results nobody is waiting on (anymore) are dropped.
+        """
+        while True:
+            item = self.results_queue.get()
+            if item == -1:
+                break
+            key, data = item
+
+            self._waiters_lock.acquire()
+            try:
+                waiter = self._waiters.get(key)
+                if waiter is not None and not waiter[0].is_set():
+                    waiter[1] = data
+                    waiter[0].set()
+            finally:
+                self._waiters_lock.release()
+
     def add_process(self):
         """Adds a new process (L{Instance} to the Dataflow pool.
 
         Creates a new L{Instance} and runs it inside a L{multiprocessing.Process}
+
+        When the Dataflow keeps spares the oldest one joins the pool
+        instead and a replacement is started in the background.
         """
-        process = Instance(self.queue)
-        self.processes.append(process)
-        Process(target=process.send).start()
-        Process(target=process.execute, args=(self.pipeline,)).start()
+        self._pool_lock.acquire()
+        try:
+            if self._spares:
+                process = self._spares.pop(0)
+                process.release.set()
+            else:
+                process = self._start_instance(self.queue, self.pipeline,
+                                               self.workers, self.costs)
+            self.processes.append(process)
+        finally:
+            self._pool_lock.release()
+
+        # the replacement starts once the new instance has got going
+        if self.spares:
+            filler = Timer(POLL_INTERVAL, self._fill_spares)
+            filler.setDaemon(True)
+            filler.start()
+
+    def _fill_spares(self):
+        """Starts spare instances until there are as many as configured.
+        """
+        self._pool_lock.acquire()
+        try:
+            while len(self._spares) < self.spares:
+                self._spares.append(self._start_instance(self.queue,
+                            self.pipeline, self.workers, self.costs, True))
+        finally:
+            self._pool_lock.release()
+
+    def _retire_spares(self):
+        """Stops the spare instances. The caller must hold the pool lock.
+        """
+        for p in self._spares:
+            p.stop.set()
+        self._spares = []
+
+    def _start_instance(self, queue, graph, workers, costs, spare=False):
+        """Starts an L{Instance} running a graph on the items of a queue.
+        """
+        self._instances += 1
+        process = Instance(queue, self.metrics_queue,
+                           'instance-%d' % self._instances, self.results_queue,
+                           self.in_flight, spare)
+        process.process = Process(target=process.execute,
+                        args=(graph, self.capacity, self.backend,
+                              workers, costs))
+        process.process.start()
+        return process
+
+    def swap(self, graph, workers=None, costs=None):
+        """Replaces the graph run by the pool without stopping ingest.
+
+        A new pool of the same size is started on the new graph, reading
+        a queue of its own. Once every new instance is running, the
+        current batch is flushed to the old queue and data sent from
+        then on is queued for the new pool. The old instances finish
+        everything queued before the switch and exit. The memory budget
+        and the results being waited on carry over.
+
+        If a new instance fails to start the old pool keeps running.
 
-    def remove_process(self):
+        @param graph: the new data model in graph notation
+        @type graph: dict
+        @keyword workers: The number of processes each instance splits its
+                          graph across. Defaults to the current number
+        @type workers: int
+        @keyword costs: The cost of each component. Defaults to the
+                        current costs
+        @type costs: dict
+        @raise RuntimeError: if a new instance exits before it is running
+        @return: Nothing
+        """
+        if workers is None:
+            workers = self.workers
+        if costs is None:
+            costs = self.costs
+
+        queue = Queue()
+        self._pool_lock.acquire()
+        try:
+            started = []
+            try:
+                for i in range(max(len(self.processes), 1)):
+                    started.append(self._start_instance(queue, graph,
+                                                        workers, costs))
+                for p in started:
+                    while not p.ready.is_set():
+                        if not p.process.is_alive():
+                            raise RuntimeError('%s exited before it started'
+                                                                    % p.name)
+                        p.ready.wait(POLL_INTERVAL)
+            except:
+                for p in started:
+                    queue.put(-1)
+                raise
+
+            self._batch_lock.acquire()
+            try:
+                self._flush()
+                old_queue, old = self.queue, self.processes
+                self.queue, self.processes = queue, started
+                self.pipeline, self.workers, self.costs = graph, workers, costs
+            finally:
+                self._batch_lock.release()
+
+            # spares run the old graph
+            self._retire_spares()
+            if self.in_flight is not None:
+                self._retired.extend(old)
+                self._old_queues.append((old_queue, old))
+        finally:
+            self._pool_lock.release()
+
+        # the old pool exits once it has run what was queued before
+        for p in old:
+            old_queue.put(-1)
+        self._fill_spares()
+
+    def remove_process(self, wait=False):
         """Removes an instance from the Dataflow pool.
 
-        Shuts down one instance in the pool.
-        @todo: Which Instance do we stop? Right now it's the last that was added
-               which may be good enough. What if it's the only instance?
+        Shuts down the instance that was added last. The instance
+        finishes the item it is working on and exits without taking
+        anything else off the queue. The last instance in the pool
+        is never removed.
+
+        @keyword wait: Wait for the instance to exit before returning
+        @type wait: Boolean
+        @return: The removed L{Instance} or None
+        """
+        self._pool_lock.acquire()
+        try:
+            if len(self.processes) < 2:
+                return None
+            process = self.processes.pop()
+            process.stop.set()
+            if self.in_flight is not None:
+                self._retired.append(process)
+        finally:
+            self._pool_lock.release()
+
+        if wait:
+            process.process.join()
+        return process
+
+    def set_parameters(self, parameters):
+        """Sets the parameters of components without restarting the pool.
+
+        Every instance applies the parameters before it takes its next
+        item. Instances added later start with them.
+
+        @see: L{Scheduler.set_parameters}
+
+        @param parameters: {name: value} dicts keyed on
+                           str(hash(component)) as in L{get_metrics}
+        @type parameters: dict
+        @return: Nothing
+        """
+        nodes = set(self.pipeline)
+        for children in self.pipeline.values():
+            nodes.update(children)
+        set_parameters(nodes, parameters)
+
+        self._pool_lock.acquire()
+        try:
+            for p in self.processes + self._spares:
+                p.updates.put(parameters)
+                p.updated.value += 1
+        finally:
+            self._pool_lock.release()
+
+    def get_queue_depth(self):
+        """Returns the number of items waiting on the shared queue.
+
+        @return: int or None if the platform can't report it
+        """
+        try:
+            return self.queue.qsize()
+        except NotImplementedError:
+            return None
+
+    def get_latency(self):
+        """Returns the average time in seconds an instance takes per item.
+
+        Only instances that have processed something are counted.
+
+        @return: float
         """
-        process = self.processes.pop()
-        self.queue.put(-1)
+        latencies = [p.get_latency() for p in self.processes \
+                                                if p.processed.value]
+        if not latencies:
+            return 0.0
+        return sum(latencies) / len(latencies)
+
+    def get_metrics(self):
+        """Returns the metrics of the instances in the pool.
+
+        Each instance reports its component metrics at most once a
+        second while it is busy and once more when it goes idle. The
+        components are keyed on str(hash(component)) of the graph the
+        Dataflow was created with and their counters are summed over
+        the instances. Edge statistics are summed as well except for
+        the high water mark which is the largest of any instance.
+
+        @see: L{Component.get_metrics}
+
+        @return: dict
+        """
+        try:
+            while True:
+                name, snapshot = self.metrics_queue.get_nowait()
+                self._metrics[name] = snapshot
+        except Empty:
+            pass
+
+        live = set(p.name for p in self.processes)
+        instances = {}
+        components = {}
+        for name, snapshot in self._metrics.items():
+            if name not in live:
+                continue
+            instances[name] = {'processed': snapshot['processed'],
+                               'latency': snapshot['latency']}
+            for key, metrics in snapshot['components'].items():
+                if key in components:
+                    _add_metrics(components[key], metrics)
+                else:
+                    components[key] = copy.deepcopy(metrics)
+
+        return {'queue_depth': self.get_queue_depth(),
+                'in_flight': self.get_in_flight(),
+                'instances': instances,
+                'components': components}
+
+    def autoscale(self, min_size=1, max_size=None, **kwargs):
+        """Starts resizing the pool based on the load.
+
+        @see: L{Autoscaler}
+
+        @keyword min_size: The smallest pool size
+        @type min_size: int
+        @keyword max_size: The largest pool size (defaults to the CPU count)
+        @type max_size: int
+        @return: L{Autoscaler}
+        """
+        if self.autoscaler is not None:
+            self.autoscaler.stop()
+        self.autoscaler = Autoscaler(self, min_size, max_size, **kwargs)
+        self.autoscaler.start()
+        return self.autoscaler
+
+class StageInstance(Instance):
+    """Represents a replica of one stage of a L{StagedDataflow}.
+
+    The replicas of a stage read from the stage's queue. Stages with
+    adapters read the data sent to the L{StagedDataflow}. Other stages
+    read the batches their parents send on the L{pypes.parallel.Channel}s
+    connecting the stages.
+    """
+    def __init__(self, channel, inputs, outputs, queues, metrics=None,
+                                name=None, results=None, in_flight=None):
+        """Class constructor
+
+        @param channel: the queue of this stage
+        @type channel: L{multiprocessing.Queue}
+        @param inputs: The edges arriving from other stages
+                       (see L{pypes.parallel.split_graph})
+        @type inputs: dict
+        @param outputs: The edges leaving for other stages
+        @type outputs: list of tuples
+        @param queues: the queue of every stage
+        @type queues: list
+        @keyword metrics: the queue this instance reports its metrics on
+        @type metrics: L{multiprocessing.Queue}
+        @keyword name: identifies this instance in its metrics reports
+        @type name: String
+        @keyword results: the queue results are published on
+        @type results: L{multiprocessing.Queue}
+        @keyword in_flight: the bytes held in flight by the pool
+        @type in_flight: L{multiprocessing.Value}
+        """
+        Instance.__init__(self, channel, metrics, name, results, in_flight)
+        self.inputs = inputs
+        self.outputs = outputs
+        self.queues = queues
+        self.edges = None
+
+    def execute(self, graph, capacity=None, backend=None):
+        """This is the entry point for the process.
+
+        @see: L{Instance.execute}
+
+        @param graph: The part of the graph in this stage
+        @type graph: dict
+        @keyword capacity: The default capacity of each edge
+        @type capacity: int
+        @keyword backend: The name of the execution backend
+        @type backend: String
+        @return: Nothing
+        """
+        global _results
+        _results = self.results
+
+        pipe = Scheduler(graph, capacity, get_backend(backend), start=False)
+        self.edges = connect_cut(pipe, self.inputs, self.outputs, self.queues)
+        pipe.start()
+        self._run(pipe)
+
+    def _feed(self, pipe, data):
+        """Runs an item read from the stage's queue through the stage.
+
+        @see: L{Instance._feed}
+        """
+        if not self.inputs:
+            Instance._feed(self, pipe, data)
+            return
+
+        kind, key, batch = data
+        self.edges[key].send_batch(batch)
+        pipe.drain()
+
+class StagedDataflow(Dataflow):
+    """Runs each stage of a data flow model in a pool of its own.
+
+    A L{Dataflow} runs a full copy of the graph in every instance. A
+    StagedDataflow compiles the graph into stages (see
+    L{pypes.compiler}), each a component or a fused chain of them,
+    and runs every stage in its own pool of L{StageInstance}s. The
+    number of replicas is set per stage. Stages pass data on bounded
+    queues so a stage that falls behind makes the stages before it
+    wait rather than letting data pile up.
+
+    Sending, batching, the memory budget and published results work
+    as they do on a L{Dataflow}. Data is only queued for the adapter
+    stages accepting it (see L{pypes.router}). The memory budget only
+    counts data until the adapter stages have processed it, the queues
+    bound the rest. Without a component, L{add_process} grows the stage with the
+    longest queue and L{remove_process} shrinks the one with the
+    shortest so L{autoscale} resizes the bottleneck. L{swap} starts the
+    stages of the new graph and drains the old ones stage by stage.
+    """
+    def __init__(self, graph, replicas=None, queue_size=DEFAULT_QUEUE_SIZE,
+                 capacity=None, backend=None, batch_size=None,
+                 batch_timeout=10, memory_budget=None, fuse=True):
+        """Class constructor
+
+        @param graph: the data model in graph notation
+        @type graph: dict
+        @keyword replicas: The number of processes running the stage of
+                           each component, keyed on the component. Only
+                           components with the same number are fused.
+                           Defaults to one per stage
+        @type replicas: dict
+        @keyword queue_size: The most messages waiting on each stage's
+                             queue. Defaults to L{DEFAULT_QUEUE_SIZE}
+        @type queue_size: int
+        @keyword fuse: Fuse linear chains of components into one stage
+        @type fuse: Boolean
+
+        @see: L{Dataflow} for the other arguments
+        """
+        if replicas is None:
+            replicas = {}
+
+        self.fuse = fuse
+        self.queue_size = queue_size
+        self._set_layout(self._compile(graph, replicas))
+
+        Dataflow.__init__(self, graph, 0, capacity, backend, batch_size,
+                          batch_timeout, memory_budget)
+        self.queue = self.queues[self.entries[0]]
+
+        for i, stage in enumerate(self.stages):
+            for j in range(max(replicas.get(stage[0], 1), 1)):
+                self.add_process(stage[0])
+        self.size = len(self.processes)
+
+    def _compile(self, graph, replicas):
+        """Compiles a graph into the stages run by the pools.
+
+        @param graph: the data model in graph notation
+        @type graph: dict
+        @param replicas: The number of processes running the stage of
+                         each component, keyed on the component
+        @type replicas: dict
+        @raise ValueError: if the graph has no adapter
+        @return: the components, subgraph, inputs, outputs and queue of
+                 each stage and the L{Router} of the data sent
+        """
+        # components given different replica counts are never fused
+        nodes, stages, stage_of = compile_graph(graph, self.fuse,
+                                                lambda n: replicas.get(n, 1))
+        components = []
+        for stage in stages:
+            if isinstance(stage, Stage):
+                components.append(stage.components)
+            else:
+                components.append([stage])
+
+        subgraphs, inputs, outputs = split_graph(graph, components)
+        queues = [Queue(self.queue_size) for stage in components]
+
+        # data sent to the dataflow goes to the stages with adapters
+        # accepting it
+        adapters = [(n, i) for i, stage in enumerate(components)
+                            for n in stage if n.get_type() == 'ADAPTER']
+        if not adapters:
+            raise ValueError('The graph has no adapter to send data to')
+        return components, subgraphs, inputs, outputs, queues, \
+                                                        Router(adapters)
+
+    def _set_layout(self, layout, replicas=None):
+        """Makes the stages of a compiled graph the running ones.
+
+        @param layout: The stages (see L{_compile})
+        @type layout: tuple
+        @keyword replicas: The replicas running each stage
+        @type replicas: list of lists
+        """
+        self._layout = layout
+        self.stages, self.subgraphs, self.inputs, self.outputs, \
+                                        self.queues, self.router = layout
+        self.entries = self.router.targets
+        if replicas is None:
+            replicas = [[] for stage in self.stages]
+        self.replicas = replicas
+
+    def _start_replica(self, layout, i):
+        """Starts a replica of a stage.
+
+        @param layout: The stages (see L{_compile})
+        @type layout: tuple
+        @param i: The index of the stage
+        @type i: int
+        @return: L{StageInstance}
+        """
+        stages, subgraphs, inputs, outputs, queues, router = layout
+
+        # the adapter stages count data against the memory budget
+        in_flight = None
+        if i in router.targets:
+            in_flight = self.in_flight
+
+        self._instances += 1
+        process = StageInstance(queues[i], inputs[i], outputs[i], queues,
+                                self.metrics_queue,
+                                'stage-%d-%d' % (i, self._instances),
+                                self.results_queue, in_flight)
+        process.process = Process(target=process.execute,
+                        args=(subgraphs[i], self.capacity, self.backend))
+        process.process.start()
+        return process
+
+    def _put(self, item):
+        """Queues an item for the stages with adapters accepting it.
+        """
+        if isinstance(item, Batch):
+            groups = [(i, Batch(items)) \
+                            for i, items in self.router.route_batch(item)]
+        else:
+            groups = [(i, item) for i in self.router.route(item)]
+
+        # the item was counted once when sent, every stage reading a part
+        # of it uncounts that part
+        if self.in_flight is not None:
+            extra = sum([item_size(data) for i, data in groups]) - \
+                                                    item_size(item)
+            if extra:
+                self.in_flight.get_lock().acquire()
+                try:
+                    self.in_flight.value += extra
+                finally:
+                    self.in_flight.get_lock().release()
+
+        for i, data in groups:
+            self.queues[i].put(data)
+
+    def _get_stage(self, component):
+        """Returns the index of the stage running a component.
+        """
+        for i, stage in enumerate(self.stages):
+            if component in stage:
+                return i
+        raise ValueError('%s is not in the graph' % component)
+
+    def _get_depth(self, i):
+        """Returns the number of messages waiting for a stage or None.
+        """
+        try:
+            return self.queues[i].qsize()
+        except NotImplementedError:
+            return None
+
+    def add_process(self, component=None):
+        """Adds a replica to the pool of a stage.
+
+        @keyword component: A component of the stage (None picks the
+                            stage with the longest queue)
+        @type component: L{Component}
+        """
+        self._pool_lock.acquire()
+        try:
+            if component is None:
+                i = max(range(len(self.stages)), key=self._get_depth)
+            else:
+                i = self._get_stage(component)
+            process = self._start_replica(self._layout, i)
+            self.replicas[i].append(process)
+            self.processes.append(process)
+        finally:
+            self._pool_lock.release()
+
+    def remove_process(self, wait=False, component=None):
+        """Removes a replica from the pool of a stage.
+
+        The last replica of a stage is never removed.
+
+        @see: L{Dataflow.remove_process}
+
+        @keyword wait: Wait for the replica to exit before returning
+        @type wait: Boolean
+        @keyword component: A component of the stage (None picks the
+                            stage with the shortest queue)
+        @type component: L{Component}
+        @return: The removed L{StageInstance} or None
+        """
+        self._pool_lock.acquire()
+        try:
+            if component is None:
+                candidates = [i for i, r in enumerate(self.replicas) \
+                                                            if len(r) > 1]
+                if not candidates:
+                    return None
+                i = min(candidates, key=self._get_depth)
+            else:
+                i = self._get_stage(component)
+                if len(self.replicas[i]) < 2:
+                    return None
+            process = self.replicas[i].pop()
+            self.processes.remove(process)
+            process.stop.set()
+            if process.in_flight is not None:
+                self._retired.append(process)
+        finally:
+            self._pool_lock.release()
+
+        if wait:
+            process.process.join()
+        return process
+
+    def swap(self, graph, workers=None, costs=None, replicas=None):
+        """Replaces the graph run by the stages without stopping ingest.
+
+        The new graph is compiled into stages of its own and their
+        replicas are started. Once every new replica is running, the
+        current batch is flushed to the old stages and data sent from
+        then on is queued for the new ones. The old stages are then
+        stopped in dependency order from a background thread, each once
+        it has finished what the stages before it sent. The memory
+        budget and the results being waited on carry over.
+
+        If a new replica fails to start the old stages keep running.
+
+        @see: L{Dataflow.swap}
+
+        @param graph: the new data model in graph notation
+        @type graph: dict
+        @keyword workers: Unused, every stage runs in processes of its own
+        @type workers: int
+        @keyword costs: Unused
+        @type costs: dict
+        @keyword replicas: The number of processes running the stage of
+                           each component. Defaults to the number running
+                           the component now, one for new components
+        @type replicas: dict
+        @raise RuntimeError: if a new replica exits before it is running
+        @return: Nothing
+        """
+        if replicas is None:
+            replicas = {}
+            for stage, pool in zip(self.stages, self.replicas):
+                for n in stage:
+                    replicas[n] = len(pool)
+
+        layout = self._compile(graph, replicas)
+        stages, queues = layout[0], layout[4]
+        self._pool_lock.acquire()
+        try:
+            started = [[] for stage in stages]
+            try:
+                for i, stage in enumerate(stages):
+                    for j in range(max(replicas.get(stage[0], 1), 1)):
+                        started[i].append(self._start_replica(layout, i))
+                for pool in started:
+                    for p in pool:
+                        while not p.ready.is_set():
+                            if not p.process.is_alive():
+                                raise RuntimeError('%s exited before it '
+                                                   'started' % p.name)
+                            p.ready.wait(POLL_INTERVAL)
+            except:
+                for i, pool in enumerate(started):
+                    for p in pool:
+                        queues[i].put(-1)
+                raise
+
+            self._batch_lock.acquire()
+            try:
+                self._flush()
+                old_queues, old = self.queues, self.replicas
+                old_entries = self.entries
+                self._set_layout(layout, started)
+                self.queue = self.queues[self.entries[0]]
+                self.processes = [p for pool in started for p in pool]
+                self.pipeline = graph
+            finally:
+                self._batch_lock.release()
+
+            if self.in_flight is not None:
+                for i in old_entries:
+                    self._retired.extend(old[i])
+                    self._old_queues.append((old_queues[i], old[i]))
+        finally:
+            self._pool_lock.release()
+
+        # not a daemon so the interpreter waits for it before exiting
+        drain = threading.Thread(target=self._drain, args=(old_queues, old))
+        drain.start()
+
+    def get_queue_depth(self):
+        """Returns the number of messages waiting on all the stage queues.
+
+        @return: int or None if the platform can't report it
+        """
+        depths = [self._get_depth(i) for i in range(len(self.stages))]
+        if None in depths:
+            return None
+        return sum(depths)
+
+    def get_metrics(self):
+        """Returns the metrics of the stages and instances in the pool.
+
+        Adds the components, replica count and queue depth of each
+        stage to the metrics of a L{Dataflow}.
+
+        @see: L{Dataflow.get_metrics}
+
+        @return: dict
+        """
+        metrics = Dataflow.get_metrics(self)
+        metrics['stages'] = [{'components': [str(hash(n)) for n in stage],
+                              'replicas': len(self.replicas[i]),
+                              'queue_depth': self._get_depth(i)} \
+                                        for i, stage in enumerate(self.stages)]
+        return metrics
+
+    def close(self):
+        """Shuts down every stage once it has finished its data.
+
+        The stages are stopped in dependency order from a background
+        thread so each one finishes what the stages before it sent.
+
+        @see: L{Dataflow.close}
+        """
+        if self.autoscaler is not None:
+            self.autoscaler.stop()
+            self.autoscaler = None
+
+        self.flush()
+        # not a daemon so the interpreter waits for it before exiting
+        shutdown = threading.Thread(target=self._shutdown)
+        shutdown.start()
+
+    def _shutdown(self):
+        """Stops the stages one after the other.
+        """
+        self._drain(self.queues, self.replicas)
+
+        if self._dispatcher is not None:
+            self.results_queue.put(-1)
+            self._dispatcher = None
+
+    def _drain(self, queues, replicas):
+        """Stops stages in dependency order once they have run their data.
+
+        @param queues: The queue of each stage
+        @type queues: list
+        @param replicas: The replicas running each stage
+        @type replicas: list of lists
+        """
+        for i, pool in enumerate(replicas):
+            for p in pool:
+                queues[i].put(-1)
+            for p in pool:
+                p.process.join()
+
+def _add_metrics(total, metrics):
+    """Adds one instance's component metrics to a running total.
+
+    @param total: The metrics being added to
+    @type total: dict
+    @param metrics: The metrics of the same component in another instance
+    @type metrics: dict
+    """
+    for key, value in metrics.items():
+        if key in ('docs_in', 'docs_out', 'run_time',
+                   'wakeups', 'idle_wakeups'):
+            total[key] += value
+
+    for port, stats in metrics['edges'].items():
+        edge = total['edges'].get(port)
+        if edge is None:
+            total['edges'][port] = dict(stats)
+            continue
+        for key in ('size', 'sent', 'stalls'):
+            edge[key] += stats[key]
+        edge['high_water'] = max(edge['high_water'], stats['high_water'])
 
+if __name__ == '__main__':
+    # Run the doctests
+    import sys
+    import doctest
+    doctest.testmod(sys.modules['__main__'])
@@ -6,16 +6,51 @@ a pype instance.
 
 Each pair of nodes is connected by their own unique
 pype object.
+
+The component reading from a pype is its consumer. Sending
+data on a pype wakes its consumer if it is blocked waiting for
+input.
+
+A pype may be bounded by giving it a capacity. A bounded
+pype refuses data once it is full which allows the sending
+component to yield until the receiving component drains it.
+
+Run this module directly to run the doctests (unittests).
 """
 
+from collections import deque
+from itertools import islice
+
 class Pype(object):
     """A bidirectional buffer used to allow two nodes to pass data back and forth.
+
+    Data is kept in a L{collections.deque} so both ends operate in constant time.
+
+    >>> p = Pype(capacity=2)
+    >>> p.send('a'), p.send('b'), p.send('c')
+    (True, True, False)
+    >>> p.size, p.full
+    (2, True)
+    >>> p.recv(), p.recv(), p.recv()
+    ('a', 'b', None)
+    >>> p.get_stats()['high_water'], p.get_stats()['stalls']
+    (2, 1)
+
     @todo: Should this be a L{multiprocessor.pipe}?
     """
-    def __init__(self):
+    def __init__(self, capacity=None):
         """Class constructor
+
+        @keyword capacity: The maximum number of items this pype will hold.
+                           None (the default) means the pype is unbounded.
+        @type capacity: int
         """
-        self.buffer = []
+        self.buffer = deque()
+        self.capacity = capacity
+        self.consumer = None
+        self.high_water = 0
+        self.sent = 0
+        self.stalls = 0
 
     def get_buffer_size(self):
         """Returns the current buffer size of this pype
@@ -24,12 +59,60 @@ class Pype(object):
 
     size = property(get_buffer_size)
 
+    def is_full(self):
+        """Returns True if this pype has reached its capacity
+        """
+        return self.capacity is not None and len(self.buffer) >= self.capacity
+
+    full = property(is_full)
+
     def send(self, data):
         """Writes data to this pype
 
-        @return: Nothing
+        @return: True if the data was written, False if the pype is full
         """
+        if self.capacity is not None and len(self.buffer) >= self.capacity:
+            self.stalls += 1
+            return False
+
         self.buffer.append(data)
+        self.sent += 1
+        if len(self.buffer) > self.high_water:
+            self.high_water = len(self.buffer)
+        if self.consumer is not None:
+            self.consumer.wake()
+        return True
+
+    def send_batch(self, items):
+        """Writes a list of data to this pype in one operation
+
+        When the pype is bounded only the items that fit are written.
+
+        >>> p = Pype(capacity=3)
+        >>> p.send_batch(['a', 'b', 'c', 'd'])
+        3
+        >>> p.recv_batch(2), p.recv_batch()
+        (['a', 'b'], ['c'])
+
+        @param items: The data to write
+        @type items: list
+        @return: The number of items written
+        """
+        count = len(items)
+        if self.capacity is not None:
+            room = self.capacity - len(self.buffer)
+            if room < count:
+                self.stalls += 1
+                count = max(room, 0)
+                items = islice(items, count)
+
+        self.buffer.extend(items)
+        self.sent += count
+        if len(self.buffer) > self.high_water:
+            self.high_water = len(self.buffer)
+        if count and self.consumer is not None:
+            self.consumer.wake()
+        return count
 
     def recv(self):
         """Reads data from this pype
@@ -37,8 +120,52 @@ class Pype(object):
         @return: data or None if no data is available
         """
         try:
-            data = self.buffer.pop(0)
-        except:
+            data = self.buffer.popleft()
+        except IndexError:
             data = None
         return data
 
+    def recv_batch(self, n=None):
+        """Reads up to n items from this pype in one operation
+
+        @keyword n: The maximum number of items to read (None reads everything)
+        @type n: int
+        @return: list (empty if no data is available)
+        """
+        if n is None or n >= len(self.buffer):
+            items = list(self.buffer)
+            self.buffer.clear()
+        else:
+            popleft = self.buffer.popleft
+            items = [popleft() for i in xrange(n)]
+        return items
+
+    def get_stats(self):
+        """Returns the buffer statistics for this pype.
+
+        The high water mark is the largest number of items the
+        pype has held at once and is useful for sizing capacities.
+        Stalls counts the writes refused because the pype was full.
+
+        @return: dict
+        """
+        return {'size': len(self.buffer),
+                'capacity': self.capacity,
+                'high_water': self.high_water,
+                'sent': self.sent,
+                'stalls': self.stalls}
+
+    def reset_stats(self):
+        """Resets the high water mark and counters of this pype.
+
+        @return: Nothing
+        """
+        self.high_water = len(self.buffer)
+        self.sent = 0
+        self.stalls = 0
+
+if __name__ == '__main__':
+    # Run the doctests
+    import sys
+    import doctest
+    doctest.testmod(sys.modules['__main__'])
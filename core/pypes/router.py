@@ -0,0 +1,166 @@
+"""Routes the data sent to a graph to the adapters that accept it.
+
+Adapters declare the mimetypes and routes they accept in their
+__mimetypes__ and __routes__ class attributes (see L{Component}).
+Data describing itself through get_meta('mimetype') and
+get_meta('route'), as the studio's packets do, is only delivered to
+the adapters that match. Anything else is delivered to every adapter.
+
+The adapters matching each (mimetype, route) pair are worked out the
+first time the pair is seen and kept in a dispatch table. Mimetypes
+and routes no adapter declares share a single entry.
+
+Run this module directly to run the doctests (unittests).
+
+    >>> class CSV(Component):
+    ...     __metatype__ = 'ADAPTER'
+    ...     __mimetypes__ = ('text/csv',)
+    >>> class JSON(Component):
+    ...     __metatype__ = 'ADAPTER'
+    ...     __mimetypes__ = ('application/json', None)
+    >>> class Feeds(Component):
+    ...     __metatype__ = 'ADAPTER'
+    ...     __routes__ = ('feeds',)
+    >>> class Doc(dict):
+    ...     def get_meta(self, meta, attr=None, default=None):
+    ...         return self.get(meta, default)
+    >>> router = Router([(CSV(), 'csv'), (JSON(), 'json'), (Feeds(), 'feeds')])
+    >>> router.route(Doc(mimetype='text/csv'))
+    ['csv']
+    >>> router.route(Doc(mimetype='application/json; charset=UTF-8'))
+    ['json']
+    >>> router.route(Doc())
+    ['json']
+    >>> router.route(Doc(mimetype='text/csv', route='feeds'))
+    ['csv', 'feeds']
+    >>> router.route('not a packet')
+    ['csv', 'json', 'feeds']
+    >>> router.route_batch([Doc(mimetype='text/csv'), Doc(), Doc(mimetype='text/csv')])
+    [('csv', [{'mimetype': 'text/csv'}, {'mimetype': 'text/csv'}]), ('json', [{}])]
+"""
+
+import sys
+
+from component import Component
+
+# the key of the mimetypes and routes no adapter declares
+_OTHER = object()
+
+def normalize_mimetype(mimetype):
+    """Returns a mimetype without its parameters, in lower case.
+
+    >>> normalize_mimetype('Application/JSON; charset=UTF-8')
+    'application/json'
+
+    @param mimetype: The mimetype (None if unknown)
+    @type mimetype: String
+    @return: String or None
+    """
+    if mimetype is None:
+        return None
+    return mimetype.split(';', 1)[0].strip().lower()
+
+class Router(object):
+    """Delivers data to the targets of the adapters accepting it.
+    """
+    def __init__(self, adapters):
+        """Class constructor
+
+        @param adapters: (adapter, target) pairs. Data accepted by an
+                         adapter is delivered to its target (such as the
+                         edge feeding it). Several adapters may share a
+                         target, which then receives the data once.
+        @type adapters: list of tuples
+        """
+        self.adapters = []
+        self.targets = []
+        self.mimetypes = set()
+        self.routes = set()
+        for adapter, target in adapters:
+            mimetypes = adapter.get_mimetypes()
+            if mimetypes is not None:
+                mimetypes = set([normalize_mimetype(m) for m in mimetypes])
+                self.mimetypes.update(mimetypes)
+
+            routes = adapter.get_routes()
+            if routes is not None:
+                routes = set(routes)
+                self.routes.update(routes)
+
+            self.adapters.append((mimetypes, routes, target))
+            if target not in self.targets:
+                self.targets.append(target)
+
+        # nothing to look up when every adapter accepts everything
+        self.broadcast = not self.mimetypes and not self.routes
+        self.table = {}
+
+    def _get_key(self, data):
+        """Returns the dispatch table key of data or None if it has none.
+        """
+        get_meta = getattr(data, 'get_meta', None)
+        if get_meta is None:
+            return None
+
+        mimetype = normalize_mimetype(get_meta('mimetype'))
+        if mimetype not in self.mimetypes:
+            mimetype = _OTHER
+
+        route = get_meta('route')
+        if route not in self.routes:
+            route = _OTHER
+        return (mimetype, route)
+
+    def _match(self, key):
+        """Returns the targets of the adapters accepting a key.
+        """
+        mimetype, route = key
+        targets = []
+        for mimetypes, routes, target in self.adapters:
+            if mimetypes is not None and mimetype not in mimetypes:
+                continue
+            if routes is not None and route not in routes:
+                continue
+            if target not in targets:
+                targets.append(target)
+        return targets
+
+    def route(self, data):
+        """Returns the targets data is delivered to.
+
+        @param data: The data being sent
+        @type data: Application Specific
+        @return: list
+        """
+        if self.broadcast:
+            return self.targets
+
+        key = self._get_key(data)
+        if key is None:
+            return self.targets
+
+        targets = self.table.get(key)
+        if targets is None:
+            targets = self.table[key] = self._match(key)
+        return targets
+
+    def route_batch(self, batch):
+        """Splits a batch by the targets its data is delivered to.
+
+        @param batch: The data being sent
+        @type batch: list
+        @return: list of (target, items) in the order of the targets
+        """
+        if self.broadcast:
+            return [(target, batch) for target in self.targets]
+
+        groups = {}
+        for data in batch:
+            for target in self.route(data):
+                groups.setdefault(self.targets.index(target), []).append(data)
+        return [(self.targets[i], groups[i]) for i in sorted(groups)]
+
+if __name__ == '__main__':
+    # Run the doctests
+    import doctest
+    doctest.testmod(sys.modules['__main__'])
@@ -1,80 +1,263 @@
-"""Provides scheduling routines for stackless tasklets.
+"""Provides scheduling routines for component micro-threads.
 
-The scheduler itself runs as a tasklet. It blocks waiting
-for input on the channel passed in. When new data is sent
-on this channel, the scheduler wakes and begins processing
-of the data.
+The L{Scheduler} wires the graph together and starts each
+component on an execution backend (see L{pypes.backend}).
+Data sent to the scheduler is fed to every input adapter
+and then run through the graph.
+
+Scheduling is event driven. Components block while they
+have no input so only the components that data has been
+sent to are on the run queue. Sending data on a L{Pype}
+marks its consumer runnable.
+
+Adapters declaring the mimetypes or routes they accept are only fed
+the data that matches (see L{pypes.router}).
+
+The graph is compiled first (see L{pypes.compiler}) so linear
+chains of components implementing process() run as a single
+L{Stage} with no edges between them.
 
 """
 
-import stackless
 from pype import Pype
-from graph import get_pairlist, topsort
+from compiler import compile_graph
+from router import Router
+from backend import get_backend
 import sys
-import traceback
 
-def sched(ch, graph):
-    """Sits in an infinite loop waiting on the channel to recieve data.
+class Scheduler(object):
+    """Runs a data flow graph on an execution backend.
+    """
+    def __init__(self, graph, capacity=None, backend=None, fuse=True,
+                                                            start=True):
+        """Class constructor
+
+        The constructor takes care of sorting the input graph into a
+        dependency list, compiling it into stages, connecting the stages
+        and starting a micro-thread for each of them.
+
+        Each edge in the graph is a tuple of (output, input) ports.
+        An optional third item sets the capacity of that edge and
+        overrides the default capacity. Edges inside a fused stage
+        are not created.
+
+        @param graph: The graph representing the work flow
+        @type graph: Python dict organized as a graph struct
+        @keyword capacity: The default capacity of each edge (None is unbounded)
+        @type capacity: int
+        @keyword backend: The execution backend (defaults to L{get_backend})
+        @type backend: L{pypes.backend} backend instance
+        @keyword fuse: Fuse linear chains of components into one stage
+        @type fuse: Boolean
+        @keyword start: Start the micro-threads (otherwise call L{start})
+        @type start: Boolean
+        """
+        if backend is None:
+            backend = get_backend()
+
+        # backends that can't suspend inside a call can't apply backpressure
+        if not backend.can_block:
+            capacity = None
+
+        self.backend = backend
+        self.nodes, self.stages, self.stage_of = compile_graph(graph, fuse)
+        self.tasks = []
+
+        for n in self.stages:
+            n.set_backend(backend)
+
+        for n in self.nodes:
+            try:
+                # get this nodes outputs
+                edges = graph[n]
+            except:
+                pass
+            else:
+                # for each output
+                for e in edges:
+                    # fused components hand data over directly
+                    if self.stage_of[n] is self.stage_of[e]:
+                        continue
+
+                    if backend.can_block and len(edges[e]) > 2:
+                        e1 = Pype(edges[e][2])
+                    else:
+                        e1 = Pype(capacity)
+
+                    # does this port exist
+                    if not n.has_port(edges[e][0]):
+                        print 'Trying to connect undefined output port', n, edges[e][0]
+                        sys.exit(1)
+
+                    self.stage_of[n].connect_output(edges[e][0], e1)
+
+                    # does this port exist
+                    if not e.has_port(edges[e][1]):
+                        print 'Trying to connect undefined input port', e, edges[e][1]
+                        sys.exit(1)
+
+                    self.stage_of[e].connect_input(edges[e][1], e1)
+
+        # Added so that incoming data is fed to every input adapter
+        # should check if in exists and create it if it doesn't
+        # because a user could remove the input port by accident
+        # input edges are left unbounded since the caller feeding
+        # them must never block on a full edge
+        self.input_edges = []
+        adapters = []
+        for n in self.stages:
+            if n.get_type() == 'ADAPTER':
+                ie = Pype()
+                n.connect_input('in', ie)
+                self.input_edges.append(ie)
+                adapters.append((n, ie))
+        self.router = Router(adapters)
+
+        if start:
+            self.start()
+
+    def start(self):
+        """Starts the micro-threads and lets them block waiting for input.
+
+        @return: nothing
+        """
+        for n in self.stages:
+            self.tasks.append(self.backend.spawn(n))
+        self.drain()
+
+    def send(self, data):
+        """Feeds data to the input adapters accepting it and runs the graph
+        until idle.
+
+        @param data: The data being sent
+        @type data: Application Specific
+        @return: nothing
+        """
+        # sending wakes each adapter
+        for ie in self.router.route(data):
+            ie.send(data)
+        self.drain()
+
+    def send_batch(self, batch):
+        """Feeds a list of data to the input adapters accepting it and runs
+        the graph until idle.
+
+        Each adapter receives the part of the batch it accepts in a
+        single operation.
+
+        @param batch: The data being sent
+        @type batch: list
+        @return: nothing
+        """
+        for ie, items in self.router.route_batch(batch):
+            ie.send_batch(items)
+        self.drain()
 
-    The procedure prolog takes care of sorting the
-    input graph into a dependency list and initializing
-    the filter tasklets used to construct the graph.
+    def connect_input(self, node, port, edge):
+        """Connects an edge from outside the graph to an input port.
 
-    @param graph: The graph representing the work flow
-    @type graph: Python dict organized as a graph struct
-    @param ch: The stackless channel to listen on
-    @type ch: stackless.channel
-    @return: nothing
+        Used when a graph is split across workers and the node's parent
+        runs in another one (see L{pypes.parallel}). Edges must be
+        connected before the scheduler is started.
+
+        @param node: The component in the graph
+        @type node: L{Component}
+        @param port: The input port of the component
+        @type port: String
+        @param edge: The edge data arrives on
+        @type edge: L{Pype}
+        @return: Nothing
+        """
+        self.stage_of[node].connect_input(port, edge)
+
+    def connect_output(self, node, port, edge):
+        """Connects an output port to an edge leading outside the graph.
+
+        @see: L{connect_input}
+
+        @param node: The component in the graph
+        @type node: L{Component}
+        @param port: The output port of the component
+        @type port: String
+        @param edge: The edge data is sent on
+        @type edge: L{Pype}
+        @return: Nothing
+        """
+        self.stage_of[node].connect_output(port, edge)
+
+    def drain(self):
+        """Runs components until every one of them is waiting for input.
+
+        @return: nothing
+        """
+        self.backend.drain()
+
+    def set_parameters(self, parameters):
+        """Sets the parameters of components in the graph.
+
+        Components are keyed on str(hash(component)) as in L{get_metrics}
+        so the parameters of a graph can be applied to the copies of it
+        running in other processes. Components not in the graph are
+        ignored.
+
+        @param parameters: {name: value} dicts keyed on the component
+        @type parameters: dict
+        @return: Nothing
+        """
+        set_parameters(self.nodes, parameters)
+
+    def get_wakeup_stats(self):
+        """Returns the scheduler counters summed over every stage.
+
+        A fused stage is woken once for all of its components.
+
+        @see: L{Component.get_wakeup_stats}
+
+        @return: dict
+        """
+        return get_wakeup_stats(self.stages)
+
+    def get_metrics(self):
+        """Returns the metrics of every component keyed on the component.
+
+        Components are keyed on str(hash(component)). Instances forked
+        from the same graph share these keys. Components run by a
+        L{Stage} report the counters the stage keeps for them.
+
+        @see: L{Component.get_metrics}
+
+        @return: dict
+        """
+        return dict((str(hash(n)), n.get_metrics()) for n in self.nodes)
+
+def set_parameters(nodes, parameters):
+    """Sets the parameters of the components in a list.
+
+    @see: L{Scheduler.set_parameters}
+
+    @param nodes: The components to update
+    @type nodes: list
+    @param parameters: {name: value} dicts keyed on str(hash(component))
+    @type parameters: dict
+    @return: Nothing
     """
-    edgeList = get_pairlist(graph)
-    nodes = topsort(edgeList)
-    tasks = []
-    inputEdge = Pype()
-    
     for n in nodes:
-        # start this microthread
-        tasks.append(stackless.tasklet(n.run)())
-        try:
-            # get this nodes outputs
-            edges = graph[n]
-        except:
-            pass
-        else:
-            # for each output
-            for e in edges:
-                e1 = Pype()
-                # does this port exist
-                if not n.has_port(edges[e][0]):
-                    print 'Trying to connect undefined output port', n, edges[e][0]
-                    sys.exit(1)
-
-                n.connect_output(edges[e][0], e1)
-                    
-                # does this port exist 
-                if not e.has_port(edges[e][1]):
-                    print 'Trying to connect undefined input port', e, edges[e][1]
-                    sys.exit(1)
-
-                e.connect_input(edges[e][1], e1)
-
-    # Added so that incoming data is fed to every input adapter
-    # should check if in exists and create it if it doesn't 
-    # because a user could remove the input port by accident
-    inputEdges = []
-    for n in nodes:
-        if n.get_type() == 'ADAPTER':
-            ie = Pype()
-            n.connect_input('in', ie)
-            inputEdges.append(ie)
-    #nodes[0].connect_input('in', inputEdge)
-
-    while True:
-        data = ch.receive()
-        for ie in inputEdges:
-            ie.send(data)
-        #inputEdge.send(data)
-        try:
-            tasks[0].run()
-        except:
-            traceback.print_exc()
+        params = parameters.get(str(hash(n)))
+        if params:
+            for name, value in params.items():
+                n.set_parameter(name, value)
+
+def get_wakeup_stats(nodes):
+    """Returns the scheduler counters summed over a list of components.
 
+    @see: L{Component.get_wakeup_stats}
+
+    @param nodes: The components to total
+    @type nodes: list
+    @return: dict
+    """
+    totals = {'wakeups': 0, 'idle_wakeups': 0}
+    for n in nodes:
+        for key, value in n.get_wakeup_stats().items():
+            totals[key] += value
+    return totals
@@ -34,7 +34,7 @@ Features
 
 Requirements
 ------------
-- Stackless Python 2.6.x
+- Stackless Python 2.6.x or Python 2.6.x with greenlet
 
 Usage
 -----
@@ -23,6 +23,13 @@ def make_map():
     map.connect('signout', '/signout', controller='index', action='signout')
     map.resource('project', 'project')
     map.resource('filter', 'filters')
+
+    # pipeline metrics of the running project
+    map.connect('metrics',
+                '/metrics',
+                controller='metrics',
+                action='index',
+                conditions=dict(method=["GET"]))
  
     # new data controller
     map.connect('get',
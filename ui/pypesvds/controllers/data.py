@@ -9,15 +9,21 @@ import zlib
 import gzip
 import StringIO
 import json
+import base64
 
 from pylons import request, response, session, tmpl_context as c
 from pylons import app_globals
+from pylons import config
 
 from pypesvds.lib.base import BaseController, render
-from pypesvds.lib.packet import Packet
+from pypesvds.lib.packet import Packet, LazyValue
+from pypesvds.lib import spool
 from pypesvds.lib.utils import abort
 
 log = logging.getLogger(__name__)
+
+# seconds a synchronous request waits for its result by default
+DEFAULT_SYNC_TIMEOUT = 30
 mimes = os.path.join(os.path.dirname(__file__), 'mime.types')
 mimetypes.init([mimes])
 
@@ -39,8 +45,70 @@ class DataController(BaseController):
 
         return filedata
 
+    def _spool(self, data):
+        """ spool large payloads so only a handle is sent to the workflow """
+        try:
+            threshold = int(config.get('spool_threshold',
+                                       spool.DEFAULT_THRESHOLD))
+        except:
+            log.warning('Could not get spool threshold from config.')
+            threshold = spool.DEFAULT_THRESHOLD
+
+        # a threshold of 0 disables spooling
+        if threshold < 1 or len(data) < threshold:
+            return data
+
+        log.debug('Spooling %d bytes of data' % len(data))
+        return spool.spool(data, config.get('spool_dir', None))
+
+    def _sync_timeout(self):
+        """ returns the timeout of a synchronous request or None if async """
+        if request.GET.get('sync', 'false').lower() != 'true':
+            return None
+
+        try:
+            timeout = float(request.GET.get('timeout',
+                    config.get('sync_timeout', DEFAULT_SYNC_TIMEOUT)))
+        except:
+            log.warning('Invalid sync timeout, using default')
+            timeout = DEFAULT_SYNC_TIMEOUT
+
+        return max(timeout, 0)
+
+    def _json_value(self, value):
+        """ convert a packet value into something json can serialize """
+        # values never loaded (such as spooled payloads) are left out
+        # rather than exposing where they are kept
+        if isinstance(value, LazyValue):
+            return None
+
+        # binary strings are returned base64 encoded
+        if isinstance(value, str):
+            try:
+                return value.decode('utf-8')
+            except UnicodeDecodeError:
+                return {'base64': base64.b64encode(value)}
+
+        if isinstance(value, dict):
+            return dict((self._json_value(k), self._json_value(v)) \
+                                                for k, v in value.items())
+
+        if isinstance(value, (list, tuple)):
+            return [self._json_value(v) for v in value \
+                                        if not isinstance(v, LazyValue)]
+        return value
+
+    def _packet_to_json(self, packet):
+        """ serialize a processed packet for a synchronous response """
+        meta, attr_meta = packet.get_metas()
+        return json.dumps(self._json_value({'attributes': packet.get_attributes(),
+                                            'meta': meta,
+                                            'attribute_meta': attr_meta}),
+                          default=unicode)
+
     def create(self, route=None, id=None):
         status = {}
+        payload = None
         
         try:
             content_encoding = request.headers.get('Content-Encoding', None)
@@ -86,7 +154,8 @@ class DataController(BaseController):
                 # update content length since we might be decompressed now
                 content_length = len(filedata)
                 if content_length > 0:        
-                    packet.add('data', filedata)
+                    payload = self._spool(filedata)
+                    packet.add('data', payload)
                 else:
                     abort(400, 'Empty Request')
             
@@ -107,7 +176,12 @@ class DataController(BaseController):
                 packet.set_meta('processingtime', unicode(
                                 datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')))
                 
-                status = app_globals.dfg.send(packet)
+                # ?sync=true waits for the processed document
+                timeout = self._sync_timeout()
+                if timeout is None:
+                    status = app_globals.dfg.send(packet)
+                else:
+                    status = app_globals.dfg.send_sync(packet, timeout)
                 
                 # calls into pypes core are asynchronous so we respond as such
                 if status['status'] == 'success':
@@ -117,7 +191,33 @@ class DataController(BaseController):
                 log.error('Controller Exception: %s' % self.__class__.__name__)
                 log.error('Reason: %s' % str(e))                    
                 log.debug(traceback.print_exc())
+                spool.discard(payload)
                 abort(500, str(e))
+
+        # a document that was never queued leaves no spool file behind
+        if status['status'] not in ('success', 'timeout'):
+            spool.discard(payload)
+
+        # the workers hold as much data as their memory budget allows
+        if status['status'] == 'busy':
+            abort(503, json.dumps(status))
+
+        # no collector returned the document in time
+        if status['status'] == 'timeout':
+            abort(504, json.dumps(status))
+
+        # synchronous requests respond with the processed document
+        if status['status'] == 'success' and 'packet' in status:
+            try:
+                body = self._packet_to_json(status['packet'])
+            except Exception as e:
+                log.error('Unable to serialize the processed document')
+                log.error('Reason: %s' % str(e))
+                abort(500, json.dumps({'status': 'failure',
+                        'error': 'Unable To Serialize The Processed Document'}))
+            response.status = 200
+            response.content_type = 'application/json'
+            return body
           
         # return empty body on success otherwise return status object    
         return None if status['status'] == 'success' else json.dumps(status) 
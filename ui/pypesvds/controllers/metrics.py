@@ -0,0 +1,26 @@
+import logging
+import json
+from pylons import request, response, session, tmpl_context as c
+from pylons import app_globals
+
+from pypesvds.lib.base import BaseController, render
+
+log = logging.getLogger(__name__)
+
+class MetricsController(BaseController):
+    """Serves the metrics of the running project"""
+    # To properly map this controller, ensure your config/routing.py
+    # file has a route setup:
+    #     map.connect('metrics', '/metrics', controller='metrics',
+    #                 action='index', conditions=dict(method=["GET"]))
+
+    def index(self, format='html'):
+        """GET /metrics: Metrics of every component in the workflow
+
+        Components are keyed on the same id used by /filters. Each
+        one reports documents in and out, the time spent running
+        and the queue depth of each of its input edges.
+        """
+        # url('metrics')
+        response.content_type = 'application/json'
+        return json.dumps(app_globals.dfg.get_metrics())
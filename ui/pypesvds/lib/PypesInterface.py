@@ -1,9 +1,12 @@
-from pypes.pipeline import Dataflow
+from pypes.pipeline import Dataflow, MemoryBudgetExceeded
+from pypes.graph import reachable
 import pkg_resources
 import logging
 import os
 import json
+import uuid
 import traceback
+from collections import OrderedDict
 from pylons import config
 
 log = logging.getLogger(__name__)
@@ -11,6 +14,12 @@ log = logging.getLogger(__name__)
 ENTRYPOINT = 'pypesvds.plugins'
 PLUGIN_DIR = os.path.join(os.path.dirname(__file__), '../plugins')
 
+# seconds a document waits for room in the memory budget by default
+DEFAULT_MEMORY_TIMEOUT = 5
+
+# the most validated graphs kept for topologies saved before
+PLAN_CACHE_SIZE = 16
+
 def init_plugins():
     log.info('Initializing Studio Plugins from %s' % config['plugin_dir'])
     try:
@@ -43,6 +52,14 @@ class DataFlowGraph(object):
         self._workflow = None
         self._config = None
         self._graph = None
+        self._memory_timeout = DEFAULT_MEMORY_TIMEOUT
+        # validated graphs keyed on their topology (see get_topology),
+        # least recently used first
+        self._plans = OrderedDict()
+        # the topology of the running workflow and the parameters
+        # its components were last given, keyed on the component id
+        self._topology = None
+        self._applied = {}
         # load plugins
         self.plugins = init_plugins()
         self.plugin_registry = {}
@@ -128,6 +145,10 @@ class DataFlowGraph(object):
             log.debug('Registered Instances: %s' % self._registered_instances)
         else:
             self._registered_instances.pop(key)
+            # forget the graphs using the instance
+            for topology in self._plans.keys():
+                if key in topology[0]:
+                    del self._plans[topology]
 
     def Inputs(self, key):
         #return self._registered_instances[key].Inputs
@@ -143,95 +164,255 @@ class DataFlowGraph(object):
 
     def update(self, jsconfig):
         statusText = 'Unidentified Error Saving Project'
-        # close any existing workflow
+
+        # the new config from the UI only replaces the current config
+        # and graph (and the running workflow) once it is valid
+        try:
+            config = json.loads(jsconfig)
+        except:
+            return 'This Project Configuration is Bad'
+
+        # the same graph as the running one only needs its parameters set
+        topology = self.get_topology(config)
+        if topology is not None and topology == self._topology:
+            try:
+                self.update_parameters(config)
+            except:
+                log.error('Unable to update parameters')
+                traceback.print_exc()
+                statusText = 'Error Updating Project Parameters'
+            else:
+                statusText = 'Project Successfully Saved'
+                self.Config = config
+                self.save(jsconfig)
+            return statusText
+
+        graph = self._plans.pop(topology, None)
+        if graph is None:
+            statusText, graph = self.compile(config)
+            if graph is None:
+                return statusText
+
+        # the least recently used graph makes room for this one
+        if topology is not None:
+            if len(self._plans) >= PLAN_CACHE_SIZE:
+                self._plans.popitem(last=False)
+            self._plans[topology] = graph
+
+        # Build the new workflow or switch the running one over to the
+        # new graph without stopping ingest
+        try:
+            if self.Workflow is None:
+                self.Workflow = self.create_workflow(graph)
+            else:
+                self.Workflow.swap(graph)
+        except:
+            statusText = 'Error Constructing Workflow'
+        else:
+            statusText = 'Project Successfully Saved'
+            self.Config = config
+            self.Graph = graph
+            self._topology = topology
+            self._applied = self.get_parameters(config)
+            self.save(jsconfig)
+
+        return statusText
+
+    def compile(self, config=None):
+        """Validates a config (the current one by default) and translates
+        it into a graph.
+
+        Returns (statusText, graph), the graph is None if the config
+        is not valid.
+        """
+        if config is None:
+            config = self.Config
+
+        # Check for valid input component 
+        (in_status, inputs) = self.config_has_valid_input(config)
+        (out_status, outputs) = self.config_has_valid_output(config)
+
+        if in_status is False:
+            return ('Unable To Save Configuration<br><br>No Valid Adapter Specified<br>.', None)
+
+        # Check for valid output component
+        if out_status is False:
+            return ('Unable To Save Configuration<br><br>No Valid Publisher Specified<br>.', None)
+
+        # translate the config into a usable DAG
+        graph = self.translate(config)
+        if graph is None:
+            return ('Error Translating Supplied Configuration', None)
+
+        # check the connectivity of the graph
+        if not self.is_connected(inputs, outputs, graph):
+            return ('Unable To Save Project<br><br>Found Broken Path Between Adapter and Publisher.<br>', None)
+
+        return (None, graph)
+
+    def create_workflow(self, graph=None):
+        """Creates a Dataflow running a graph (the current one by default).
+        """
+        if graph is None:
+            graph = self.Graph
+
+        try:
+            # get the core count from the config
+            cores = int(config['cores'])
+            # has to be at least 1
+            if cores < 1:
+                cores = 1
+        except:
+            log.warning('Could not get core count from config.')
+            traceback.print_exc()
+            log.warning('Defaulting to core count of 1')
+            cores = 1
+
+        # batching is off unless a batch size is configured
+        try:
+            batch_size = int(config.get('batch_size', 0))
+            batch_timeout = int(config.get('batch_timeout', 10))
+        except:
+            log.warning('Could not get batch settings from config.')
+            batch_size = 0
+            batch_timeout = 10
+
+        if batch_size < 2:
+            batch_size = None
+
+        # the memory budget is off unless one is configured
+        try:
+            memory_budget = int(config.get('memory_budget', 0))
+            self._memory_timeout = float(config.get(
+                'memory_timeout', DEFAULT_MEMORY_TIMEOUT))
+        except:
+            log.warning('Could not get memory budget from config.')
+            memory_budget = 0
+            self._memory_timeout = DEFAULT_MEMORY_TIMEOUT
+
+        if memory_budget < 1:
+            memory_budget = None
+
+        # branches share one process unless configured
+        try:
+            branch_workers = int(config.get('branch_workers', 0))
+        except:
+            log.warning('Could not get branch workers from config.')
+            branch_workers = 0
+
+        if branch_workers < 2:
+            branch_workers = None
+
+        # no workers are started ahead of time unless configured
+        try:
+            spare_workers = max(int(config.get('spare_workers', 0)), 0)
+        except:
+            log.warning('Could not get spare workers from config.')
+            spare_workers = 0
+
+        #log.info('Core count: %s' % cores)
+        workflow = Dataflow(graph, cores,
+                            batch_size=batch_size,
+                            batch_timeout=batch_timeout,
+                            memory_budget=memory_budget,
+                            workers=branch_workers,
+                            spares=spare_workers)
+
+        # optionally resize the pool between min/max_cores
+        if config.get('autoscale', 'false').lower() == 'true':
+            try:
+                min_cores = int(config.get('min_cores', 1))
+                max_cores = int(config.get('max_cores', cores))
+            except:
+                log.warning('Could not get autoscale bounds from config.')
+                min_cores = max_cores = cores
+
+            workflow.autoscale(min_cores, max_cores)
+        return workflow
+
+    def close(self):
+        """Closes the running workflow.
+        """
+        self._topology = None
         if self.Workflow is not None:
             try:
                 self.Workflow.close()
             except:
                 pass
+            self.Workflow = None
 
-        # set the new updated config from the UI
+    def save(self, jsconfig):
+        """Saves the config as the default project.
+        """
+        fp = None
         try:
-            self._config = json.loads(jsconfig)
+            fp = open('projects/default.txt', 'w')
+            fp.write(jsconfig)
         except:
-            statusText = 'This Project Configuration is Bad'
+            log.error('Unable to save configuration')
         else:
-            # Check for valid input component 
-            (in_status, inputs) = self.config_has_valid_input()
-            (out_status, outputs) = self.config_has_valid_output()
-
-            if in_status is False:
-                statusText = 'Unable To Save Configuration<br><br>No Valid Adapter Specified<br>.'
-                
-            # Check for valid output component
-            elif out_status is False:
-                statusText = 'Unable To Save Configuration<br><br>No Valid Publisher Specified<br>.'
-                
-            else:
-                # translate the current config into a usable DAG
-                result = self.translate()
-                if result is False:
-                    statusText = 'Error Translating Supplied Configuration'
-                # check the connectivity of the graph
-                elif not self.is_connected(inputs, outputs):
-                    statusText = 'Unable To Save Project<br><br>Found Broken Path Between Adapter and Publisher.<br>'
-                else:
-                    # Build the new workflow
-                    try:
-                        try:
-                            # get the core count from the config
-                            cores = int(config['cores'])
-                            # has to be at least 1
-                            if cores < 1:
-                                cores = 1
-                        except:
-                            log.warning('Could not get core count from config.')
-                            traceback.print_exc()
-                            log.warning('Defaulting to core count of 1')
-                            cores = 1
-
-                        #log.info('Core count: %s' % cores)
-                        self.Workflow = Dataflow(self.Graph, cores)
-                    except:
-                        statusText = 'Error Constructing Workflow'
-                    else:
-                        statusText = 'Project Successfully Saved'
-                        # Save config here...
-                        fp = None
-                        try:
-                            fp = open('projects/default.txt', 'w')
-                            fp.write(jsconfig)
-                        except:
-                            log.error('Unable to save configuration')
-                        else:
-                            log.info('Configuration successfully saved')
-                        finally:
-                            if fp is not None:
-                                fp.close()
-
-        return statusText
+            log.info('Configuration successfully saved')
+        finally:
+            if fp is not None:
+                fp.close()
 
-    def is_connected(self, starts, ends):
+    def get_topology(self, config=None):
+        """Returns a key identifying the components and wiring of a
+        config (the current one by default) or None if the config is
+        incomplete.
+        """
+        if config is None:
+            config = self.Config
+        try:
+            cids = tuple([c['cid'] for c in config['containers']])
+            wires = [(w['src']['moduleId'], w['src']['termid'],
+                      w['tgt']['moduleId'], w['tgt']['termid']) \
+                                            for w in config['wires']]
+        except:
+            return None
+        wires.sort()
+        return (cids, tuple(wires))
+
+    def get_parameters(self, config=None):
+        """Returns the parameter values of the components in a config
+        (the current one by default) keyed on the component id.
+        """
+        if config is None:
+            config = self.Config
+        parameters = {}
+        for container in config['containers']:
+            cid = container['cid']
+            params = self._registered_instances[cid].get_parameters()
+            parameters[cid] = dict((name, value[0]) \
+                                    for name, value in params.items())
+        return parameters
+
+    def update_parameters(self, config=None):
+        """Sends the parameters changed since the workflow was built
+        (or last updated) to the running workflow.
+        """
+        changed = {}
+        for cid, params in self.get_parameters(config).items():
+            if params != self._applied.get(cid):
+                changed[cid] = params
+
+        if changed:
+            self.Workflow.set_parameters(changed)
+            self._applied.update(changed)
+        log.info('Updated parameters of %d components' % len(changed))
+
+    def is_connected(self, starts, ends, graph=None):
+        # every adapter must reach every publisher
+        if graph is None:
+            graph = self.Graph
+        ends = [self._registered_instances[end] for end in ends]
         for start in starts:
+            found = reachable(graph, [self._registered_instances[start]])
             for end in ends:
-                connected = self.find_path(self.Graph, self._registered_instances[start], self._registered_instances[end])
-                if connected is None:
+                if end not in found:
                     return False
         return True
 
-    def find_path(self, graph, start, end, path=[]):
-        path = path + [start]
-        if start == end:
-            return path
-        if not graph.has_key(start):
-            return None
-        for node in graph[start]:
-            if node not in path:
-                newpath = self.find_path(graph, node, end, path)
-                if newpath: 
-                    return newpath
-        return None
-
     def _get_workflow(self):
         return self._workflow
 
@@ -250,35 +431,43 @@ class DataFlowGraph(object):
     def _set_graph(self, graph):
         self._graph = graph
 
-    def config_has_valid_input(self):
+    def config_has_valid_input(self, config=None):
+        if config is None:
+            config = self.Config
         valid_input = False
         valid_inputs = []
-        for container in self.Config['containers']:
+        for container in config['containers']:
             if container['type'] == 'Adapters':
                 valid_input = True
                 valid_inputs.append(container['cid'])
         return (valid_input, valid_inputs)
 
-    def config_has_valid_output(self):
+    def config_has_valid_output(self, config=None):
+        if config is None:
+            config = self.Config
         valid_output = False
         valid_outputs = []
-        for container in self.Config['containers']:
+        for container in config['containers']:
             if container['type'] == 'Publishers':
                 valid_output = True
                 valid_outputs.append(container['cid'])
         return (valid_output, valid_outputs)
 
-    def translate(self):
+    def translate(self, config=None):
+        # returns the graph of a config (the current one by default)
+        # or None if it can't be translated
+        if config is None:
+            config = self.Config
         status = None
         G = {}
-        for entry in self.Config['wires']:
+        for entry in config['wires']:
             try:
                 source_container_id = entry['src']['moduleId']
                 target_container_id = entry['tgt']['moduleId']
                 input = entry['tgt']['termid']
                 output = entry['src']['termid']
-                source_key = self.Config['containers'][source_container_id]['cid']
-                target_key = self.Config['containers'][target_container_id]['cid']
+                source_key = config['containers'][source_container_id]['cid']
+                target_key = config['containers'][target_container_id]['cid']
                 source = self._registered_instances[source_key]
                 target = self._registered_instances[target_key]
             except:
@@ -292,26 +481,83 @@ class DataFlowGraph(object):
                     G[source] = {target:(output, input)}
                 status = True
 
-        # set the graph 
-        self.Graph = G
-        return status
+        if status is False:
+            return None
+        return G
 
     def send(self, doc):
         response = {}
         try:
             if self.Workflow is not None:
-                self.Workflow.send(doc)
+                self.Workflow.send(doc, timeout=self._memory_timeout)
                 response['status'] = 'success'
             else:
                 log.error('No workflow defined')
                 response['status'] = 'failure'
                 response['error'] = 'No Active Workflow Defined'
+        except MemoryBudgetExceeded as e:
+            log.warning('Rejected document: %s' % str(e))
+            response['status'] = 'busy'
+            response['error'] = 'Memory Budget Exceeded, Try Again Later'
+        except:
+            response['status'] = 'failure'
+            response['error'] = 'Unexpected Error Running Project'
+
+        return response
+
+    def send_sync(self, doc, timeout=None):
+        response = {}
+        try:
+            if self.Workflow is not None:
+                # a collector publisher returns the document under this id
+                cid = uuid.uuid4().hex
+                doc.set_meta('correlationid', cid)
+                self.Workflow.expect(cid)
+                try:
+                    self.Workflow.send(doc, timeout=self._memory_timeout)
+                except:
+                    # drop the waiter, nothing is published for the document
+                    self.Workflow.wait_result(cid, 0)
+                    raise
+                result = self.Workflow.wait_result(cid, timeout)
+                if result is None:
+                    response['status'] = 'timeout'
+                    response['error'] = 'No Result Within %s Seconds' % timeout
+                else:
+                    response['status'] = 'success'
+                    response['packet'] = result
+            else:
+                log.error('No workflow defined')
+                response['status'] = 'failure'
+                response['error'] = 'No Active Workflow Defined'
+        except MemoryBudgetExceeded as e:
+            log.warning('Rejected document: %s' % str(e))
+            response['status'] = 'busy'
+            response['error'] = 'Memory Budget Exceeded, Try Again Later'
         except:
             response['status'] = 'failure'
             response['error'] = 'Unexpected Error Running Project'
 
         return response
 
+    def get_metrics(self):
+        response = {}
+        try:
+            if self.Workflow is not None:
+                response = self.Workflow.get_metrics()
+                response['status'] = 'success'
+            else:
+                log.error('No workflow defined')
+                response['status'] = 'failure'
+                response['error'] = 'No Active Workflow Defined'
+        except:
+            log.error('Unable to collect metrics')
+            traceback.print_exc()
+            response['status'] = 'failure'
+            response['error'] = 'Unexpected Error Collecting Metrics'
+
+        return response
+
     def _get_filters(self):
         self._filters.sort()
         return self._filters
@@ -1,4 +1,6 @@
 """The application's Globals object"""
+import atexit
+
 from PypesInterface import DataFlowGraph
 
 class Globals(object):
@@ -15,3 +17,5 @@ class Globals(object):
 
         """
         self.dfg = DataFlowGraph()
+        # stop the workflow's processes when the studio shuts down
+        atexit.register(self.dfg.close)
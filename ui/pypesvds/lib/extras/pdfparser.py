@@ -82,7 +82,11 @@ class PDFConverter(object):
     
     def convert(self, data):
         # convert binary pdf data into a file like structure
-        pdfdata = StringIO(data)
+        # file like data (such as a mapped spool file) is read in place
+        if hasattr(data, 'read'):
+            pdfdata = data
+        else:
+            pdfdata = StringIO(data)
 
         # I have no idea why this is needed
         CMapDB.initialize('CMap', 'CDBCMap')
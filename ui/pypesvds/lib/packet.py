@@ -3,18 +3,218 @@ of data both produced and consumed by components. Each
 componnet operates on a document object (or sequence of objects).
 """
 
+import os
+import sys
 import copy
+import pickle
 import pprint
 import logging
+import tempfile
 import unittest
 
-from collections import defaultdict
+from collections import defaultdict, Mapping
 
 LOG = logging.getLogger(__name__)
 
+# marks a missing key where None is a valid value
+_MISSING = object()
+
+def _same_items(a, b):
+    """Compares two mappings without copying either of them
+    """
+    # plain views are compared through the dictionary they view
+    if type(a) is DictView:
+        a = a._data
+    if type(b) is DictView:
+        b = b._data
+    if a is b:
+        return True
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a == b
+    if len(a) != len(b):
+        return False
+    for key, value in a.iteritems():
+        if key not in b or b[key] != value:
+            return False
+    return True
+
+class LazyValue(object):
+    """An attribute value that is only read when it is first used.
+
+    The source is a file path (optionally with an offset and size), an
+    object with a read() method or a callable returning the value. A
+    packet keeps the reference until L{Packet.get} loads the value and
+    pickles the reference rather than the value, so a callable must be
+    picklable to reach a worker process.
+    """
+
+    def __init__(self, source, offset=0, size=-1):
+        """Constructor
+
+        @param source: where the value is read from
+        @type source: string (path), file like object or callable
+        @param offset: where the value starts in a file
+        @type offset: int, default 0
+        @param size: the size of the value in a file
+        @type size: int, default -1 (to the end of the file)
+        """
+        self.source = source
+        self.offset = offset
+        self.size = size
+
+    def load(self):
+        """Reads the value from its source
+
+        @return: the value
+        """
+        source = self.source
+        if isinstance(source, basestring):
+            fp = open(source, 'rb')
+            try:
+                if self.offset:
+                    fp.seek(self.offset)
+                return fp.read(self.size)
+            finally:
+                fp.close()
+        if callable(source):
+            return source()
+        return source.read()
+
+    def __repr__(self):
+        return '<LazyValue %r>' % (self.source,)
+
+def _has_lazy(values):
+    """Returns True if a value list holds a L{LazyValue}
+    """
+    for value in values:
+        if isinstance(value, LazyValue):
+            return True
+    return False
+
+def _load_values(values):
+    """Replaces the L{LazyValue}s in a value list with their values
+
+    @return: the change in size of the values (see L{_value_size})
+    """
+    delta = 0
+    for idx, value in enumerate(values):
+        if isinstance(value, LazyValue):
+            values[idx] = value.load()
+            delta += _value_size(values[idx]) - _value_size(value)
+    return delta
+
+def _value_size(value):
+    """Returns the approximate size of an attribute value in bytes.
+
+    Strings count their length, as does anything else with a length
+    (a list value counts its items, not their size). L{LazyValue}s
+    count their size when it is known and None counts nothing. Other
+    values count what sys.getsizeof reports for them.
+    """
+    try:
+        return len(value)
+    except TypeError:
+        pass
+    if isinstance(value, LazyValue):
+        return max(value.size, 0)
+    if value is None:
+        return 0
+    return sys.getsizeof(value)
+
+def _values_size(values):
+    """Returns the approximate size of a list of attribute values in bytes
+    """
+    try:
+        # all strings (or anything else with a length), summed in C
+        return sum(map(len, values))
+    except TypeError:
+        return sum([_value_size(v) for v in values])
+
+class DictView(Mapping):
+    """A read-only view of a dictionary.
+
+    The view reflects later changes to the dictionary. Nested dictionaries
+    are returned as views too. Other values, such as the value lists of
+    attributes, are returned as stored and must not be modified.
+    """
+    __slots__ = ('_data',)
+
+    def __init__(self, data):
+        """Constructor
+
+        @param data: the dictionary to view
+        @type data: dictionary
+        """
+        self._data = data
+
+    def __getitem__(self, key):
+        # defaultdicts would insert missing keys
+        if key not in self._data:
+            raise KeyError(key)
+        value = self._data[key]
+        if isinstance(value, dict):
+            return DictView(value)
+        return value
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    # faster than the generic Mapping methods built on __getitem__
+    def get(self, key, default=None):
+        if key not in self._data:
+            return default
+        value = self._data[key]
+        if isinstance(value, dict):
+            return DictView(value)
+        return value
+
+    def keys(self):
+        return self._data.keys()
+
+    def iteritems(self):
+        for key, value in self._data.iteritems():
+            if isinstance(value, dict):
+                value = DictView(value)
+            yield key, value
+
+    def items(self):
+        return list(self.iteritems())
+
+    def copy(self):
+        """Returns a shallow copy of the viewed dictionary as a dict
+        """
+        return dict(self.iteritems())
+
+    def __eq__(self, other):
+        if not isinstance(other, Mapping):
+            return NotImplemented
+        return _same_items(self, other)
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    def __repr__(self):
+        return 'DictView(%r)' % dict(self._data)
+
 class Packet(object):
     """Represents the unit of information passed between components within the 
     data flow graph.
+
+    Clones share the value lists of their attributes with the packet they
+    were cloned from. A shared list is copied the first time either packet
+    modifies it in place (copy-on-write).
+
+    The approximate size of the attribute values is kept up to date as
+    attributes change (see L{get_size}).
     """
 
     def __init__(self, doc=None, meta=None, attr_meta=None):
@@ -48,6 +248,27 @@ class Packet(object):
         self._meta = meta
         self._attr_meta = defaultdict(dict, attr_meta)
 
+        # attributes whose value list is shared with a clone
+        self._shared = set()
+
+        # approximate size of the attribute values in bytes
+        self._size = sum(map(_values_size, self._doc.itervalues()))
+
+    def _writable(self, attr):
+        """Returns the value list of an attribute for modifying in place.
+
+        A list shared with a clone is copied first.
+
+        @param attr: the attribute being modified
+        @type attr: string
+        @return: the attribute's value list
+        """
+        if attr in self._shared:
+            self._shared.discard(attr)
+            if attr in self._doc:
+                self._doc[attr] = self._doc[attr][:]
+        return self._doc[attr]
+
     def pprint(self, meta=False):
         """Prints the document object
 
@@ -69,23 +290,37 @@ class Packet(object):
             print 'Attribute Meta'
             printer.pprint(sorted_attr_meta)
 
-    def get(self, attr, default=None):
+    def get(self, attr, default=None, load=True):
         """Returns the attribute or the default value if it does not exist.
 
+        L{LazyValue}s are loaded and replace the reference in the document
+        unless load is False.
+
         @param attr: the attribute to get
         @type attr: string
         @param default:  the default value to return
         @type default: any, default None
+        @param load: if lazy values are loaded
+        @type load: boolean, default True
         @return: string if single value, list if multivalue, default if the
             attribute does not exist.
         """
 
         if attr in self._doc:
-            value = self._doc[attr]
-            if len(value) == 1 and self.get_meta('multi', attr, False) is False:
-                value = value[0]
+            values = self._doc[attr]
+            if len(values) == 1 and self.get_meta('multi', attr, False) is False:
+                value = values[0]
+                if load and isinstance(value, LazyValue):
+                    # loaded values are not shared with clones
+                    values = self._writable(attr)
+                    values[0] = value.load()
+                    self._size += _value_size(values[0]) - _value_size(value)
+                    value = values[0]
             else:
-                value = value[:]
+                if load and _has_lazy(values):
+                    values = self._writable(attr)
+                    self._size += _load_values(values)
+                value = values[:]
         else:
             value = default
             
@@ -107,12 +342,18 @@ class Packet(object):
         @type keep_meta: boolean, default True
         """
             
+        old = self._doc.get(attr)
         if isinstance(value, list) and multi:
             self._doc[attr] = value[:]
             self.set_meta('multi', multi, attr)
+            self._size += _values_size(value)
         else:
             self._doc[attr] = [value]
             self.set_meta('multi', multi, attr)
+            self._size += _value_size(value)
+        self._shared.discard(attr)
+        if old:
+            self._size -= _values_size(old)
             
         if not keep_meta and attr in self._attr_meta:
             del self._attr_meta[attr]
@@ -135,6 +376,25 @@ class Packet(object):
         else:
             self.set(attr, value, multi, True)
 
+    def set_values(self, attr, values, meta=None):
+        """Sets the values of an attribute as they are stored, a list of
+        values whose meaning is given by the attribute's 'multi' metadata.
+        Used to write back the columns of a L{PacketBatch}.
+
+        @param attr: the attribute to set
+        @type attr: string
+        @param values: the attribute's values
+        @type values: list
+        @param meta: replaces the attribute metadata if given
+        @type meta: dictionary, default None (keep the metadata)
+        """
+        old = self._doc.get(attr, ())
+        self._doc[attr] = list(values)
+        self._shared.discard(attr)
+        self._size += _values_size(values) - _values_size(old)
+        if meta is not None:
+            self._attr_meta[attr] = meta.copy()
+
     def append(self, attr, value, extend=False):
         """Appends a value to an attribute. If the attribute is not already
         multivalued then it becomes multivaliued.  If extend is True and value
@@ -149,9 +409,11 @@ class Packet(object):
         """
         
         if isinstance(value, list) and extend:
-            self._doc[attr].extend(value)
+            self._writable(attr).extend(value)
+            self._size += _values_size(value)
         else:
-            self._doc[attr].append(value)
+            self._writable(attr).append(value)
+            self._size += _value_size(value)
                     
     def delete(self, attr):
         """Delete an attribute.  All metadata related to the attribute will be 
@@ -163,7 +425,9 @@ class Packet(object):
         """
         success = False
         try:
-            del self._doc[attr]
+            values = self._doc.pop(attr)
+            self._size -= _values_size(values)
+            self._shared.discard(attr)
             if attr in self._attr_meta:
                 del self._attr_meta[attr]
 
@@ -188,8 +452,13 @@ class Packet(object):
         try:
             # try to remove the item, if it results in
             # an empty attribute, delete the attribute altogether
-            del self._doc[attr][index]
-            if not self._doc[attr]:
+            if attr not in self._doc:
+                raise KeyError(attr)
+            values = self._writable(attr)
+            value = values[index]
+            del values[index]
+            self._size -= _value_size(value)
+            if not values:
                 self.delete(attr)
                 
             success = True
@@ -214,7 +483,12 @@ class Packet(object):
         """
         success = False
         try:
-            self._doc[attr][index] = value
+            if attr not in self._doc:
+                raise KeyError(attr)
+            values = self._writable(attr)
+            old = values[index]
+            values[index] = value
+            self._size += _value_size(value) - _value_size(old)
             success = True
         except (IndexError, KeyError):
             pass
@@ -239,6 +513,16 @@ class Packet(object):
         
         return copy.deepcopy(dict(self._doc))
 
+    def view_attributes(self):
+        """Returns a read-only view of the document attributes.
+
+        Unlike L{get_attributes} nothing is copied. Use L{get_attributes}
+        to modify the result.
+
+        @return: the attributes as a L{DictView}
+        """
+        return DictView(self._doc)
+
     def get_attribute_names(self):
         """Returns the names of the document attributes as a list.
 
@@ -255,6 +539,16 @@ class Packet(object):
         """
         
         return (copy.deepcopy(self._meta), copy.deepcopy(dict(self._attr_meta)))
+
+    def view_metas(self):
+        """Returns read-only views of the metadata.
+
+        Unlike L{get_metas} nothing is copied. Use L{get_metas} to
+        modify the result.
+
+        @return: tuple of L{DictView}, (packet meta, attribute meta)
+        """
+        return (DictView(self._meta), DictView(self._attr_meta))
     
     def get_meta_names(self):
         """Returns tuple of metadata names.  The first item is the packet 
@@ -270,6 +564,17 @@ class Packet(object):
             attr_names[attr] = sorted(self._attr_meta[attr].keys())
             
         return (sorted(self._meta.keys()), attr_names)
+
+    def get_size(self):
+        """Returns the approximate size of the attribute values in bytes.
+
+        The size is kept up to date as attributes are set and removed
+        rather than computed on each call. Metadata is not counted and
+        L{LazyValue}s count the size given to them until they are loaded.
+
+        @return: the size in bytes
+        """
+        return self._size
             
     def set_meta(self, meta, value, attr=None):
         """Set a metadata value.  If the metadata value already exists, it will
@@ -374,6 +679,33 @@ class Packet(object):
         """Creates a copy of the document. If metas is True then meta 
         information is also copied.
 
+        The clone shares the value lists of this document until either
+        of them modifies an attribute (see L{_writable}). The values
+        themselves are not copied.
+
+        @param metas: If we include metadata in the clone
+        @type metas: boolean, default True 
+        @return: Copy of the L{Packet} object
+        """
+        other = Packet()
+        other._doc.update(self._doc)
+        self._shared.update(self._doc)
+        other._shared.update(self._doc)
+        other._size = self._size
+
+        if metas:
+            other._meta.update(self._meta)
+            for attr, meta in self._attr_meta.iteritems():
+                other._attr_meta[attr] = dict(meta)
+        
+        return other
+
+    def deep_clone(self, metas=True):
+        """Creates a deep copy of the document. If metas is True then meta 
+        information is also copied.
+
+        Unlike L{clone} nothing is shared with this document.
+
         @param metas: If we include metadata in the clone
         @type metas: boolean, default True 
         @return: Copy of the L{Packet} object
@@ -398,11 +730,16 @@ class Packet(object):
         """
         
         if metas:
-            meta, attr_meta = other.get_metas()
+            meta, attr_meta = other.view_metas()
             self._meta.update(meta)
-            self._attr_meta.update(attr_meta)
+            for attr, ameta in attr_meta.iteritems():
+                self._attr_meta[attr] = ameta.copy()
             
-        self._doc.update(other.get_attributes())
+        for attr, values in other.view_attributes().iteritems():
+            self._size += _values_size(values) - \
+                                        _values_size(self._doc.get(attr, ()))
+            self._doc[attr] = list(values)
+            self._shared.discard(attr)
 
     def __iter__(self):
         """Packet iterator
@@ -413,6 +750,22 @@ class Packet(object):
         for field in sorted_fields:
             yield field
 
+    def iteritems(self, sort=False):
+        """Iterates over the (key/value) pairs of the document.
+
+        Unless sort is True the attributes come in no particular order
+        and nothing is allocated, making this cheaper than iterating
+        the packet itself for callers that do not need sorted attributes.
+        The value lists must not be modified.
+
+        @param sort: If the attributes are sorted by name
+        @type sort: boolean, default False
+        @return: iterator of tuple (key/value) pairs
+        """
+        if sort:
+            return iter(self)
+        return self._doc.iteritems()
+
     def __eq__(self, rhs):
         """Packet == operator
 
@@ -421,11 +774,11 @@ class Packet(object):
         """
         
         try:
-            r_meta, r_attr_meta = rhs.get_metas()
-            r_doc = rhs.get_attributes()
-            result = (self._doc == r_doc) and \
-                     (self._meta == r_meta) and \
-                     (self._attr_meta == r_attr_meta)
+            r_meta, r_attr_meta = rhs.view_metas()
+            r_doc = rhs.view_attributes()
+            result = _same_items(self._doc, r_doc) and \
+                     _same_items(self._meta, r_meta) and \
+                     _same_items(self._attr_meta, r_attr_meta)
         except AttributeError:
             result = False
 
@@ -440,13 +793,643 @@ class Packet(object):
 
         return (not self == rhs)
 
+    def __getstate__(self):
+        """Returns the packet as a (doc, meta, attribute meta) tuple.
+
+        Plain dictionaries are pickled rather than the defaultdicts and
+        the instance dictionary. Nothing is shared after unpickling.
+
+        @return: tuple, (attributes, packet meta, attribute meta)
+        """
+        return (dict(self._doc), self._meta, dict(self._attr_meta))
+
+    def __setstate__(self, state):
+        doc, self._meta, attr_meta = state
+        self._doc = defaultdict(list, doc)
+        self._attr_meta = defaultdict(dict, attr_meta)
+        self._shared = set()
+        self._size = sum(map(_values_size, doc.itervalues()))
+
+
+class _Values(list):
+    """The value list of a multivalued L{CompactPacket} attribute.
+
+    Single values are stored unboxed so a list subclass is used to tell
+    an attribute's values apart from a single value that is a list.
+    """
+    __slots__ = ()
+
+class _AttributesView(DictView):
+    """A read-only view of the attributes of a L{CompactPacket}.
+
+    Unboxed single values are returned in a one item list.
+    """
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        value = self._data[key]
+        if isinstance(value, _Values):
+            return value
+        return [value]
+
+    def get(self, key, default=None):
+        if key not in self._data:
+            return default
+        return self[key]
+
+    def iteritems(self):
+        for key, value in self._data.iteritems():
+            if not isinstance(value, _Values):
+                value = [value]
+            yield key, value
+
+    def __repr__(self):
+        return 'DictView(%r)' % dict(self.iteritems())
+
+def _stored_size(stored):
+    """Returns the size of the values of a L{CompactPacket} attribute
+    """
+    if isinstance(stored, _Values):
+        return _values_size(stored)
+    return _value_size(stored)
+
+def _intern(name):
+    """Interns str attribute names so packets share one copy of each name
+    """
+    if type(name) is str:
+        return intern(name)
+    return name
+
+class CompactPacket(object):
+    """A memory compact L{Packet} with the same public API.
+
+    Packets are stored in slots rather than an instance dict. An
+    attribute holding a single value that is not multivalued stores the
+    value itself rather than a one item list and its 'multi' meta is
+    implied. The attribute metadata and the copy-on-write bookkeeping
+    are only allocated once they are used. Attribute names are interned.
+    """
+    __slots__ = ('_doc', '_meta', '_attr_meta', '_shared', '_size')
+
+    def __init__(self, doc=None, meta=None, attr_meta=None):
+        """Constructor
+        
+        @param doc: attributes to use
+        @type doc: dictionary, default None
+        @param meta: packet metadata to use
+        @type meta: dictionary, default None
+        @param attr_meta: attribute metadata to use
+        @type attr_meta: dictionary, default None
+        """
+        self._doc = {}
+        self._meta = {}
+        self._attr_meta = None
+        self._shared = None
+
+        if meta is not None:
+            self._meta = copy.deepcopy(meta)
+
+        if attr_meta:
+            self._attr_meta = dict((_intern(k), dict(v)) for k, v in \
+                                    copy.deepcopy(attr_meta).iteritems())
+
+        if doc is not None:
+            for attr, value in copy.deepcopy(doc).iteritems():
+                attr = _intern(attr)
+                self._doc[attr] = _Values(value if isinstance(value, list) \
+                                                            else [value])
+                self._compact(attr)
+        self._size = sum(map(_stored_size, self._doc.itervalues()))
+
+    def _explicit(self, attr):
+        """Returns the stored metadata of an attribute, allocating it if needed
+        """
+        if self._attr_meta is None:
+            self._attr_meta = {}
+        try:
+            return self._attr_meta[attr]
+        except KeyError:
+            meta = self._attr_meta[attr] = {}
+            return meta
+
+    def _compact(self, attr):
+        """Unboxes a single value whose 'multi' meta is False
+        """
+        values = self._doc[attr]
+        if not isinstance(values, _Values) or len(values) != 1 or \
+                                            self._attr_meta is None:
+            return
+        meta = self._attr_meta.get(attr)
+        if meta is not None and meta.get('multi', True) is False:
+            self._doc[attr] = values[0]
+            del meta['multi']
+            if not meta:
+                del self._attr_meta[attr]
+            self._unshare(attr)
+
+    def _writable(self, attr):
+        """Returns the value list of an attribute for modifying in place.
+
+        Unboxed values are boxed (making their 'multi' meta explicit) and
+        lists shared with a clone are copied first.
+
+        @param attr: the attribute being modified
+        @type attr: string
+        @return: the attribute's value list
+        """
+        try:
+            values = self._doc[attr]
+        except KeyError:
+            values = self._doc[attr] = _Values()
+            return values
+
+        if not isinstance(values, _Values):
+            values = self._doc[attr] = _Values([values])
+            self._explicit(attr)['multi'] = False
+        elif self._shared is not None and attr in self._shared:
+            values = self._doc[attr] = _Values(values)
+            self._shared.discard(attr)
+        return values
+
+    def _unshare(self, attr):
+        if self._shared is not None:
+            self._shared.discard(attr)
+
+    def _values(self, attr):
+        """Returns the values of an attribute as a list (do not modify)
+        """
+        values = self._doc[attr]
+        if isinstance(values, _Values):
+            return values
+        return [values]
+
+    def _full_attr_meta(self):
+        """Returns the attribute metadata including implied 'multi' metas
+        """
+        attr_meta = {}
+        if self._attr_meta is not None:
+            attr_meta.update(self._attr_meta)
+        for attr, values in self._doc.iteritems():
+            if not isinstance(values, _Values):
+                meta = dict(attr_meta.get(attr, ()))
+                meta['multi'] = False
+                attr_meta[attr] = meta
+        return attr_meta
+
+    def pprint(self, meta=False):
+        """Prints the document object
+
+        @param meta: if metadata should be printed or not
+        @type meta: boolean, default False
+        """
+        sorted_fields = [(k, list(self._values(k))) \
+                                for k in sorted(self._doc.keys())]
+        printer = pprint.PrettyPrinter(indent=4)
+        print 'Attributes:'
+        printer.pprint(sorted_fields)
+        
+        if meta:
+            attr_meta = self._full_attr_meta()
+            sorted_meta = [(k, self._meta[k]) \
+                            for k in sorted(self._meta.keys())]
+            sorted_attr_meta = [(k, attr_meta[k]) \
+                                    for k in sorted(attr_meta.keys())]
+            print 'Packet Meta'
+            printer.pprint(sorted_meta)
+            print 'Attribute Meta'
+            printer.pprint(sorted_attr_meta)
+
+    def get(self, attr, default=None, load=True):
+        """Returns the attribute or the default value if it does not exist.
+
+        @see: L{Packet.get}
+        """
+        try:
+            value = self._doc[attr]
+        except KeyError:
+            return default
+
+        if not isinstance(value, _Values):
+            if load and isinstance(value, LazyValue):
+                self._doc[attr] = value.load()
+                self._size += _value_size(self._doc[attr]) - _value_size(value)
+                value = self._doc[attr]
+            return value
+        if load and _has_lazy(value):
+            value = self._writable(attr)
+            self._size += _load_values(value)
+        if len(value) == 1 and self.get_meta('multi', attr, False) is False:
+            return value[0]
+        return value[:]
+
+    def set(self, attr, value, multi=False, keep_meta=True):
+        """Sets the attribute, overwriting any existing value(s).
+
+        @see: L{Packet.set}
+        """
+        attr = _intern(attr)
+        self._unshare(attr)
+        if isinstance(value, list) and multi:
+            size = _values_size(value)
+        else:
+            size = _value_size(value)
+        self._size += size - _stored_size(self._doc.get(attr))
+
+        if not keep_meta:
+            # the attribute is left without any metadata
+            if self._attr_meta is not None:
+                self._attr_meta.pop(attr, None)
+            if isinstance(value, list) and multi:
+                self._doc[attr] = _Values(value)
+            else:
+                self._doc[attr] = _Values([value])
+            return
+
+        if isinstance(value, list) and multi:
+            self._doc[attr] = _Values(value)
+            self._explicit(attr)['multi'] = multi
+        elif multi:
+            self._doc[attr] = _Values([value])
+            self._explicit(attr)['multi'] = multi
+        else:
+            self._doc[attr] = value
+            if self._attr_meta is not None:
+                meta = self._attr_meta.get(attr)
+                if meta is not None:
+                    meta.pop('multi', None)
+                    if not meta:
+                        del self._attr_meta[attr]
+
+    def add(self, attr, value, multi=False):
+        """Sets the attribute only if it does not already exist.
+
+        @see: L{Packet.add}
+        """
+        if attr in self._doc:
+            LOG.debug('Attribute %s exists, not adding!' % attr)
+        else:
+            self.set(attr, value, multi, True)
+
+    def set_values(self, attr, values, meta=None):
+        """Sets the values of an attribute as they are stored.
+
+        @see: L{Packet.set_values}
+        """
+        attr = _intern(attr)
+        implied = attr in self._doc and \
+                        not isinstance(self._doc[attr], _Values)
+        self._size += _values_size(values) - _stored_size(self._doc.get(attr))
+        self._doc[attr] = _Values(values)
+        self._unshare(attr)
+        if meta is not None:
+            self._explicit(attr)
+            self._attr_meta[attr] = meta.copy()
+        elif implied:
+            self._explicit(attr)['multi'] = False
+        self._compact(attr)
+
+    def append(self, attr, value, extend=False):
+        """Appends a value to an attribute.
+
+        @see: L{Packet.append}
+        """
+        values = self._writable(_intern(attr))
+        if isinstance(value, list) and extend:
+            values.extend(value)
+            self._size += _values_size(value)
+        else:
+            values.append(value)
+            self._size += _value_size(value)
+                    
+    def delete(self, attr):
+        """Delete an attribute.  All metadata related to the attribute will be 
+        lost.
+
+        @see: L{Packet.delete}
+        """
+        if attr not in self._doc:
+            return False
+
+        self._size -= _stored_size(self._doc.pop(attr))
+        self._unshare(attr)
+        if self._attr_meta is not None:
+            self._attr_meta.pop(attr, None)
+        return True
+
+    def remove(self, attr, index=0):
+        """Remove an item from the attribute.
+
+        @see: L{Packet.remove}
+        """
+        if attr not in self._doc:
+            return False
+
+        values = self._writable(attr)
+        try:
+            value = values[index]
+        except IndexError:
+            return False
+        del values[index]
+        self._size -= _value_size(value)
+
+        if not self._doc[attr]:
+            self.delete(attr)
+        return True
+
+    def replace(self, attr, value, index=0):
+        """Replaces an item in the attribute.
+
+        @see: L{Packet.replace}
+        """
+        if attr not in self._doc:
+            return False
+
+        current = self._doc[attr]
+        if not isinstance(current, _Values) and index in (0, -1):
+            self._doc[attr] = value
+            self._size += _value_size(value) - _value_size(current)
+            return True
+
+        values = self._writable(attr)
+        try:
+            old = values[index]
+        except IndexError:
+            return False
+        values[index] = value
+        self._size += _value_size(value) - _value_size(old)
+        return True
+
+    def has(self, attr):
+        """Returns true if the document has the attribute, false otherwise.
+
+        @see: L{Packet.has}
+        """
+        return attr in self._doc
+
+    def get_attributes(self):
+        """Returns the document as a dictionary.
+
+        @see: L{Packet.get_attributes}
+        """
+        return copy.deepcopy(dict((k, list(self._values(k))) \
+                                            for k in self._doc))
+
+    def view_attributes(self):
+        """Returns a read-only view of the document attributes.
+
+        @see: L{Packet.view_attributes}
+        """
+        return _AttributesView(self._doc)
+
+    def get_attribute_names(self):
+        """Returns the names of the document attributes as a list.
+
+        @see: L{Packet.get_attribute_names}
+        """
+        return sorted(self._doc.keys())
+
+    def get_metas(self):
+        """Returns tuple of metadata.
+
+        @see: L{Packet.get_metas}
+        """
+        return (copy.deepcopy(self._meta),
+                copy.deepcopy(self._full_attr_meta()))
+
+    def view_metas(self):
+        """Returns read-only views of the metadata.
+
+        @see: L{Packet.view_metas}
+        """
+        return (DictView(self._meta), DictView(self._full_attr_meta()))
+    
+    def get_meta_names(self):
+        """Returns tuple of metadata names.
+
+        @see: L{Packet.get_meta_names}
+        """
+        attr_names = {}
+        for attr, meta in self._full_attr_meta().iteritems():
+            attr_names[attr] = sorted(meta.keys())
+            
+        return (sorted(self._meta.keys()), attr_names)
+
+    def get_size(self):
+        """Returns the approximate size of the attribute values in bytes.
+
+        @see: L{Packet.get_size}
+        """
+        return self._size
+            
+    def set_meta(self, meta, value, attr=None):
+        """Set a metadata value.
+
+        @see: L{Packet.set_meta}
+        """
+        if attr is None:
+            self._meta[meta] = value
+            return True
+        if attr not in self._doc:
+            return False
+
+        if meta == 'multi':
+            if value is False and len(self._values(attr)) == 1:
+                # store the single value unboxed (again)
+                if isinstance(self._doc[attr], _Values):
+                    self._explicit(attr)['multi'] = value
+                    self._compact(attr)
+                return True
+            self._writable(attr)
+        self._explicit(attr)[meta] = value
+        return True
+
+    def get_meta(self, meta, attr=None, default=None):
+        """Return the metadata value if it exists, otherwise the default value 
+        is returned.
+
+        @see: L{Packet.get_meta}
+        """
+        if attr is None:
+            return self._meta.get(meta, default)
+
+        values = self._doc.get(attr, _MISSING)
+        if meta == 'multi' and values is not _MISSING and \
+                                        not isinstance(values, _Values):
+            return False
+
+        if self._attr_meta is not None and attr in self._attr_meta:
+            return self._attr_meta[attr].get(meta, default)
+        return default
+
+    def delete_meta(self, meta, attr=None):
+        """Deletes a metadata value. 
+
+        @see: L{Packet.delete_meta}
+        """
+        if attr is None:
+            return self._meta.pop(meta, _MISSING) is not _MISSING
+
+        values = self._doc.get(attr, _MISSING)
+        if meta == 'multi' and values is not _MISSING and \
+                                        not isinstance(values, _Values):
+            self._writable(attr)
+
+        if self._attr_meta is None or attr not in self._attr_meta:
+            return False
+        return self._attr_meta[attr].pop(meta, _MISSING) is not _MISSING
+        
+    def has_meta(self, meta, attr=None):
+        """Checks if a given metadata value exists.
+
+        @see: L{Packet.has_meta}
+        """
+        if attr is None:
+            return meta in self._meta
+        return self.get_meta(meta, attr, _MISSING) is not _MISSING
+
+    def is_multivalued(self, attr):
+        """Returns True if the attribute is multivalued.
+
+        @see: L{Packet.is_multivalued}
+        """
+        return self.get_meta('multi', attr, False)
+
+    def clone(self, metas=True):
+        """Creates a copy of the document.
+
+        Like L{Packet.clone} value lists are shared until modified.
+
+        @see: L{Packet.clone}
+        """
+        other = CompactPacket()
+        other._doc.update(self._doc)
+        other._size = self._size
+
+        shared = [k for k, v in self._doc.iteritems() \
+                                        if isinstance(v, _Values)]
+        if shared:
+            if self._shared is None:
+                self._shared = set()
+            self._shared.update(shared)
+            other._shared = set(shared)
+
+        if metas:
+            other._meta.update(self._meta)
+            if self._attr_meta:
+                other._attr_meta = dict((k, dict(v)) for k, v in \
+                                        self._attr_meta.iteritems())
+        else:
+            # without metadata single values lose their implied 'multi'
+            for attr, value in other._doc.iteritems():
+                if not isinstance(value, _Values):
+                    other._doc[attr] = _Values([value])
+
+        return other
+
+    def deep_clone(self, metas=True):
+        """Creates a deep copy of the document.
+
+        @see: L{Packet.deep_clone}
+        """
+        if metas:
+            meta, attr_meta = self._meta, self._full_attr_meta()
+        else:
+            meta, attr_meta = {}, {}
+        return CompactPacket(dict((k, list(self._values(k))) \
+                                        for k in self._doc), meta, attr_meta)
+
+    def merge(self, other, metas=False):
+        """Merges this document with another document.
+
+        @see: L{Packet.merge}
+        """
+        if metas:
+            meta, attr_meta = other.view_metas()
+            self._meta.update(meta)
+            for attr, ameta in attr_meta.iteritems():
+                attr = _intern(attr)
+                # the attribute's metadata is replaced, implied or not
+                if attr in self._doc:
+                    self._writable(attr)
+                self._explicit(attr)
+                self._attr_meta[attr] = ameta.copy()
+
+        for attr, values in other.view_attributes().iteritems():
+            attr = _intern(attr)
+            implied = attr in self._doc and \
+                            not isinstance(self._doc[attr], _Values)
+            self._size += _values_size(values) - \
+                                        _stored_size(self._doc.get(attr))
+            self._doc[attr] = _Values(values)
+            self._unshare(attr)
+            if implied:
+                self._explicit(attr)['multi'] = False
+            self._compact(attr)
+
+    def __iter__(self):
+        """Packet iterator
+
+        @return: tuple (key/value) pairs
+        """
+        for k in sorted(self._doc.keys()):
+            yield (k, self._values(k))
+
+    def iteritems(self, sort=False):
+        """Iterates over the (key/value) pairs of the document.
+
+        @see: L{Packet.iteritems}
+        """
+        if sort:
+            return iter(self)
+        return self.view_attributes().iteritems()
+
+    def __eq__(self, rhs):
+        """Packet == operator
+
+        @param rhs: The other packet to compare
+        @type rhs: L{Packet} or L{CompactPacket} object 
+        """
+        try:
+            r_meta, r_attr_meta = rhs.view_metas()
+            r_doc = rhs.view_attributes()
+            result = _same_items(self.view_attributes(), r_doc) and \
+                     _same_items(self._meta, r_meta) and \
+                     _same_items(self._full_attr_meta(), r_attr_meta)
+        except AttributeError:
+            result = False
+
+        return result
+
+    def __ne__(self, rhs):
+        """Packet != operator
+
+        @param rhs: the L{Packet} on the right hand side of the operator
+        @type rhs: L{Packet} object
+        """
+        return (not self == rhs)
+
+    def __getstate__(self):
+        """Returns the packet as a (doc, meta, attribute meta) tuple.
+
+        @see: L{Packet.__getstate__}
+        """
+        return (self._doc, self._meta, self._attr_meta)
+
+    def __setstate__(self, state):
+        self._doc, self._meta, self._attr_meta = state
+        self._shared = None
+        self._size = sum(map(_stored_size, self._doc.itervalues()))
+
 
 class PacketUnitTest(unittest.TestCase):
     """Unit test for L{Packet}"""
+
+    # the packet implementation under test
+    packet_class = Packet
     
     def setUp(self):
         """Default test setup"""
-        self.doc = Packet()
+        self.doc = self.packet_class()
         
     def test_get(self):
         """Test get"""
@@ -496,6 +1479,23 @@ class PacketUnitTest(unittest.TestCase):
         self.doc.add('a', 2)
         self.assertNotEqual(self.doc.get('a'), 2, 'Failed add')
         
+    def test_set_values(self):
+        """Test set_values"""
+        self.doc.set('a', 1)
+        self.doc.set_meta('am1', 1, 'a')
+        values = [2, 3]
+        self.doc.set_values('a', values)
+        values.append(4)
+        self.assertEqual(self.doc.get('a'), [2, 3], 'Failed set_values')
+        self.assertEqual(self.doc.get_meta('am1', 'a'), 1, 'Failed set_values')
+
+        self.doc.set_values('b', [5], {'multi': True})
+        self.assertEqual(self.doc.get('b'), [5], 'Failed set_values')
+        self.doc.set_values('b', [6], {'multi': False})
+        self.assertEqual(self.doc.get('b'), 6, 'Failed set_values')
+        self.assertEqual(self.doc.is_multivalued('b'), False, 
+            'Failed set_values')
+
     def test_append(self):
         """Test append"""
         # append a single value to non-existing attribute
@@ -586,6 +1586,31 @@ class PacketUnitTest(unittest.TestCase):
         self.assertEqual(self.doc.get_attributes(), 
             {'a': [1],'b': [2],'c':[[3,4]]}, 'Failed get_attributes')
         
+    def test_views(self):
+        """Test view_attributes and view_metas"""
+        self.doc.set('a', 1)
+        self.doc.set_meta('pm1', 1)
+        self.doc.set_meta('am1', 1, 'a')
+        attrs = self.doc.view_attributes()
+        meta, attr_meta = self.doc.view_metas()
+        self.assertEqual(attrs, {'a': [1]}, 'Failed views')
+        self.assertEqual(meta, {'pm1': 1}, 'Failed views')
+        self.assertEqual(attr_meta['a']['am1'], 1, 'Failed views')
+
+        # views are read-only and missing keys are not created
+        def assign(view, key, value):
+            view[key] = value
+        self.assertRaises(TypeError, assign, attrs, 'b', [2])
+        self.assertRaises(TypeError, assign, attr_meta['a'], 'am2', 2)
+        self.assertRaises(KeyError, attrs.__getitem__, 'b')
+        self.assertEqual(self.doc.has('b'), False, 'Failed views')
+
+        # attribute views follow the document
+        self.doc.set('b', 2)
+        self.assertEqual(attrs, {'a': [1], 'b': [2]}, 'Failed views')
+        self.assertEqual(self.doc.view_attributes(), 
+            self.doc.get_attributes(), 'Failed views')
+
     def test_get_attribute_names(self):
         """Test get_attribute_names"""
         # empty packet
@@ -818,10 +1843,38 @@ class PacketUnitTest(unittest.TestCase):
         self.assertEqual(pp4.get_attributes(), {'a': [1], 'b': [2]},
             'Failed clone')
         
+    def test_clone_copy_on_write(self):
+        """Test clone shares values until modified"""
+        self.doc.set('a', [1, 2], multi=True)
+        self.doc.set('b', 3)
+        self.doc.set_meta('am1', 1, 'a')
+        pp2 = self.doc.clone()
+        self.assertEqual(pp2._doc['a'] is self.doc._doc['a'], True,
+            'Failed clone')
+
+        # modifying the clone leaves the original alone
+        pp2.append('a', 4)
+        pp2.replace('b', 5)
+        pp2.set_meta('am1', 2, 'a')
+        self.assertEqual(self.doc.get('a'), [1, 2], 'Failed clone')
+        self.assertEqual(self.doc.get('b'), 3, 'Failed clone')
+        self.assertEqual(self.doc.get_meta('am1', 'a'), 1, 'Failed clone')
+        self.assertEqual(pp2.get('a'), [1, 2, 4], 'Failed clone')
+        self.assertEqual(pp2.get('b'), 5, 'Failed clone')
+
+        # modifying the original leaves the clone alone
+        pp3 = self.doc.clone()
+        self.doc.remove('a', 0)
+        self.doc.append('b', 6)
+        self.assertEqual(pp3.get('a'), [1, 2], 'Failed clone')
+        self.assertEqual(pp3.get('b'), 3, 'Failed clone')
+        self.assertEqual(self.doc.get('a'), [2], 'Failed clone')
+        self.assertEqual(self.doc.get('b'), [3, 6], 'Failed clone')
+
     def test_merge(self):
         """Test merge"""
         # empty packet with non-empty, no metas
-        pp2 = Packet()
+        pp2 = self.packet_class()
         pp2.set('a', 1)
         pp2.set('b', 2)
         pp2.set_meta('pm1', 1)
@@ -832,7 +1885,7 @@ class PacketUnitTest(unittest.TestCase):
             'Failed merge')
         
         # empty packet with non-empty, with metas
-        self.doc = Packet()
+        self.doc = self.packet_class()
         self.doc.merge(pp2, metas=True)
         self.assertEqual(self.doc.get_metas(), ({'pm1': 1}, {'a': {'am1': 1}}),
             'Failed merge')
@@ -862,7 +1915,7 @@ class PacketUnitTest(unittest.TestCase):
         
         # eq
         pp2 = self.doc.clone()
-        pp3 = Packet()
+        pp3 = self.packet_class()
         self.assertEqual(pp2 == self.doc, True, 'Failed eq')
         self.assertEqual(pp3 == self.doc, False, 'Failed eq')
         self.assertEqual(self.doc == 2, False, 'Failed eq')
@@ -871,6 +1924,108 @@ class PacketUnitTest(unittest.TestCase):
         self.assertEqual(pp2 != self.doc, False, 'Failed ne')
         self.assertEqual(pp3 != self.doc, True, 'Failed ne')
         
+    def test_iteritems(self):
+        """Test iteritems"""
+        self.assertEqual(list(self.doc.iteritems()), [], 'Failed iteritems')
+
+        self.doc.set('c', 'test')
+        self.doc.set('a', [1, 2, 3], multi=True)
+        self.doc.set('b', [4, 5])
+        self.assertEqual(sorted(self.doc.iteritems()), [('a', [1, 2, 3]), 
+            ('b', [[4, 5]]), ('c', ['test'])], 'Failed iteritems')
+        self.assertEqual(list(self.doc.iteritems(sort=True)), list(self.doc),
+            'Failed iteritems')
+
+    def test_lazy(self):
+        """Test lazy values"""
+        loads = []
+        def loader():
+            loads.append(1)
+            return 'abc'
+
+        self.doc.set('a', LazyValue(loader))
+        self.doc.set('b', [LazyValue(loader), 'x'], multi=True)
+        self.assertEqual(self.doc.has('a'), True, 'Failed lazy')
+        self.assertEqual(isinstance(self.doc.get('a', load=False), 
+            LazyValue), True, 'Failed lazy')
+        self.assertEqual(loads, [], 'Failed lazy')
+
+        # loaded once, on first get
+        self.assertEqual(self.doc.get('a'), 'abc', 'Failed lazy')
+        self.assertEqual(self.doc.get('a'), 'abc', 'Failed lazy')
+        self.assertEqual(self.doc.get('b'), ['abc', 'x'], 'Failed lazy')
+        self.assertEqual(loads, [1, 1], 'Failed lazy')
+
+        # file references are pickled as references
+        fd, path = tempfile.mkstemp()
+        try:
+            os.write(fd, 'headbody')
+            os.close(fd)
+            self.doc.set('c', LazyValue(path, 4))
+            other = pickle.loads(pickle.dumps(self.doc, 2))
+            self.assertEqual(isinstance(other.get('c', load=False), 
+                LazyValue), True, 'Failed lazy')
+            self.assertEqual(other.get('c'), 'body', 'Failed lazy')
+        finally:
+            os.unlink(path)
+
+    def test_pickle(self):
+        """Test pickling roundtrips"""
+        self.doc.set('a', [1, 2, 3], multi=True)
+        self.doc.set('b', [4, 5])
+        self.doc.set('c', u'test')
+        self.doc.set_meta('pm1', 1)
+        self.doc.set_meta('am1', 1, 'a')
+        clone = self.doc.clone()
+
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            other = pickle.loads(pickle.dumps(clone, protocol))
+            self.assertEqual(type(other), self.packet_class, 'Failed pickle')
+            self.assertEqual(other, self.doc, 'Failed pickle')
+            self.assertEqual(other.is_multivalued('a'), True, 'Failed pickle')
+
+            # nothing is shared with the pickled packet
+            other.append('a', 4)
+            other.set_meta('am2', 2, 'c')
+            self.assertEqual(clone.get('a'), [1, 2, 3], 'Failed pickle')
+            self.assertEqual(clone.has_meta('am2', 'c'), False, 
+                'Failed pickle')
+
+    def test_get_size(self):
+        """Test size accounting"""
+        self.assertEqual(self.doc.get_size(), 0, 'Failed get_size')
+        self.doc.set('a', 'abcd')
+        self.doc.set('b', ['ab', 'cd', 'ef'], multi=True)
+        self.doc.set_meta('pm1', 'metadata is not counted')
+        self.assertEqual(self.doc.get_size(), 10, 'Failed get_size')
+
+        self.doc.set('a', 'ab')
+        self.doc.append('b', ['gh', 'ij'], extend=True)
+        self.doc.replace('b', 'abcd', 0)
+        self.doc.remove('b', 1)
+        self.assertEqual(self.doc.get_size(), 12, 'Failed get_size')
+
+        clone = self.doc.clone()
+        clone.delete('b')
+        clone.set_values('c', ['xyz'])
+        self.assertEqual(clone.get_size(), 5, 'Failed get_size')
+        self.assertEqual(self.doc.get_size(), 12, 'Failed get_size')
+
+        self.doc.merge(clone)
+        self.assertEqual(self.doc.get_size(), 15, 'Failed get_size')
+        other = pickle.loads(pickle.dumps(self.doc, 2))
+        self.assertEqual(other.get_size(), 15, 'Failed get_size')
+
+        # lazy values count their given size until they are loaded
+        self.doc.set('d', LazyValue(lambda: 'abc'))
+        self.doc.set('e', [LazyValue(lambda: 'abcd', size=10)], multi=True)
+        self.assertEqual(self.doc.get_size(), 25, 'Failed get_size')
+        self.doc.get('d')
+        self.doc.get('e')
+        self.assertEqual(self.doc.get_size(), 22, 'Failed get_size')
+        self.assertEqual(self.packet_class(self.doc.get_attributes()).get_size(),
+            22, 'Failed get_size')
+
     def test_pprint(self):
         """Test pprint"""
         self.doc.set('a', [1, 2, 3], multi=True)
@@ -885,6 +2040,38 @@ class PacketUnitTest(unittest.TestCase):
         self.doc.pprint(meta=True)
         
 
+class CompactPacketUnitTest(PacketUnitTest):
+    """Runs the L{Packet} unit tests against L{CompactPacket}"""
+
+    packet_class = CompactPacket
+
+    def test_compact_storage(self):
+        """Test single values are unboxed and names interned"""
+        self.doc.set(''.join(['fi', 'eld']), 'v')
+        self.doc.set('m', [1, 2], multi=True)
+        self.assertEqual(self.doc._doc['field'], 'v', 'Failed compact')
+        self.assertEqual(self.doc._attr_meta, {'m': {'multi': True}},
+            'Failed compact')
+        self.assertEqual([k for k in self.doc._doc if k == 'field'][0] \
+            is intern('field'), True, 'Failed compact')
+
+        # implied multi meta is reported like any other meta
+        self.assertEqual(self.doc.get_metas(), ({}, {'field': 
+            {'multi': False}, 'm': {'multi': True}}), 'Failed compact')
+
+        # equal to the same document held in a Packet
+        other = Packet()
+        other.set('field', 'v')
+        other.set('m', [1, 2], multi=True)
+        self.assertEqual(self.doc == other, True, 'Failed compact')
+        self.assertEqual(other == self.doc, True, 'Failed compact')
+
+def suite():
+    """Returns the L{Packet} and L{CompactPacket} unit tests"""
+    loader = unittest.TestLoader()
+    return unittest.TestSuite([
+                loader.loadTestsFromTestCase(PacketUnitTest),
+                loader.loadTestsFromTestCase(CompactPacketUnitTest)])
+
 if __name__ == '__main__':
-    SUITE = unittest.TestLoader().loadTestsFromTestCase(PacketUnitTest)
-    unittest.TextTestRunner(verbosity=2).run(SUITE)
+    unittest.TextTestRunner(verbosity=2).run(suite())
@@ -0,0 +1,324 @@
+"""Provides a column-wise view of a batch of packets.
+
+Field-wise components (setting, deleting, copying or normalizing the
+same fields on every document) can work on whole columns instead of
+dispatching on each document in turn::
+
+    batch = PacketBatch(self.receive_batch('in'))
+    column = batch.get_column('title')
+    batch.set_column('title', [None if vals is None else \\
+                            [v.lower() for v in vals] for vals in column])
+    self.send_batch('out', batch.to_packets())
+
+A column holds one entry per packet: the attribute's value list, or
+None where the packet does not have the attribute. Columns are read
+from the packets when first used and only the columns that were set
+are written back.
+"""
+
+import unittest
+
+from pypesvds.lib.packet import Packet, CompactPacket
+
+class PacketBatch(object):
+    """Holds a batch of packets column-wise.
+    """
+
+    def __init__(self, packets=None):
+        """Constructor
+
+        @param packets: the packets in the batch
+        @type packets: list of L{Packet} or L{CompactPacket}
+        """
+        if packets is None:
+            packets = []
+
+        self._packets = list(packets)
+        self._attributes = None
+        self._attr_metas = None
+
+        # columns as read from the packets, and as set since
+        self._read = {}
+        self._columns = {}
+        self._metas = {}
+        self._dirty = []
+
+    def __len__(self):
+        return len(self._packets)
+
+    def _views(self):
+        if self._attributes is None:
+            self._attributes = [p.view_attributes() for p in self._packets]
+        return self._attributes
+
+    def _meta_views(self):
+        if self._attr_metas is None:
+            self._attr_metas = [p.view_metas()[1] for p in self._packets]
+        return self._attr_metas
+
+    def get_field_names(self):
+        """Returns the names of the attributes found in any of the packets.
+
+        @return: the attribute names as a sorted list
+        """
+        names = set()
+        for view in self._views():
+            names.update(view.keys())
+        for field, column in self._columns.iteritems():
+            if any(vals is not None for vals in column):
+                names.add(field)
+            elif field in names:
+                names.discard(field)
+        return sorted(names)
+
+    def get_column(self, field):
+        """Returns the values of an attribute for every packet.
+
+        The value lists must not be modified. Build new lists and pass
+        them to L{set_column} instead.
+
+        @param field: the attribute
+        @type field: string
+        @return: list of value lists (None where the attribute is missing)
+        """
+        column = self._columns.get(field)
+        if column is None:
+            column = [view.get(field) for view in self._views()]
+            self._read[field] = column[:]
+            self._columns[field] = column
+        return column
+
+    def get_meta_column(self, field):
+        """Returns the attribute metadata of an attribute for every packet.
+
+        Metadata set by L{set_column} is returned before it is written.
+
+        @param field: the attribute
+        @type field: string
+        @return: list of read-only dictionaries (None where there is none)
+        """
+        metas = [view.get(field) for view in self._meta_views()]
+        if field in self._columns:
+            pending = self._metas.get(field)
+            for idx, vals in enumerate(self._columns[field]):
+                if vals is None:
+                    metas[idx] = None
+                elif pending is not None and pending[idx] is not None:
+                    metas[idx] = pending[idx]
+        return metas
+
+    def set_column(self, field, values, metas=None):
+        """Sets the values of an attribute for every packet.
+
+        Entries that are the same object as the entry returned by
+        L{get_column} are left alone, a None entry deletes the attribute.
+
+        @param field: the attribute
+        @type field: string
+        @param values: one value list (or None) per packet
+        @type values: list
+        @param metas: one attribute metadata dictionary per packet that
+                      replaces the current metadata, None entries keep it
+        @type metas: list, default None (keep all metadata)
+        """
+        if len(values) != len(self._packets):
+            raise ValueError, 'Column has %d entries for %d packets' % \
+                                            (len(values), len(self._packets))
+
+        if metas is not None and len(metas) != len(self._packets):
+            raise ValueError, 'Metadata has %d entries for %d packets' % \
+                                            (len(metas), len(self._packets))
+
+        self._columns[field] = values
+        if metas is not None:
+            pending = self._metas.get(field)
+            if pending is not None:
+                metas = [p if m is None else m for m, p in zip(metas, pending)]
+            self._metas[field] = metas
+
+        if field not in self._dirty:
+            self._dirty.append(field)
+
+    def delete_column(self, field):
+        """Deletes an attribute from every packet.
+
+        @param field: the attribute
+        @type field: string
+        """
+        self.set_column(field, [None] * len(self._packets))
+
+    def _write(self, idx, packet, columns):
+        """Writes the columns of one packet.
+        """
+        for field, values, metas, read in columns:
+            vals = values[idx]
+            if vals is None:
+                if read is None or read[idx] is not None:
+                    packet.delete(field)
+                continue
+
+            meta = None if metas is None else metas[idx]
+            if read is None or vals is not read[idx] or meta is not None:
+                packet.set_values(field, vals, meta)
+
+    def to_packets(self, errors=None):
+        """Writes the columns that were set back to the packets.
+
+        @keyword errors: if given, the packets that could not be written
+                         are added to it as (packet, exception) pairs and
+                         the others are still written. Otherwise the first
+                         error is raised.
+        @type errors: list
+        @return: the packets in the batch
+        """
+        columns = [(field, self._columns[field], self._metas.get(field),
+                            self._read.get(field)) for field in self._dirty]
+
+        # packets are written one at a time rather than column by column
+        # so each packet is only brought into the cache once
+        for idx, packet in enumerate(self._packets):
+            if errors is None:
+                self._write(idx, packet, columns)
+                continue
+            try:
+                self._write(idx, packet, columns)
+            except Exception as e:
+                errors.append((packet, e))
+
+        self._dirty = []
+        self._read = {}
+        self._columns = {}
+        self._metas = {}
+        self._attributes = None
+        self._attr_metas = None
+        return self._packets
+
+def apply_columns(packets, transform, *args):
+    """Runs a column-wise transform on a list of packets.
+
+    transform(batch, *args) sets the columns of a L{PacketBatch} holding
+    the packets. When it fails on the whole batch, each packet is
+    transformed in a batch of its own so a bad packet only leaves itself
+    unmodified.
+
+    @param packets: the packets to transform
+    @type packets: list
+    @param transform: sets the columns of the batch it is passed
+    @type transform: callable
+    @return: list of (packet, exception) for the packets left unmodified
+    """
+    errors = []
+    try:
+        batch = PacketBatch(packets)
+        transform(batch, *args)
+    except Exception:
+        # the columns are set before any packet is written
+        for packet in packets:
+            try:
+                batch = PacketBatch([packet])
+                transform(batch, *args)
+                batch.to_packets()
+            except Exception as e:
+                errors.append((packet, e))
+    else:
+        batch.to_packets(errors)
+    return errors
+
+class PacketBatchUnitTest(unittest.TestCase):
+    """ Tests the column-wise packet batch """
+
+    packet_class = Packet
+
+    def setUp(self):
+        self.docs = []
+        for i in range(3):
+            doc = self.packet_class()
+            doc.set('a', 'a%d' % i)
+            doc.set_meta('am1', i, 'a')
+            if i != 1:
+                doc.set('b', [i, i + 1], multi=True)
+            self.docs.append(doc)
+        self.expected = [d.deep_clone() for d in self.docs]
+
+    def test_get_column(self):
+        batch = PacketBatch(self.docs)
+        self.assertEqual(len(batch), 3)
+        self.assertEqual(batch.get_column('a'), [['a0'], ['a1'], ['a2']])
+        self.assertEqual(batch.get_column('b'), [[0, 1], None, [2, 3]])
+        self.assertEqual(batch.get_column('c'), [None, None, None])
+        self.assertEqual(batch.get_meta_column('a')[2]['am1'], 2)
+        self.assertEqual(batch.get_field_names(), ['a', 'b'])
+
+        # nothing set, nothing changed
+        self.assertEqual(batch.to_packets(), self.expected)
+
+    def test_set_column(self):
+        batch = PacketBatch(self.docs)
+        column = batch.get_column('a')
+        batch.set_column('a', [vals if i else [v.upper() for v in vals] \
+                                        for i, vals in enumerate(column)])
+        batch.set_column('c', [['x', 'y'], None, ['z']],
+                                [{'multi': True}, None, None])
+        docs = batch.to_packets()
+
+        self.assertEqual(docs[0].get('a'), 'A0')
+        self.assertEqual(docs[0].get_meta('am1', 'a'), 0)
+        self.assertEqual(docs[1].get('a'), 'a1')
+        self.assertEqual(docs[0].get('c'), ['x', 'y'])
+        self.assertEqual(docs[1].has('c'), False)
+        self.assertEqual(docs[2].get('c'), 'z')
+        self.assertRaises(ValueError, batch.set_column, 'c', [None])
+
+    def test_delete_column(self):
+        batch = PacketBatch(self.docs)
+        batch.delete_column('b')
+        self.assertEqual(batch.get_field_names(), ['a'])
+        for doc, expected in zip(batch.to_packets(), self.expected):
+            expected.delete('b')
+            self.assertEqual(doc, expected)
+
+    def test_shared_values(self):
+        # copying a column shares nothing between the attributes
+        batch = PacketBatch(self.docs)
+        batch.set_column('c', batch.get_column('b'),
+                                        batch.get_meta_column('b'))
+        docs = batch.to_packets()
+        docs[0].append('c', 9)
+        self.assertEqual(docs[0].get('b'), [0, 1])
+        self.assertEqual(docs[0].get('c'), [0, 1, 9])
+        self.assertEqual(docs[2].is_multivalued('c'), True)
+
+    def test_pending_metas(self):
+        batch = PacketBatch(self.docs)
+        batch.set_column('c', [['x']] * 3, [{'m': 1}, None, {'m': 3}])
+        batch.set_column('c', [['y']] * 3, [None, {'m': 2}, None])
+        self.assertEqual([m and m['m'] for m in batch.get_meta_column('c')],
+                                                                    [1, 2, 3])
+        batch.delete_column('b')
+        self.assertEqual(batch.get_meta_column('b'), [None] * 3)
+        docs = batch.to_packets()
+        self.assertEqual([d.get_meta('m', 'c') for d in docs], [1, 2, 3])
+
+    def test_apply_columns(self):
+        def upper(batch):
+            batch.set_column('a', [[v.upper() for v in vals] \
+                                    for vals in batch.get_column('a')])
+        self.docs[1].set('a', 1)
+        errors = apply_columns(self.docs, upper)
+        self.assertEqual([d for d, e in errors], [self.docs[1]])
+        self.assertEqual([d.get('a') for d in self.docs], ['A0', 1, 'A2'])
+
+class CompactPacketBatchUnitTest(PacketBatchUnitTest):
+    """Runs the L{PacketBatch} unit tests against L{CompactPacket}"""
+
+    packet_class = CompactPacket
+
+def suite():
+    """Returns the L{PacketBatch} unit tests"""
+    loader = unittest.TestLoader()
+    return unittest.TestSuite([
+                loader.loadTestsFromTestCase(PacketBatchUnitTest),
+                loader.loadTestsFromTestCase(CompactPacketBatchUnitTest)])
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
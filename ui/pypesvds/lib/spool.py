@@ -0,0 +1,283 @@
+"""Provides spool files used to hand large payloads to the workflow.
+
+Large uploads are written once to a spool file and the packet carries
+a L{SpoolHandle} in their place. Only the handle is pickled when the
+packet is sent to a worker process. Components map the file into
+memory and read the bytes in place rather than receiving a copy.
+
+A handle owns the file and removes it once the packet holding it is
+gone. Pickling the handle hands the file over to the copy received
+by the worker, so a payload that is never sent (a rejected or failed
+request) does not leave its file behind either.
+"""
+
+import os
+import mmap
+import logging
+import tempfile
+import unittest
+import cStringIO
+
+from pypesvds.lib.packet import LazyValue
+
+LOG = logging.getLogger(__name__)
+
+# payloads at least this size (in bytes) are spooled by default
+DEFAULT_THRESHOLD = 1048576
+
+class SpoolMap(mmap.mmap):
+    """A read only memory map of a spool file.
+
+    Behaves like a file (read, seek, tell) as well as a string
+    (slicing, len). Unlike a plain map read() with no size reads
+    to the end so it can be handed to parsers expecting a file.
+    """
+
+    def read(self, size=-1):
+        if size < 0:
+            size = len(self) - self.tell()
+        return mmap.mmap.read(self, size)
+
+class SpoolHandle(LazyValue):
+    """Refers to a payload written to a spool file.
+
+    A handle is a L{LazyValue} so packets read the payload on first use.
+    """
+
+    def __init__(self, path, size, owner=False):
+        """Constructor
+
+        @param path: the spool file holding the payload
+        @type path: string
+        @param size: the size of the payload in bytes
+        @type size: int
+        @param owner: remove the file once the handle is gone
+        @type owner: boolean
+        """
+        LazyValue.__init__(self, path, 0, size)
+        self.path = path
+        self._owner = owner
+
+    def open(self):
+        """Maps the payload into memory
+
+        @return: L{SpoolMap}
+        """
+        fp = open(self.path, 'rb')
+        try:
+            return SpoolMap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            fp.close()
+
+    def read(self):
+        """Returns a copy of the payload
+
+        @return: string
+        """
+        fp = open(self.path, 'rb')
+        try:
+            return fp.read()
+        finally:
+            fp.close()
+
+    def load(self):
+        return self.read()
+
+    def release(self):
+        """Removes the spool file
+        """
+        self._owner = False
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+    def __len__(self):
+        return self.size
+
+    def __copy__(self):
+        # handles are immutable so copies share the spool file
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __getstate__(self):
+        # whoever receives the pickled handle takes ownership of the file
+        self._owner = False
+        return (self.path, self.size)
+
+    def __setstate__(self, state):
+        self.path, size = state
+        LazyValue.__init__(self, self.path, 0, size)
+        self._owner = True
+
+    def __del__(self):
+        if self._owner:
+            self.release()
+
+    def __repr__(self):
+        return '<SpoolHandle %s (%d bytes)>' % (self.path, self.size)
+
+def spool(data, directory=None):
+    """Writes a payload to a new spool file
+
+    @param data: the payload
+    @type data: string
+    @param directory: where to create the spool file (default system temp dir)
+    @type directory: string
+    @return: L{SpoolHandle}
+    """
+    if directory is not None and not os.path.exists(directory):
+        os.makedirs(directory)
+
+    fd, path = tempfile.mkstemp(prefix='pypes-', suffix='.spool',
+                                dir=directory)
+    try:
+        os.write(fd, data)
+    finally:
+        os.close(fd)
+
+    return SpoolHandle(path, len(data), owner=True)
+
+def is_spooled(value):
+    """Returns True if the value is a L{SpoolHandle}
+
+    @param value: an attribute value
+    @return: boolean
+    """
+    return isinstance(value, SpoolHandle)
+
+def discard(value):
+    """Removes the spool file of a handle that was never sent
+
+    Handles that were sent belong to the worker that received them and
+    are left alone, as are values that are not spooled.
+
+    @param value: an attribute value
+    """
+    if isinstance(value, SpoolHandle) and value._owner:
+        value.release()
+
+def load(value):
+    """Returns the bytes of a spooled or lazy value, other values are
+    returned as is
+
+    @param value: an attribute value
+    @return: string or the original value
+    """
+    if isinstance(value, LazyValue):
+        return value.load()
+    return value
+
+def open_data(value):
+    """Returns the payload of a value as a file like object without copying
+
+    Spooled payloads are mapped into memory, strings are wrapped.
+
+    @param value: an attribute value
+    @return: file like object
+    """
+    if isinstance(value, SpoolHandle):
+        return value.open()
+
+    return cStringIO.StringIO(load(value))
+
+class SpoolUnitTest(unittest.TestCase):
+    """ Tests the spool handles """
+
+    def setUp(self):
+        self.data = 'x' * 1000 + 'end'
+        self.handle = spool(self.data)
+
+    def tearDown(self):
+        self.handle.release()
+
+    def test_open_read(self):
+        self.assertEqual(len(self.handle), len(self.data))
+        self.assertEqual(self.handle.read(), self.data)
+        buf = self.handle.open()
+        self.assertEqual(buf[-3:], 'end')
+        buf.seek(1000)
+        self.assertEqual(buf.read(), 'end')
+        buf.close()
+
+    def test_load(self):
+        self.assertEqual(load(self.handle), self.data)
+        self.assertEqual(load('abc'), 'abc')
+        self.assertEqual(load(None), None)
+        self.assertEqual(load(LazyValue(lambda: 'abc')), 'abc')
+        self.assertEqual(open_data('abc').read(), 'abc')
+        self.assertTrue(is_spooled(self.handle))
+        self.assertFalse(is_spooled('abc'))
+
+    def test_copy(self):
+        import copy
+        self.assertTrue(copy.deepcopy(self.handle) is self.handle)
+        self.assertTrue(copy.copy(self.handle) is self.handle)
+
+    def test_unsent_handle(self):
+        # a handle that is never sent removes its file
+        handle = spool(self.data)
+        path = handle.path
+        del handle
+        self.assertFalse(os.path.exists(path))
+
+        # sent handles are not discarded, unsent ones are
+        import pickle
+        received = pickle.loads(pickle.dumps(self.handle))
+        discard(self.handle)
+        self.assertTrue(os.path.exists(self.handle.path))
+        del received
+        handle = spool(self.data)
+        discard(handle)
+        self.assertFalse(os.path.exists(handle.path))
+
+    def test_rejected_send(self):
+        import time
+        from pypes.component import Component
+        from pypes.pipeline import Dataflow, MemoryBudgetExceeded
+        from pypesvds.lib.packet import Packet
+
+        class Slow(Component):
+            __metatype__ = 'ADAPTER'
+            def __init__(self):
+                Component.__init__(self)
+                self.remove_output('out')
+            def process(self, docs):
+                time.sleep(0.5)
+                return []
+
+        flow = Dataflow({Slow(): {}}, 1, backend='generator',
+                        memory_budget=len(self.data))
+        try:
+            # the first document holds the whole budget while it is slept on
+            flow.send(self.data)
+            handle = spool(self.data)
+            path = handle.path
+            packet = Packet()
+            packet.add('data', handle)
+            del handle
+            self.assertRaises(MemoryBudgetExceeded, flow.send, packet,
+                              block=False)
+        finally:
+            flow.close()
+        del packet
+        self.assertFalse(os.path.exists(path))
+
+    def test_pickle_ownership(self):
+        import pickle
+        received = pickle.loads(pickle.dumps(self.handle))
+        self.assertEqual(received.read(), self.data)
+        self.assertEqual(len(received), len(self.data))
+        # the sender's copy no longer removes the file
+        del self.handle
+        self.assertTrue(os.path.exists(received.path))
+        path = received.path
+        del received
+        self.assertFalse(os.path.exists(path))
+        self.handle = SpoolHandle(path, 0)
+
+if __name__ == '__main__':
+    SUITE = unittest.TestLoader().loadTestsFromTestCase(SpoolUnitTest)
+    unittest.TextTestRunner(verbosity=2).run(SUITE)
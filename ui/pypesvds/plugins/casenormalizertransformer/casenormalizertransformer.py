@@ -2,6 +2,7 @@ import logging
 #import traceback
 
 from pypes.component import Component
+from pypesvds.lib.packetbatch import apply_columns
 
 log = logging.getLogger(__name__)
 
@@ -33,58 +34,41 @@ class CaseNormalizer(Component):
 
         return result
 
-    def run(self):
-        while True:
-
-            # get parameters outside doc loop for better performace
-            try:
-                # get defined operation
-                op = self.get_parameter('operation')
-                if op is None:
-                    raise ValueError, 'Operation not set'
-
-                # get the fields to perform normalization on
-                fields = self.get_parameter('fields')
-                if fields is None:
-                    raise ValueError, 'Fields not set'
-
-                # convert to a list of field names
-                fields = [f.strip() for f in fields.split(',')]
-
-            except Exception as e:
-                log.error('Component Failed: %s' % self.__class__.__name__)
-                log.error('Reason: %s' % str(e))
-
-                # send all docs without processing
-                for d in self.receive_all('in'):
-                    self.send('out', d)
-
-                self.yield_ctrl()
-                continue # so next time we are called we continue at the top
-
-            # loop though each document on input port
-            for doc in self.receive_all('in'):
-                try:
-                    # perform normalization on each field
-                    for field in fields:
-                        fieldval = doc.get(field)
-                        if fieldval is not None:
-                            # if it is multivalued, then perform
-                            # normalization on each value                        
-                            if doc.is_multivalued(field):
-                                doc.set(field, [self._normalize(x, op) \
-                                                for x in fieldval], multi=True)
-                            else:
-                                doc.set(field, self._normalize(fieldval, op))
-                        else:
-                            log.info('Field %s not set, skipping' % field)
-
-                except Exception as e:
-                    log.error('Component Failed: %s' % self.__class__.__name__)
-                    log.error('Reason: %s' % str(e))
-                    #log.error(traceback.print_exc())
-
-                self.send('out', doc)
-            
-            self.yield_ctrl()
-
+    def _normalize_fields(self, batch, fields, op):
+        for field in fields:
+            # every value is normalized, multivalued or not
+            column = batch.get_column(field)
+            batch.set_column(field, [vals if vals is None else \
+                [self._normalize(x, op) for x in vals] for vals in column])
+
+    def process(self, docs):
+        # get parameters outside doc loop for better performace
+        try:
+            # get defined operation
+            op = self.get_parameter('operation')
+            if op is None:
+                raise ValueError, 'Operation not set'
+
+            # get the fields to perform normalization on
+            fields = self.get_parameter('fields')
+            if fields is None:
+                raise ValueError, 'Fields not set'
+
+            # convert to a list of field names
+            fields = [f.strip() for f in fields.split(',')]
+
+        except Exception as e:
+            log.error('Component Failed: %s' % self.__class__.__name__)
+            log.error('Reason: %s' % str(e))
+
+            # send all docs without processing
+            return docs
+
+        # normalize each field of all waiting documents at once, a document
+        # that fails is sent on unmodified
+        for doc, e in apply_columns(docs, self._normalize_fields, fields, op):
+            log.error('Component Failed: %s' % self.__class__.__name__)
+            log.error('Reason: %s' % str(e))
+            #log.error(traceback.print_exc())
+
+        return docs
@@ -0,0 +1,43 @@
+import logging
+#import traceback
+
+from pypes.component import Component
+from pypes.pipeline import publish_result
+
+log = logging.getLogger(__name__)
+
+class Collector(Component):
+    """Returns processed documents to synchronous /data requests.
+
+    Documents carrying a correlationid meta were sent by a client
+    waiting on the result. They are handed back to the studio process
+    which responds with the final document. Other documents are ignored.
+    """
+    __metatype__ = 'PUBLISHER'
+
+    def __init__(self):
+        # initialize parent class
+        Component.__init__(self)
+        self.remove_output('out')
+        log.info('Component Initialized: %s' % self.__class__.__name__)
+
+    def run(self):
+        # Define our components entry point
+        while True:
+
+            # for each document waiting on our input port
+            for doc in self.receive_batch('in'):
+                try:
+                    cid = doc.get_meta('correlationid')
+                    if cid is None:
+                        continue
+
+                    if not publish_result(cid, doc):
+                        log.debug('No results channel for %s' % cid)
+                except Exception as e:
+                    log.error('Component Failed: %s' % self.__class__.__name__)
+                    log.error('Reason: %s' % str(e))
+                    #log.error(traceback.print_exc())
+
+            # yield the CPU, allowing another component to run
+            self.yield_ctrl()
@@ -2,6 +2,7 @@ import logging
 #import traceback
 
 from pypes.component import Component
+from pypesvds.lib.packetbatch import apply_columns
 
 log = logging.getLogger(__name__)
 
@@ -19,88 +20,84 @@ class CopyField(Component):
         # log successful initialization message
         log.info('Component Initialized: %s' % self.__class__.__name__)
 
-    def _copy(self, doc, orig, new, mode):
-        ismulti = doc.is_multivalued(orig)
-        docmeta, attrmeta = doc.get_metas()
-
-        if not doc.has(new) or mode == 'Overwrite':
-            doc.set(new, doc.get(orig), multi=ismulti, keep_meta=False)
-            if orig in attrmeta:
-                for meta in attrmeta[orig]:
-                    doc.set_meta(meta, attrmeta[orig][meta], attr=new)
-
-        else:
-            if mode == 'Append':
-                doc.append(new, doc.get(orig), extend=ismulti)
-                if orig in attrmeta:
-                    for meta in attrmeta[orig]:
-                        try:
-                            old = attrmeta[new][meta]
-                            doc.set_meta(meta, [old, attrmeta[orig][meta]], 
-                                                                    attr=new)
-                        except:
-                            doc.set_meta(meta, attrmeta[orig][meta], attr=new)
-
-            elif mode == 'Abort':
-                log.debug('Aborting copy, %s already exists' % new)
-                
-    def run(self):
-        # Define our components entry point
-        while True:
-
-            # get parameters outside doc loop for better performace
-            try:
-                sources = self.get_parameter('sources')
-                if sources is None:
-                    raise ValueError, 'No source fields set'
-
-                destinations = self.get_parameter('destinations')
-                if destinations is None:
-                    raise ValueError, 'No new field names set'
-
-                mode = self.get_parameter('mode')
-                if mode is None:
-                    raise ValueError, 'No comflict mode defined'
-
-                # split into a list of  field names
-                sources = [s.strip() for s in sources.split(',')]
-                destinations = [d.strip() for d in destinations.split(',')]
-
-                # make sure the list sizes are the same
-                if len(sources) != len(destinations):
-                    raise ValueError, 'There must be the same number of ' \
-                                    'source fields as there are destinations'
-                
-            except Exception as e:
-                log.error('Component Failed: %s' % self.__class__.__name__)
-                log.error('Reason: %s' % str(e))
+    def _copy(self, batch, orig, new, mode):
+        # copies one column to another, following the conflict mode for
+        # the documents that already have the new field
+        sources = batch.get_column(orig)
+        source_metas = batch.get_meta_column(orig)
+        values = list(batch.get_column(new))
+        metas = [None] * len(values)
+        dest_metas = None
+
+        for idx, vals in enumerate(sources):
+            if vals is None:
+                continue
+
+            if values[idx] is None or mode == 'Overwrite':
+                # the new field only keeps the metadata of the source
+                meta = {} if source_metas[idx] is None \
+                                    else source_metas[idx].copy()
+            elif mode == 'Append':
+                if dest_metas is None:
+                    dest_metas = batch.get_meta_column(new)
+                meta = {} if dest_metas[idx] is None else dest_metas[idx].copy()
+                if source_metas[idx] is not None:
+                    for key, value in source_metas[idx].iteritems():
+                        meta[key] = [meta[key], value] if key in meta else value
+                vals = values[idx] + vals
+            else:
+                continue
+
+            values[idx] = vals
+            metas[idx] = meta
+
+        batch.set_column(new, values, metas)
+
+    def _copy_fields(self, batch, sources, destinations, mode):
+        for orig, new in zip(sources, destinations):
+            if orig == new:
+                log.debug('%s == %s, skipping' % (orig, new))
+            else:
+                self._copy(batch, orig, new, mode)
+
+    def process(self, docs):
+        # get parameters outside doc loop for better performace
+        try:
+            sources = self.get_parameter('sources')
+            if sources is None:
+                raise ValueError, 'No source fields set'
+
+            destinations = self.get_parameter('destinations')
+            if destinations is None:
+                raise ValueError, 'No new field names set'
+
+            mode = self.get_parameter('mode')
+            if mode is None:
+                raise ValueError, 'No comflict mode defined'
+
+            # split into a list of  field names
+            sources = [s.strip() for s in sources.split(',')]
+            destinations = [d.strip() for d in destinations.split(',')]
+
+            # make sure the list sizes are the same
+            if len(sources) != len(destinations):
+                raise ValueError, 'There must be the same number of ' \
+                                'source fields as there are destinations'
             
-                # optionally send all docs without processing
-                for d in self.receive_all('in'):
-                    self.send('out', d)
-            
-                self.yield_ctrl()
-                continue # so next time we are called we continue at the top               
-
-            # for each document waiting on our input port
-            for doc in self.receive_all('in'):
-                try:
-                    for orig, new in zip(sources, destinations):
-                        if not doc.has(orig):
-                            log.debug('%s does not exist, skipping' % orig)
-                        elif orig == new:
-                            log.debug('%s == %s, skipping' % (orig, new))
-                        else:
-                            self._copy(doc, orig, new, mode)
-
-                except Exception as e:
-                    log.error('Component Failed: %s' % self.__class__.__name__)
-                    log.error('Reason: %s' % str(e))                    
-                    #log.error(traceback.print_exc())
-
-                # send the document to the next component
-                self.send('out', doc)
-
-            # yield the CPU, allowing another component to run
-            self.yield_ctrl()
-
+        except Exception as e:
+            log.error('Component Failed: %s' % self.__class__.__name__)
+            log.error('Reason: %s' % str(e))
+        
+            # optionally send all docs without processing
+            return docs
+
+        # copy the fields of all waiting documents at once, a document
+        # that fails is sent on unmodified
+        for doc, e in apply_columns(docs, self._copy_fields,
+                                    sources, destinations, mode):
+            log.error('Component Failed: %s' % self.__class__.__name__)
+            log.error('Reason: %s' % str(e))
+            #log.error(traceback.print_exc())
+
+        # send the documents to the next component
+        return docs
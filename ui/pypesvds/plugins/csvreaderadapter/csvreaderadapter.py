@@ -4,16 +4,21 @@ import logging
 #import traceback
 
 from pypes.component import Component
-from pypesvds.lib.packet import Packet
+from pypesvds.lib.packet import Packet, CompactPacket
+from pypesvds.lib import spool
 
 log = logging.getLogger(__name__)
 
 class CSVReader(Component):
     __metatype__ = 'ADAPTER'
+    __mimetypes__ = ('text/csv',)
 
     def __init__(self):
         # initialize parent class
         Component.__init__(self)
+
+        # rows are emitted as memory compact packets by default
+        self.set_parameter('compact_rows', 'True', ['True', 'False'])
         log.info('Component Initialized: %s' % self.__class__.__name__)
 
     def _utf8_encoder(self, data):
@@ -26,10 +31,13 @@ class CSVReader(Component):
         # define our components entry point
         while True:           
 
+            # get parameters outside doc loop for better performace
+            compact = self.get_parameter('compact_rows') != 'False'
+
             # for each document waiting on our input port
             for doc in self.receive_all('in'):
                 try:
-                    data = doc.get('data')
+                    data = doc.get('data', load=False)
                     mime = doc.get_meta('mimetype')
 
                     # if there is no data, move on to the next doc
@@ -41,6 +49,7 @@ class CSVReader(Component):
                         continue
 
                     # adapters should delete the data once it is read
+                    data = spool.load(data)
                     doc.delete('data')
 
                     # convert the data to a file-like object required by 
@@ -52,8 +61,14 @@ class CSVReader(Component):
                     # TODO support for all dialects
                     rows = csv.reader(self._utf8_encoder(content), 
                                                             dialect='excel')
+                    # each row starts as a copy of the remaining attributes
+                    if compact:
+                        template = CompactPacket(doc.get_attributes())
+                    else:
+                        template = doc
+
                     for row in rows:
-                        document = doc.clone(metas=False)
+                        document = template.clone(metas=False)
                         for idx, column in enumerate(row):
                             # column nums start at 1
                             # convert back to unicode string since all
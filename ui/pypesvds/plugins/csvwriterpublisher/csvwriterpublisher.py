@@ -90,7 +90,7 @@ class CSVWriter(Component):
 
             else:     
                 # for each document waiting on our input port
-                for doc in self.receive_all('in'):
+                for doc in self.receive_batch('in'):
                     try:
                         row = []
 
@@ -21,6 +21,8 @@ class FastXML(Component):
         self.set_parameter('output_dir', 'fastxml')
         self.set_parameter('on_exist', 'Abort', ['Abort', 'Overwrite', 
                                                             'NextAvaiable'])
+        # elements are written in no particular order unless sorted
+        self.set_parameter('sort_fields', 'False', ['True', 'False'])
 
         # log successful initialization message
         log.info('Component Initialized: %s' % self.__class__.__name__)
@@ -59,6 +61,8 @@ class FastXML(Component):
                 if onexist is None:
                     raise ValueError, 'On Exist not set'
 
+                sort = self.get_parameter('sort_fields') == 'True'
+
                 # check that the output directory exists and is a directory
                 if not os.path.exists(outdir):
                     os.mkdir(outdir)
@@ -76,16 +80,16 @@ class FastXML(Component):
             # for each document waiting on our input port
             doccnt = 0
             writebuf = []
-            for doc in self.receive_all('in'):
+            for doc in self.receive_batch('in'):
                 doccnt = doccnt + 1
                 try:
                     writebuf.append('\t<document>')
-                    for key, vals in doc:
-                        sep = ';'
 
-                        # get a document level separator
-                        if doc.has_meta('separator'):
-                            sep = doc.get_meta('separator')
+                    # get a document level separator
+                    docsep = doc.get_meta('separator', default=';')
+
+                    for key, vals in doc.iteritems(sort=sort):
+                        sep = docsep
 
                         # get a field level separator that overwrite a
                         # document level separator
@@ -3,11 +3,13 @@ import logging
 
 from pypes.component import Component
 from pypesvds.lib.extras.BeautifulSoup import BeautifulSoup
+from pypesvds.lib import spool
 
 log = logging.getLogger(__name__)
 
 class HTML(Component):
     __metatype__ = 'ADAPTER'
+    __mimetypes__ = ('text/html',)
 
     def __init__(self):
         # initialize parent class
@@ -43,7 +45,7 @@ class HTML(Component):
             # for each document waiting on our input port
             for doc in self.receive_all('in'):
                 try:
-                    data = doc.get('data')
+                    data = doc.get('data', load=False)
                     mime = doc.get_meta('mimetype')
 
                     # if there is no data, move on to the next doc
@@ -54,6 +56,8 @@ class HTML(Component):
                     if mime != 'text/html':
                         continue
 
+                    data = spool.load(data)
+
                     # use BeautifulSoup to parse the html
                     html = BeautifulSoup(data)
                     doc.set('title', u''.join(html.title.contents))
@@ -3,11 +3,13 @@ import logging
 
 from pypes.component import Component
 from pypesvds.lib.extras.pdfparser import PDFConverter
+from pypesvds.lib import spool
 
 log = logging.getLogger(__name__)
 
 class PDFReader(Component):
     __metatype__ = 'ADAPTER'
+    __mimetypes__ = ('application/pdf',)
 
     def __init__(self):
         # initialize parent class
@@ -25,7 +27,7 @@ class PDFReader(Component):
             # for each document waiting on our input port
             for doc in self.receive_all('in'):
                 try:
-                    data = doc.get('data')
+                    data = doc.get('data', load=False)
                     mime = doc.get_meta('mimetype')
 
                     # if there is no data, move on to the next doc
@@ -36,8 +38,12 @@ class PDFReader(Component):
                     if mime != 'application/pdf':
                         continue
 
-                    # do the conversion
+                    # do the conversion, spooled data is read in place
                     # if it fails the converter will return an empty string
+                    if spool.is_spooled(data):
+                        data = data.open()
+                    else:
+                        data = spool.load(data)
                     body = self._converter.convert(data)
                     if body:
                         # write out the body as unicode string
@@ -2,6 +2,7 @@ import logging
 #import traceback
 
 from pypes.component import Component
+from pypesvds.lib.packetbatch import apply_columns
 
 log = logging.getLogger(__name__)
 
@@ -19,91 +20,87 @@ class RenameField(Component):
         # log successful initialization message
         log.info('Component Initialized: %s' % self.__class__.__name__)
 
-    def _rename(self, doc, orig, new, mode):
-        ismulti = doc.is_multivalued(orig)
-        docmeta, attrmeta = doc.get_metas()
-
-        if not doc.has(new) or mode == 'Overwrite':
-            doc.set(new, doc.get(orig), multi=ismulti, keep_meta=False)
-            if orig in attrmeta:
-                for meta in attrmeta[orig]:
-                    doc.set_meta(meta, attrmeta[orig][meta], attr=new)
-
-            doc.delete(orig)
-        else:
-            if mode == 'Append':
-                doc.append(new, doc.get(orig), extend=ismulti)
-                if orig in attrmeta:
-                    for meta in attrmeta[orig]:
-                        try:
-                            old = attrmeta[new][meta]
-                            doc.set_meta(meta, [old, attrmeta[orig][meta]], 
-                                                                    attr=new)
-                        except:
-                            doc.set_meta(meta, attrmeta[orig][meta], attr=new)
-
-                doc.delete(orig)
-
-            elif mode == 'Abort':
-                log.debug('Aborting rename, %s already exists' % new)
-                
-    def run(self):
-        # Define our components entry point
-        while True:
-
-            # get parameters outside doc loop for better performace
-            try:
-                originals = self.get_parameter('original_names')
-                if originals is None:
-                    raise ValueError, 'No source fields set'
-
-                newnames = self.get_parameter('new_names')
-                if newnames is None:
-                    raise ValueError, 'No new field names set'
-
-                mode = self.get_parameter('mode')
-                if mode is None:
-                    raise ValueError, 'No comflict mode defined'
-
-                # split into a list of  field names
-                originals = [o.strip() for o in originals.split(',')]
-                newnames = [n.strip() for n in newnames.split(',')]
-
-                # make sure the list sizes are the same
-                if len(originals) != len(newnames):
-                    raise ValueError, 'There must be the same number of ' \
-                                    'original fields as there are new fields'
-                
-            except Exception as e:
-                log.error('Component Failed: %s' % self.__class__.__name__)
-                log.error('Reason: %s' % str(e))
+    def _rename(self, batch, orig, new, mode):
+        # moves one column to another, following the conflict mode for
+        # the documents that already have the new field
+        sources = batch.get_column(orig)
+        source_metas = batch.get_meta_column(orig)
+        values = list(batch.get_column(new))
+        metas = [None] * len(values)
+        dest_metas = None
+        moved = list(sources)
+
+        for idx, vals in enumerate(sources):
+            if vals is None:
+                continue
+
+            if values[idx] is None or mode == 'Overwrite':
+                # the new field only keeps the metadata of the source
+                meta = {} if source_metas[idx] is None \
+                                    else source_metas[idx].copy()
+            elif mode == 'Append':
+                if dest_metas is None:
+                    dest_metas = batch.get_meta_column(new)
+                meta = {} if dest_metas[idx] is None else dest_metas[idx].copy()
+                if source_metas[idx] is not None:
+                    for key, value in source_metas[idx].iteritems():
+                        meta[key] = [meta[key], value] if key in meta else value
+                vals = values[idx] + vals
+            else:
+                continue
+
+            values[idx] = vals
+            metas[idx] = meta
+            moved[idx] = None
+
+        batch.set_column(new, values, metas)
+        batch.set_column(orig, moved)
+
+    def _rename_fields(self, batch, originals, newnames, mode):
+        for orig, new in zip(originals, newnames):
+            if orig == new:
+                log.debug('%s == %s, skipping' % (orig, new))
+            else:
+                self._rename(batch, orig, new, mode)
+
+    def process(self, docs):
+        # get parameters outside doc loop for better performace
+        try:
+            originals = self.get_parameter('original_names')
+            if originals is None:
+                raise ValueError, 'No source fields set'
+
+            newnames = self.get_parameter('new_names')
+            if newnames is None:
+                raise ValueError, 'No new field names set'
+
+            mode = self.get_parameter('mode')
+            if mode is None:
+                raise ValueError, 'No comflict mode defined'
+
+            # split into a list of  field names
+            originals = [o.strip() for o in originals.split(',')]
+            newnames = [n.strip() for n in newnames.split(',')]
+
+            # make sure the list sizes are the same
+            if len(originals) != len(newnames):
+                raise ValueError, 'There must be the same number of ' \
+                                'original fields as there are new fields'
             
-                # optionally send all docs without processing
-                for d in self.receive_all('in'):
-                    self.send('out', d)
-            
-                self.yield_ctrl()
-                continue # so next time we are called we continue at the top               
-
-            # for each document waiting on our input port
-            for doc in self.receive_all('in'):
-                try:
-                    for orig, new in zip(originals, newnames):
-                        if not doc.has(orig):
-                            log.debug('%s does not exist, skipping' % orig)
-                        elif orig == new:
-                            log.debug('%s == %s, skipping' % (orig, new))
-                        else:
-                            self._rename(doc, orig, new, mode)
-
-                except Exception as e:
-                    log.error('Component Failed: %s' % self.__class__.__name__)
-                    log.error('Reason: %s' % str(e))                    
-                    #log.error(traceback.print_exc())
-
-                # send the document to the next component
-                self.send('out', doc)
-
-            # yield the CPU, allowing another component to run
-            self.yield_ctrl()
-
+        except Exception as e:
+            log.error('Component Failed: %s' % self.__class__.__name__)
+            log.error('Reason: %s' % str(e))
+        
+            # optionally send all docs without processing
+            return docs
+
+        # rename the fields of all waiting documents at once, a document
+        # that fails is sent on unmodified
+        for doc, e in apply_columns(docs, self._rename_fields,
+                                    originals, newnames, mode):
+            log.error('Component Failed: %s' % self.__class__.__name__)
+            log.error('Reason: %s' % str(e))
+            #log.error(traceback.print_exc())
+
+        # send the documents to the next component
+        return docs
@@ -3,11 +3,13 @@ import logging
 
 from pypes.component import Component
 from pypesvds.lib.extras import feedparser
+from pypesvds.lib import spool
 
 log = logging.getLogger(__name__)
 
 class RSS(Component):
     __metatype__ = 'ADAPTER'
+    __mimetypes__ = ('application/xml',)
 
     def __init__(self):
         # initialize parent class
@@ -21,7 +23,7 @@ class RSS(Component):
             # for each document waiting on our input port
             for doc in self.receive_all('in'):
                 try:
-                    data = doc.get('data')
+                    data = doc.get('data', load=False)
                     mime = doc.get_meta('mimetype')
 
                     # if there is no data, move on to the next doc
@@ -33,6 +35,7 @@ class RSS(Component):
                         continue
 
                     # adapters should delete the data
+                    data = spool.load(data)
                     doc.delete('data')
 
                     parsedfeed = feedparser.parse(data)
@@ -2,6 +2,7 @@ import logging
 #import traceback
 
 from pypes.component import Component
+from pypesvds.lib.packetbatch import apply_columns
 
 log = logging.getLogger(__name__)
 
@@ -18,46 +19,43 @@ class SetField(Component):
         # log successful initialization message
         log.info('Component Initialized: %s' % self.__class__.__name__)
 
-    def run(self):
-        # Define our components entry point
-        while True:
-
-            # get parameters outside doc loop for better performace
-            try:
-                field = self.get_parameter('field')
-                if field is None:
-                    raise ValueError, 'Field not defined'
-
-                values = self.get_parameter('values')
-                if values is None:
-                    raise ValueError, 'Values not set'
-
-                # create a list of values
-                values = [v for v in values.split(';') if v]
-
-            except Exception as e:
-                log.error('Component Failed: %s' % self.__class__.__name__)
-                log.error('Reason: %s' % str(e))
-            
-                # optionally send all docs without processing
-                for d in self.receive_all('in'):
-                    self.send('out', d)
-            
-                self.yield_ctrl()
-                continue # so next time we are called we continue at the top               
-
-            # for each document waiting on our input port
-            for doc in self.receive_all('in'):
-                try:
-                    doc.set(field, values, multi=True)
-                except Exception as e:
-                    log.error('Component Failed: %s' % self.__class__.__name__)
-                    log.error('Reason: %s' % str(e))                    
-                    #log.error(traceback.print_exc())
-
-                # send the document to the next component
-                self.send('out', doc)
-
-            # yield the CPU, allowing another component to run
-            self.yield_ctrl()
-
+    def _set(self, batch, field, values):
+        # the field becomes multivalued, other metadata is kept
+        metas = []
+        for meta in batch.get_meta_column(field):
+            meta = {} if meta is None else meta.copy()
+            meta['multi'] = True
+            metas.append(meta)
+
+        batch.set_column(field, [values] * len(batch), metas)
+
+    def process(self, docs):
+        # get parameters outside doc loop for better performace
+        try:
+            field = self.get_parameter('field')
+            if field is None:
+                raise ValueError, 'Field not defined'
+
+            values = self.get_parameter('values')
+            if values is None:
+                raise ValueError, 'Values not set'
+
+            # create a list of values
+            values = [v for v in values.split(';') if v]
+
+        except Exception as e:
+            log.error('Component Failed: %s' % self.__class__.__name__)
+            log.error('Reason: %s' % str(e))
+        
+            # optionally send all docs without processing
+            return docs
+
+        # set the field on all waiting documents at once, a document
+        # that fails is sent on unmodified
+        for doc, e in apply_columns(docs, self._set, field, values):
+            log.error('Component Failed: %s' % self.__class__.__name__)
+            log.error('Reason: %s' % str(e))
+            #log.error(traceback.print_exc())
+
+        # send the documents to the next component
+        return docs
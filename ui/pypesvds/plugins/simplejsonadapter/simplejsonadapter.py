@@ -2,12 +2,15 @@ import logging
 import traceback
 import json
 from pypesvds.lib.packet import Packet
+from pypesvds.lib import spool
 from pypes.component import Component
 
 log = logging.getLogger(__name__)
 
 class SimpleJSON(Component):
     __metatype__ = 'ADAPTER'
+    # documents without a mimetype (GET and DELETE requests) pass through
+    __mimetypes__ = ('application/json', None)
 
     def __init__(self):
         Component.__init__(self)
@@ -32,7 +35,7 @@ class SimpleJSON(Component):
 
             for doc in self.receive_all('in'):
                 try:
-                    data = doc.get('data')
+                    data = doc.get('data', load=False)
                     mime = doc.get_meta('mimetype')
 
                     if data is not None:
@@ -46,7 +49,7 @@ class SimpleJSON(Component):
                                 doc.delete('data')
 
                             try:
-                                doc.merge(Packet(json.loads(data)), metas=True)
+                                doc.merge(Packet(json.loads(spool.load(data))), metas=True)
                             except:
                                 log.error('Unable to convert data')
                                 log.error(traceback.print_exc())
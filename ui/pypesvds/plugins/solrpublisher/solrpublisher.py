@@ -136,7 +136,7 @@ class Solr(Component):
             # for each document waiting on our input port
             cnt = 0
             writebuf = []
-            for doc in self.receive_all('in'):
+            for doc in self.receive_batch('in'):
                 cnt = cnt + 1
                 try:
                     # check for a document boost
@@ -147,7 +147,8 @@ class Solr(Component):
 
                     writebuf.append('<doc%s>' % ( \
                                 ' boost="%s">' % boost if boost > 1 else ''))
-                    for key, vals in doc:
+                    # solr does not care about the order of the fields
+                    for key, vals in doc.iteritems():
                         # see if we need to do a field boost
                         try:
                             fboost = float(doc.get_meta('boost', attr=key))
@@ -4,11 +4,13 @@ import xml.etree.cElementTree as ET
 
 from pypes.component import Component
 from pypesvds.lib.packet import Packet
+from pypesvds.lib import spool
 
 log = logging.getLogger(__name__)
 
 class SolrXML(Component):
     __metatype__ = 'ADAPTER'
+    __mimetypes__ = ('application/xml',)
 
     def __init__(self):
         # initialize parent class
@@ -22,7 +24,7 @@ class SolrXML(Component):
             # for each document waiting on our input port
             for doc in self.receive_all('in'):
                 try:
-                    data = doc.get('data')
+                    data = doc.get('data', load=False)
                     mime = doc.get_meta('mimetype')
 
                     # if there is no data, move on to the next doc
@@ -33,6 +35,8 @@ class SolrXML(Component):
                     if mime != 'application/xml':
                         continue
 
+                    data = spool.load(data)
+
                     # solr xml starts with an add tag, if this does not start
                     # with an add tag, move to the next doc
                     xml = ET.XML(data)
@@ -2,11 +2,13 @@ import logging
 #import traceback
 
 from pypes.component import Component
+from pypesvds.lib import spool
 
 log = logging.getLogger(__name__)
 
 class TextReader(Component):
     __metatype__ = 'ADAPTER'
+    __mimetypes__ = ('text/plain',)
 
     def __init__(self):
         # initialize parent class
@@ -20,7 +22,7 @@ class TextReader(Component):
             # for each document waiting on our input port
             for doc in self.receive_all('in'):
                 try:
-                    data = doc.get('data')
+                    data = doc.get('data', load=False)
                     mime = doc.get_meta('mimetype')
 
                     # if there is no data, move on to the next doc
@@ -32,7 +34,7 @@ class TextReader(Component):
                         continue
 
                     # move data to text field and delete data
-                    doc.set('text', data.decode('utf-8'))
+                    doc.set('text', spool.load(data).decode('utf-8'))
                     doc.delete('data')
 
                 except Exception as e:
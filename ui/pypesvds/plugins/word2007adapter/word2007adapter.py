@@ -1,15 +1,16 @@
 import zipfile
 import logging
 #import traceback
-import cStringIO
 from xml.dom.minidom import parseString
 
 from pypes.component import Component
+from pypesvds.lib import spool
 
 log = logging.getLogger(__name__)
 
 class Word2007(Component):
     __metatype__ = 'ADAPTER'
+    __mimetypes__ = ('application/msword',)
 
     def __init__(self):
         # initialize parent class
@@ -17,8 +18,8 @@ class Word2007(Component):
         log.info('Component Initialized: %s' % self.__class__.__name__)
 
     def _unzip(self, zipdata):
-        buf = cStringIO.StringIO()
-        buf.write(zipdata)
+        # spooled data is mapped rather than copied into a buffer
+        buf = spool.open_data(zipdata)
         unzipped = zipfile.ZipFile(buf)
         try:
             xml = unzipped.read('word/document.xml')
@@ -74,7 +75,7 @@ class Word2007(Component):
             # for each document waiting on our input port
             for doc in self.receive_all('in'):
                 try:
-                    data = doc.get('data')
+                    data = doc.get('data', load=False)
                     mime = doc.get_meta('mimetype')
                     fname = doc.get_meta('url', default='unknown')
 
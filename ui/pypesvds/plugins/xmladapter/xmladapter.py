@@ -7,12 +7,14 @@ import xml.etree.cElementTree as ET
 
 from pypes.component import Component
 from pypesvds.lib.packet import Packet
+from pypesvds.lib import spool
 from pypesvds.lib.extras.elementfilter import findall
 
 log = logging.getLogger(__name__)
 
 class XML(Component):
     __metatype__ = 'ADAPTER'
+    __mimetypes__ = ('application/xml',)
 
     def __init__(self):
         # initialize parent class
@@ -70,7 +72,7 @@ class XML(Component):
         self._mappings = mappings
 
     def _do_mapping(self, doc):
-        data = doc.get('data', '')
+        data = spool.load(doc.get('data', ''))
         xml = ET.XML(data)
         doc.delete('data')
 
@@ -1,4 +1,10 @@
+import json
+import base64
+
+from pylons import config
+
 from pypesvds.tests import *
+from pypesvds.lib.packet import Packet
 
 class TestDataController(TestController):
 
@@ -41,3 +47,22 @@ class TestDataController(TestController):
 
     def test_edit_as_xml(self):
         response = self.app.get(url('formatted_edit_text', id=1, format='xml'))
+
+    def test_create_sync_binary(self):
+        # the processed document still holds the raw bytes that were sent
+        returned = Packet()
+        returned.add('data', '\xff\xfe')
+        dfg = config['pylons.app_globals'].dfg
+        dfg.send_sync = lambda doc, timeout=None: {'status': 'success',
+                                                   'packet': returned}
+        try:
+            response = self.app.post(url('create', sync='true'),
+                        params='\xff\xfe',
+                        headers={'Content-Type': 'application/octet-stream'})
+        finally:
+            del dfg.send_sync
+        assert response.status_int == 200
+        assert response.content_type == 'application/json'
+        body = json.loads(response.body)
+        assert body['attributes']['data'] == \
+                                [{'base64': base64.b64encode('\xff\xfe')}]
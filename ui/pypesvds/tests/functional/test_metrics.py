@@ -0,0 +1,8 @@
+from pypesvds.tests import *
+
+class TestMetricsController(TestController):
+
+    def test_index(self):
+        response = self.app.get(url('metrics'))
+        # Test response...
+        assert response.content_type == 'application/json'